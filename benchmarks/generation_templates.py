@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Microbenchmark of precompiled control action templates
+against the former per-action formatting and serialization
+and of generation on a process pool"""
+
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from importer import Importer  # noqa: E402
+
+from synthetic import generate_structure_file  # noqa: E402
+
+
+def legacy_generate(importer, loxone_structure_file):
+    """Former generation loop which formats and serializes every action URL"""
+    ha_bridge_devices_configuration = []
+    loxone_url_schema = (
+        "http://{username}:{password}@{host}:{port}/dev/sps/io/{control}/{action}"
+    )
+    loxone_controls = importer.get_loxone_controls(loxone_structure_file)
+    loxone_rooms = importer.get_loxone_rooms(loxone_structure_file)
+    loxone_categories = importer.get_loxone_categories(loxone_structure_file)
+
+    for uuid, control in sorted(loxone_controls.items()):
+        control_type = control.get("type")
+        room_uuid = control.get("room", "00000000-0000-0000-0000000000000000")
+        category_uuid = control.get("cat", "00000000-0000-0000-0000000000000000")
+        ha_bridge_device = {
+            "name": "{control_name} {room_name}".format(
+                control_name=control.get("name"),
+                room_name=loxone_rooms[room_uuid]["name"],
+            ).strip(),
+            "description": "Control-Type: {control_type}, Category: {category}".format(
+                control_type=control_type,
+                category=loxone_categories[category_uuid]["name"],
+            ),
+            "targetDevice": "Loxone",
+            "deviceType": "custom",
+            "mapType": "httpDevice",
+            "mapId": uuid,
+        }
+        actions = importer.control_actions_map.get(control_type)
+        if actions is None:
+            continue
+        for action, key in (("on", "onUrl"), ("dim", "dimUrl"), ("off", "offUrl")):
+            if action not in actions:
+                continue
+            item = OrderedDict()
+            item["item"] = loxone_url_schema.format(
+                username=importer.loxone_username,
+                password=importer.loxone_password,
+                host=importer.loxone_miniserver_host,
+                port=importer.loxone_miniserver_port,
+                control=uuid,
+                action=actions[action],
+            )
+            item["type"] = "httpDevice"
+            item["httpVerb"] = "GET"
+            item["contentType"] = "text/html"
+            ha_bridge_device[key] = json.dumps([item])
+        ha_bridge_devices_configuration.append(ha_bridge_device)
+
+    return ha_bridge_devices_configuration
+
+
+def measure(function, loxone_structure_file):
+    """Returns result and wall time of a generation run"""
+    loxone_structure_file = json.loads(json.dumps(loxone_structure_file))
+    start = time.perf_counter()
+    result = function(loxone_structure_file)
+    return result, time.perf_counter() - start
+
+
+@click.command()
+@click.option(
+    "--controls",
+    type=click.IntRange(min=1),
+    default=100000,
+    help="Set number of synthetic controls (Default: 100000)",
+)
+@click.option(
+    "--processes",
+    type=click.IntRange(min=2),
+    help="Also generate devices on a pool of this many processes",
+)
+def cli(controls, processes):
+    """Compares legacy and precompiled device generation"""
+    importer = Importer()
+    importer.loxone_miniserver_host = "192.168.1.2"
+    importer.loxone_miniserver_port = 80
+    importer.loxone_username = "player1"
+    importer.loxone_password = "secret"
+    loxone_structure_file = generate_structure_file(controls)
+
+    legacy, legacy_time = measure(
+        lambda f: legacy_generate(importer, f), loxone_structure_file
+    )
+    compiled, compiled_time = measure(
+        importer.generate_ha_bridge_devices_configuration, loxone_structure_file
+    )
+    if legacy != compiled:
+        raise click.ClickException("Precompiled output differs from legacy output")
+
+    click.echo("Controls:    {controls}".format(controls=controls))
+    click.echo("Devices:     {devices}".format(devices=len(compiled)))
+    click.echo("Legacy:      {time:.3f}s".format(time=legacy_time))
+    click.echo("Precompiled: {time:.3f}s".format(time=compiled_time))
+    click.echo(
+        "Speedup:     {speedup:.2f}x".format(speedup=legacy_time / compiled_time)
+    )
+
+    if processes:
+        importer.generation_processes = processes
+        sharded, sharded_time = measure(
+            importer.generate_ha_bridge_devices_configuration, loxone_structure_file
+        )
+        if sharded != compiled:
+            raise click.ClickException("Process pool output differs from serial output")
+        click.echo(
+            "{processes} processes: {time:.3f}s ({speedup:.2f}x serial)".format(
+                processes=processes,
+                time=sharded_time,
+                speedup=compiled_time / sharded_time,
+            )
+        )
+
+
+if __name__ == "__main__":
+    cli()
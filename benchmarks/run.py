@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Reports wall time and peak memory of the importer phases
+against synthetic structure files and a local HA-Bridge stand-in"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from importer import Importer  # noqa: E402
+
+from synthetic import SIZES, write_structure_file  # noqa: E402
+from stub_server import serve  # noqa: E402
+
+
+def measure(function, trace_memory):
+    """Returns result, wall time and peak traced memory of a function call"""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_benchmark(structure_file, options):
+    """Runs fetch, generation and upload against a fresh stub server"""
+    with serve(structure_file, options["latency"]) as server:
+        importer = Importer()
+        importer.loxone_miniserver_host = "127.0.0.1"
+        importer.loxone_miniserver_port = server.port
+        importer.loxone_username = "benchmark"
+        importer.loxone_password = "benchmark"
+        importer.ha_bridge_host = "127.0.0.1"
+        importer.ha_bridge_port = server.port
+        importer.request_timeout = 60
+        importer.ha_bridge_concurrency = options["concurrency"]
+        importer.ha_bridge_batch_size = options["batch_size"]
+
+        results = []
+        if options["stream"]:
+            fetch = importer.get_loxone_structure_file_stream
+        else:
+            fetch = importer.get_loxone_structure_file
+        loxone_structure_file, elapsed, peak = measure(fetch, options["memory"])
+        results.append(("fetch", elapsed, peak))
+
+        devices, elapsed, peak = measure(
+            lambda: importer.generate_ha_bridge_devices_configuration(
+                loxone_structure_file
+            ),
+            options["memory"],
+        )
+        results.append(("generate", elapsed, peak))
+        if options["stream"]:
+            loxone_structure_file.close()
+
+        _, elapsed, peak = measure(
+            lambda: importer.add_devices_into_ha_bridge(devices), options["memory"]
+        )
+        results.append(("upload", elapsed, peak))
+        if len(server.devices) != len(devices):
+            raise click.ClickException("HA-Bridge stand-in is missing devices")
+
+    return len(devices), server.requests, results
+
+
+def format_memory(peak):
+    """Formats traced memory in MiB"""
+    if peak is None:
+        return "-"
+    return "{size:.1f} MiB".format(size=peak / 1024.0 / 1024.0)
+
+
+@click.command()
+@click.option(
+    "--controls",
+    type=click.IntRange(min=1),
+    multiple=True,
+    default=SIZES,
+    help="Set number of controls, may be given multiple times (Default: 1000, 10000, 100000)",
+)
+@click.option(
+    "--latency",
+    type=float,
+    default=0,
+    help="Set latency in seconds of the HA-Bridge stand-in (Default: 0)",
+)
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Set number of concurrent requests to HA-Bridge (Default: 1)",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Set number of devices per request (Default: 1)",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Read the structure file incrementally",
+)
+@click.option(
+    "--memory/--no-memory",
+    default=True,
+    help="Trace peak memory, which slows down all phases (Default: memory)",
+)
+def cli(**options):
+    """Benchmarks fetch, generation and upload of synthetic structure files"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for controls in options["controls"]:
+            structure_file = write_structure_file(
+                os.path.join(tmp_dir, "LoxAPP3_{count}.json".format(count=controls)),
+                controls,
+            )
+            devices, requests, results = run_benchmark(structure_file, options)
+            click.echo(
+                "{controls} controls, {devices} devices, {requests} requests".format(
+                    controls=controls, devices=devices, requests=requests
+                )
+            )
+            for phase, elapsed, peak in results:
+                click.echo(
+                    "  {phase:<10} {elapsed:>9.3f}s {memory:>12}".format(
+                        phase=phase, elapsed=elapsed, memory=format_memory(peak)
+                    )
+                )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Reports cold start time of the importer with python -X importtime
+and the wall time of short-lived commands"""
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+COMMANDS = (
+    ("-m importer --help", ["-m", "importer", "--help"]),
+    ("importer.py --help", [os.path.join(ROOT_DIR, "importer.py"), "--help"]),
+)
+
+
+def parse_import_times(output):
+    """Returns cumulative microseconds of importer in total
+    and of the modules imported directly by importer"""
+    modules = {}
+    for line in output.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match is None:
+            continue
+        cumulative, indent, name = int(match.group(2)), match.group(3), match.group(4)
+        # Modules are reported after the modules they import
+        if not indent:
+            if name == "importer":
+                return cumulative, modules
+            modules = {}
+        elif len(indent) == 2:
+            modules[name] = cumulative
+    raise ValueError("importer was not imported")
+
+
+def measure_import(runs):
+    """Imports the importer in fresh interpreters and returns the median
+    total import time and the median time of each direct import"""
+    totals = []
+    modules = {}
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import importer"],
+            cwd=ROOT_DIR,
+            stderr=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+        ).stderr
+        total, run_modules = parse_import_times(output)
+        totals.append(total)
+        for name, cumulative in run_modules.items():
+            modules.setdefault(name, []).append(cumulative)
+    return statistics.median(totals), {
+        name: statistics.median(times)
+        for name, times in modules.items()
+        if len(times) == runs
+    }
+
+
+def measure_command(arguments, runs):
+    """Returns the median wall time of a command in fresh interpreters"""
+    elapsed = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + arguments,
+            cwd=ROOT_DIR,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        elapsed.append(time.perf_counter() - start)
+    return statistics.median(elapsed)
+
+
+@click.command()
+@click.option(
+    "--runs",
+    type=click.IntRange(min=1),
+    default=10,
+    help="Set number of interpreters started per measurement (Default: 10)",
+)
+@click.option(
+    "--top",
+    type=click.IntRange(min=0),
+    default=10,
+    help="Set number of slowest direct imports to list (Default: 10)",
+)
+@click.option(
+    "--max-import-ms",
+    type=float,
+    help="Fail if importing importer takes longer in milliseconds",
+)
+def cli(runs, top, max_import_ms):
+    """Benchmarks cold start of the importer"""
+    # Write bytecode once, so the measurements do not include compilation
+    subprocess.run(
+        [sys.executable, "-m", "compileall", "-q", "importer.py"],
+        cwd=ROOT_DIR,
+        check=True,
+    )
+
+    total, modules = measure_import(runs)
+    click.echo(
+        "{name:<24} {total:>9.1f}ms".format(
+            name="import importer", total=total / 1000.0
+        )
+    )
+    for name, cumulative in sorted(modules.items(), key=lambda m: -m[1])[:top]:
+        click.echo(
+            "  {name:<24} {cumulative:>9.1f}ms".format(
+                name=name, cumulative=cumulative / 1000.0
+            )
+        )
+    for name, arguments in COMMANDS:
+        click.echo(
+            "{name:<24} {elapsed:>9.1f}ms".format(
+                name=name, elapsed=measure_command(arguments, runs) * 1000.0
+            )
+        )
+
+    if max_import_ms is not None and total / 1000.0 > max_import_ms:
+        raise click.ClickException(
+            "Import took {total:.1f}ms, more than {limit:.1f}ms".format(
+                total=total / 1000.0, limit=max_import_ms
+            )
+        )
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Local HTTP stand-in for the HA-Bridge devices REST API
+and the structure file endpoints of a Loxone MiniServer"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded HTTP server which keeps HA-Bridge devices in memory"""
+
+    daemon_threads = True
+
+    def __init__(self, address, structure_file=None, latency=0):
+        """Constructor"""
+        super(StubServer, self).__init__(address, StubRequestHandler)
+        self.structure_file = structure_file
+        self.latency = latency
+        self.devices = {}
+        self.next_id = 1
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        """Returns the port the server listens on"""
+        return self.server_address[1]
+
+    def add_devices(self, devices):
+        """Stores devices and returns them with their new IDs"""
+        with self.lock:
+            for device in devices:
+                device["id"] = str(self.next_id)
+                self.next_id += 1
+                self.devices[device["id"]] = device
+        return devices
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Handles HA-Bridge and MiniServer requests with a configurable latency"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data).encode("utf-8"))
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length))
+
+    def begin(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_GET(self):
+        self.begin()
+        if self.path == "/api/devices":
+            with self.server.lock:
+                devices = list(self.server.devices.values())
+            self.send_json(200, devices)
+        elif self.path == "/data/LoxAPP3.json" and self.server.structure_file:
+            with open(self.server.structure_file, "rb") as f:
+                self.send_body(200, f.read())
+        elif self.path == "/jdev/sps/LoxAPPversion3" and self.server.structure_file:
+            # Editing the structure file changes its version like on a MiniServer
+            modified = os.path.getmtime(self.server.structure_file)
+            self.send_json(
+                200,
+                {
+                    "LL": {
+                        "control": "dev/sps/LoxAPPversion3",
+                        "value": time.strftime(
+                            "%Y-%m-%d %H:%M:%S", time.localtime(modified)
+                        ),
+                        "Code": "200",
+                    }
+                },
+            )
+        elif self.path.startswith("/jdev/sps/io/") and self.server.structure_file:
+            uuid = self.path[len("/jdev/sps/io/") :]
+            self.send_json(
+                200,
+                {"LL": {"control": "dev/sps/io/" + uuid, "value": "0", "Code": "200"}},
+            )
+        else:
+            self.send_json(404, {"message": "not found"})
+
+    def do_POST(self):
+        self.begin()
+        if self.path != "/api/devices":
+            self.send_json(404, {"message": "not found"})
+            return
+        payload = self.read_json()
+        devices = payload if isinstance(payload, list) else [payload]
+        self.send_json(201, self.server.add_devices(devices))
+
+    def do_PUT(self):
+        self.begin()
+        device = self.read_json()
+        device_id = self.path.rsplit("/", 1)[-1]
+        with self.server.lock:
+            self.server.devices[device_id] = device
+        self.send_json(200, device)
+
+    def do_DELETE(self):
+        self.begin()
+        device_id = self.path.rsplit("/", 1)[-1]
+        with self.server.lock:
+            self.server.devices.pop(device_id, None)
+        self.send_json(200, {})
+
+
+@contextlib.contextmanager
+def serve(structure_file=None, latency=0, host="127.0.0.1", port=0):
+    """Runs a stub server in a background thread"""
+    server = StubServer((host, port), structure_file, latency)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@click.command()
+@click.option(
+    "--port",
+    type=int,
+    default=8080,
+    help="Set port to listen on (Default: 8080)",
+)
+@click.option(
+    "--structure-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Serve a structure file like a Loxone MiniServer",
+)
+@click.option(
+    "--latency",
+    type=float,
+    default=0,
+    help="Set latency in seconds added to every request (Default: 0)",
+)
+def cli(port, structure_file, latency):
+    """Runs a local HA-Bridge stand-in until interrupted"""
+    server = StubServer(("127.0.0.1", port), structure_file, latency)
+    click.echo("Listening on http://127.0.0.1:{port}".format(port=server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    cli()
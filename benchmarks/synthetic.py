@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Generator of synthetic Loxone visualisation structure files"""
+
+import json
+import os
+import random
+import sys
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from importer import Importer  # noqa: E402
+
+SIZES = (1000, 10000, 100000)
+
+
+def generate_structure_file(controls, rooms=50, categories=20, seed=0):
+    """Generates a structure file with controls spread across all control types
+    of the default control actions map"""
+    rng = random.Random(seed)
+    control_types = sorted(Importer().control_actions_map)
+
+    loxone_rooms = {}
+    for index in range(rooms):
+        uuid = "{index:08x}-0000-0001-ffff000000000000".format(index=index)
+        loxone_rooms[uuid] = {
+            "uuid": uuid,
+            "name": "Room {index}".format(index=index),
+            "image": "00000000-0000-0002-2000000000000000.svg",
+            "defaultRating": 0,
+            "isFavorite": False,
+            "type": 0,
+        }
+
+    loxone_categories = {}
+    for index in range(categories):
+        uuid = "{index:08x}-0000-0002-ffff000000000000".format(index=index)
+        loxone_categories[uuid] = {
+            "uuid": uuid,
+            "name": "Category {index}".format(index=index),
+            "image": "00000000-0000-0021-2000000000000000.svg",
+            "defaultRating": 0,
+            "isFavorite": False,
+            "type": "undefined",
+            "color": "#69C350",
+        }
+
+    room_uuids = sorted(loxone_rooms)
+    category_uuids = sorted(loxone_categories)
+    loxone_controls = {}
+    for index in range(controls):
+        uuid = "{index:08x}-{random:04x}-0003-ffff000000000000".format(
+            index=index, random=rng.randrange(0x10000)
+        )
+        control_type = control_types[index % len(control_types)]
+        loxone_controls[uuid] = {
+            "name": "{control_type} {index}".format(
+                control_type=control_type, index=index
+            ),
+            "type": control_type,
+            "uuidAction": uuid,
+            "room": rng.choice(room_uuids),
+            "cat": rng.choice(category_uuids),
+            "defaultRating": 0,
+            "isFavorite": False,
+            "isSecured": False,
+            "states": {
+                "active": "{index:08x}-0000-0004-ffff000000000000".format(index=index)
+            },
+        }
+
+    return {
+        "lastModified": "2018-01-01 15:30:45",
+        "msInfo": {
+            "serialNr": "000000000000",
+            "msName": "Synthetic MiniServer",
+            "projectName": "Synthetic {controls}".format(controls=controls),
+        },
+        "rooms": loxone_rooms,
+        "cats": loxone_categories,
+        "controls": loxone_controls,
+    }
+
+
+def write_structure_file(path, controls, seed=0):
+    """Writes a synthetic structure file and returns its path"""
+    with open(path, "w") as f:
+        json.dump(generate_structure_file(controls, seed=seed), f)
+    return path
+
+
+@click.command()
+@click.option(
+    "--output-dir",
+    type=click.Path(file_okay=False),
+    default=".",
+    help="Set directory to write structure files into (Default: .)",
+)
+@click.option(
+    "--controls",
+    type=click.IntRange(min=1),
+    multiple=True,
+    default=SIZES,
+    help="Set number of controls, may be given multiple times (Default: 1000, 10000, 100000)",
+)
+def cli(output_dir, controls):
+    """Writes synthetic LoxAPP3.json files"""
+    os.makedirs(output_dir, exist_ok=True)
+    for count in controls:
+        path = write_structure_file(
+            os.path.join(output_dir, "LoxAPP3_{count}.json".format(count=count)),
+            count,
+        )
+        click.echo("{path}: {size} bytes".format(path=path, size=os.path.getsize(path)))
+
+
+if __name__ == "__main__":
+    cli()
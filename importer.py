@@ -4,12 +4,1076 @@
 """Commandline interface
 to control Importer class"""
 
-import json
+import base64
+import contextlib
+import copy
+import fnmatch
+import gzip
+import importlib
 import logging
-from collections import OrderedDict
+import math
+import os
+import queue
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from itertools import chain, count, islice
+from urllib.parse import urlsplit
 
 import click
-import requests
+
+
+class LazyModule(types.ModuleType):
+    """Placeholder for a module which is imported on first attribute access,
+    so commands which never use it do not pay for importing it"""
+
+    def __getattr__(self, name):
+        module = importlib.import_module(self.__name__)
+        # Keep attributes which were replaced, e.g. by mock.patch
+        for key, value in module.__dict__.items():
+            self.__dict__.setdefault(key, value)
+        return getattr(module, name)
+
+
+asyncio = LazyModule("asyncio")
+hashlib = LazyModule("hashlib")
+json = LazyModule("json")
+requests = LazyModule("requests")
+
+
+class UploadError(Exception):
+    """Raised when one or more devices could not be added into HA-Bridge"""
+
+    def __init__(self, errors):
+        """Constructor"""
+        self.errors = errors
+        super(UploadError, self).__init__(
+            "{count} device(s) could not be processed by HA-Bridge".format(
+                count=len(errors)
+            )
+        )
+
+
+SyncPlan = namedtuple("SyncPlan", ["create", "update", "delete", "unchanged"])
+DeviceChanges = namedtuple(
+    "DeviceChanges", ["added", "changed", "removed", "unchanged"]
+)
+GenerationContext = namedtuple(
+    "GenerationContext",
+    [
+        "map_id_prefix",
+        "room_names",
+        "category_names",
+        "templates",
+        "templates_digests",
+    ],
+)
+VerificationReport = namedtuple("VerificationReport", ["verified", "failures"])
+
+RETRYABLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+# Responses which tell that the server did not process the request
+UNPROCESSED_STATUS_CODES = frozenset([429, 503])
+
+
+def get_retryable_request_errors():
+    """Returns exceptions of requests which may not occur again on retry"""
+    return (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+
+
+def get_connect_request_errors():
+    """Returns exceptions of requests and urllib3 which are raised
+    before a request reached the server"""
+    import urllib3
+
+    return (requests.exceptions.ConnectTimeout, urllib3.exceptions.ConnectTimeoutError)
+
+
+def get_async_request_errors():
+    """Returns exceptions of aiohttp requests which the async engine handles"""
+    import aiohttp
+
+    return (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+def get_error_status(error):
+    """Returns the HTTP status of a failed request or None"""
+    status = getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+def is_retryable_error(error, retryable_errors):
+    """Checks if a failed request may succeed when it is sent again,
+    which is the case for timeouts, connection errors and server errors"""
+    status = get_error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    return isinstance(error, retryable_errors)
+
+
+def is_unprocessed_error(error, connect_errors):
+    """Checks if a failed request was certainly not processed by the server,
+    so that even a request which creates something may be sent again.
+    This is the case for connect errors and 429 and 503 responses."""
+    status = get_error_status(error)
+    if status is not None:
+        return status in UNPROCESSED_STATUS_CODES
+    # requests wraps the urllib3 error of a refused connection
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, connect_errors) or isinstance(reason, connect_errors)
+
+
+def is_rejected_error(error):
+    """Checks if the server answered a request with a client error,
+    so it did not store anything of it"""
+    status = get_error_status(error)
+    return (
+        status is not None
+        and 400 <= status < 500
+        and status not in UNPROCESSED_STATUS_CODES
+    )
+
+
+def backoff_delay(attempt, base, cap):
+    """Returns a randomised delay before retry number `attempt`,
+    which grows exponentially from `base` up to `cap` seconds (full jitter)"""
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class AdaptiveConcurrency(object):
+    """AIMD controller for the number of concurrent HA-Bridge requests.
+    The limit doubles every round trip until the first congestion signal
+    and then grows by one per round trip while responses are fast.
+    It is halved on server errors, timeouts or responses slower than
+    the latency target, at most once per round trip."""
+
+    def __init__(self, maximum, latency_target, initial=1, minimum=1):
+        """Constructor"""
+        self.maximum = maximum
+        self.minimum = minimum
+        self.latency_target = latency_target
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.slow_start = True
+        self.decreased_at = float("-inf")
+        self.lock = threading.Lock()
+
+    def current(self):
+        """Returns the number of requests which may be in flight"""
+        return int(self.limit)
+
+    def record(self, started, latency, congested=False):
+        """Adjusts the limit with the outcome of a request
+        which was sent at `started` (time.perf_counter)"""
+        with self.lock:
+            if congested or latency > self.latency_target:
+                # Requests sent before the last decrease saw the same congestion
+                if started < self.decreased_at:
+                    return
+                self.slow_start = False
+                self.limit = max(self.minimum, self.limit / 2)
+                self.decreased_at = time.perf_counter()
+            elif self.slow_start:
+                self.limit = min(self.maximum, self.limit + 1)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+
+class RateLimiter(object):
+    """Spaces calls of wait() from any number of threads
+    evenly to at most `rate` calls per second"""
+
+    def __init__(self, rate):
+        """Constructor"""
+        self.interval = 1.0 / rate
+        self.next_call = float("-inf")
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the next call is allowed"""
+        with self.lock:
+            now = time.monotonic()
+            scheduled = max(now, self.next_call)
+            self.next_call = scheduled + self.interval
+        # Sleep outside of the lock, other threads reserve the following slots
+        if scheduled > now:
+            time.sleep(scheduled - now)
+
+
+class Statistics(object):
+    """Records wall time per phase as well as latency
+    and transferred bytes per HTTP call"""
+
+    def __init__(self):
+        """Constructor"""
+        self.phases = OrderedDict()
+        self.requests = OrderedDict()
+        self.device_changes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add_phase(self, name, elapsed):
+        """Adds wall time to a phase"""
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Measures wall time of the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def timed(self, name, items):
+        """Yields from an iterable and adds the time spent producing items
+        to a phase, which excludes the time consumers spend on them"""
+        elapsed = 0
+        items = iter(items)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            self.add_phase(name, elapsed)
+
+    def record_request(self, method, url, status, latency, bytes_sent, bytes_received):
+        """Records a finished HTTP call"""
+        path = urlsplit(url).path
+        path = re.sub(r"^/api/devices/[^/]+$", "/api/devices/{id}", path)
+        path = re.sub(r"^/jdev/sps/io/[^/]+", "/jdev/sps/io/{uuid}", path)
+        name = "{method} {path}".format(method=method, path=path)
+        with self.lock:
+            request = self.requests.setdefault(
+                name,
+                {"latencies": [], "errors": 0, "bytes_sent": 0, "bytes_received": 0},
+            )
+            request["latencies"].append(latency)
+            request["bytes_sent"] += bytes_sent
+            request["bytes_received"] += bytes_received
+            if status >= 400:
+                request["errors"] += 1
+
+    def record_response(self, r, *args, **kwargs):
+        """Response hook for requests which records the finished call"""
+        body = r.request.body or b""
+        if kwargs.get("stream"):
+            bytes_received = int(r.headers.get("Content-Length", 0))
+        else:
+            bytes_received = len(r.content)
+        self.record_request(
+            r.request.method,
+            r.request.url,
+            r.status_code,
+            r.elapsed.total_seconds(),
+            len(body),
+            bytes_received,
+        )
+
+    def record_device_changes(self, source, device_changes):
+        """Records the device changes of a structure file since the previous run,
+        replacing earlier changes of the same source"""
+        with self.lock:
+            self.device_changes[source] = device_changes
+
+    def get_device_changes(self):
+        """Returns recorded device changes of all sources combined
+        or None if no changes were recorded"""
+        with self.lock:
+            if not self.device_changes:
+                return None
+            added = []
+            changed = []
+            removed = []
+            unchanged = 0
+            for device_changes in self.device_changes.values():
+                added.extend(device_changes.added)
+                changed.extend(device_changes.changed)
+                removed.extend(device_changes.removed)
+                unchanged += device_changes.unchanged
+        return DeviceChanges(added, changed, removed, unchanged)
+
+    def percentile(self, latencies, percent):
+        """Returns the nearest-rank percentile of sorted latencies"""
+        index = int(math.ceil(percent / 100.0 * len(latencies))) - 1
+        return latencies[min(max(index, 0), len(latencies) - 1)]
+
+    def to_dict(self):
+        """Returns phase timings and request statistics"""
+        requests_statistics = OrderedDict()
+        with self.lock:
+            phases = OrderedDict(self.phases)
+            for name, request in self.requests.items():
+                latencies = sorted(request["latencies"])
+                requests_statistics[name] = OrderedDict(
+                    [
+                        ("count", len(latencies)),
+                        ("errors", request["errors"]),
+                        ("bytes_sent", request["bytes_sent"]),
+                        ("bytes_received", request["bytes_received"]),
+                        (
+                            "latency",
+                            OrderedDict(
+                                [
+                                    ("mean", sum(latencies) / len(latencies)),
+                                    ("p50", self.percentile(latencies, 50)),
+                                    ("p95", self.percentile(latencies, 95)),
+                                    ("p99", self.percentile(latencies, 99)),
+                                    ("max", latencies[-1]),
+                                ]
+                            ),
+                        ),
+                    ]
+                )
+
+        statistics = OrderedDict(
+            [
+                ("phases", phases),
+                ("requests", requests_statistics),
+                (
+                    "bytes_sent",
+                    sum(r["bytes_sent"] for r in requests_statistics.values()),
+                ),
+                (
+                    "bytes_received",
+                    sum(r["bytes_received"] for r in requests_statistics.values()),
+                ),
+            ]
+        )
+        device_changes = self.get_device_changes()
+        if device_changes is not None:
+            statistics["device_changes"] = device_changes._asdict()
+        return statistics
+
+    def write_json(self, path):
+        """Writes statistics as JSON file"""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+@contextlib.contextmanager
+def profiled(output=None, limit=25):
+    """Profiles the enclosed block with cProfile and tracemalloc
+    and writes the hottest functions and allocations to output.
+    Threads started in the block, like the producer and the request
+    workers, are profiled as well and merged into the results."""
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    output = output or sys.stderr
+    profiler = cProfile.Profile()
+    thread_profilers = []
+
+    def profile_thread(frame, event, arg):
+        # Before Python 3.12 a profiler only sees the thread enabling it,
+        # so every new thread enables its own profiler on its first event
+        thread_profiler = cProfile.Profile()
+        thread_profilers.append(thread_profiler)
+        thread_profiler.enable()
+
+    if sys.version_info < (3, 12):
+        threading.setprofile(profile_thread)
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        threading.setprofile(None)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = pstats.Stats(profiler, stream=output)
+        for thread_profiler in thread_profilers:
+            stats.add(thread_profiler)
+        stats.sort_stats("cumulative").print_stats(limit)
+        output.write(
+            "Peak traced memory: {peak:.1f} MiB\n".format(peak=peak / 1024.0 / 1024.0)
+        )
+        for statistic in snapshot.statistics("lineno")[:limit]:
+            output.write("{statistic}\n".format(statistic=statistic))
+
+
+def iter_chunks(items, size):
+    """Splits an iterable lazily into lists of at most `size` items"""
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_bounded(function, items, concurrency=1, limiter=None):
+    """Calls function for every item with at most `concurrency` calls in flight
+    and yields (index, item, result, error) tuples in completion order.
+    With a limiter, the number of calls in flight follows limiter.current()
+    up to `concurrency`. Items are consumed lazily, so the iterable
+    may be a generator."""
+    if concurrency <= 1:
+        for index, item in enumerate(items):
+            try:
+                yield index, item, function(item), None
+            except Exception as error:
+                yield index, item, None, error
+        return
+
+    def bound():
+        if limiter is None:
+            return concurrency
+        return min(concurrency, limiter.current())
+
+    items = enumerate(items)
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        while True:
+            while len(pending) < bound():
+                entry = next(items, None)
+                if entry is None:
+                    break
+                pending[executor.submit(function, entry[1])] = entry
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, item = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    yield index, item, future.result(), None
+                else:
+                    yield index, item, None, error
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def iter_ordered(executor, function, items, prefetch):
+    """Submits function for every item to an executor with at most `prefetch`
+    calls pending and yields the results in item order"""
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_prefetched(items, maxsize):
+    """Consumes an iterable in a background thread and yields its items
+    through a bounded queue, so producing items overlaps with consuming them"""
+    buffer = queue.Queue(maxsize)
+    stop = threading.Event()
+    end = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except Exception as error:
+            put((end, error))
+        else:
+            put((end, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def load_miniservers_configuration(path):
+    """Loads and validates the list of Loxone MiniServers from a JSON file"""
+    with open(path) as f:
+        configuration = json.load(f)
+
+    if not isinstance(configuration, dict) or not isinstance(
+        configuration.get("miniservers"), list
+    ):
+        raise ValueError('Configuration must contain a "miniservers" list')
+
+    miniservers = []
+    names = set()
+    for index, miniserver in enumerate(configuration["miniservers"]):
+        if not isinstance(miniserver, dict):
+            raise ValueError(
+                "MiniServer #{index} must be an object".format(index=index)
+            )
+        for key in ("host", "username", "password"):
+            if not miniserver.get(key):
+                raise ValueError(
+                    'MiniServer #{index} is missing "{key}"'.format(
+                        index=index, key=key
+                    )
+                )
+        miniserver = dict(miniserver)
+        miniserver.setdefault("name", miniserver["host"])
+        miniserver.setdefault("port", 80)
+        if miniserver["name"] in names:
+            raise ValueError(
+                'MiniServer name "{name}" is not unique'.format(name=miniserver["name"])
+            )
+        names.add(miniserver["name"])
+        miniservers.append(miniserver)
+
+    return miniservers
+
+
+def unquote_yaml_boolean(value):
+    """Turns booleans read from unquoted YAML keys on and off back into strings"""
+    if value is True:
+        return "on"
+    if value is False:
+        return "off"
+    return value
+
+
+def load_control_actions_map(path):
+    """Loads and validates a control actions map from a JSON or YAML file"""
+    with open(path, "rb") as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is required to read YAML files")
+            try:
+                control_actions_map = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError("Invalid YAML: {error}".format(error=e))
+            # YAML 1.1 reads unquoted on and off as booleans. Only the action
+            # keys are turned back, commands like yes or true must be quoted.
+            if isinstance(control_actions_map, dict):
+                for control_type, actions in control_actions_map.items():
+                    if isinstance(actions, dict):
+                        control_actions_map[control_type] = {
+                            unquote_yaml_boolean(action): command
+                            for action, command in actions.items()
+                        }
+        else:
+            control_actions_map = json.load(f)
+
+    if not isinstance(control_actions_map, dict):
+        raise ValueError("Control actions map must map control types to actions")
+
+    for control_type, actions in control_actions_map.items():
+        if actions is None:
+            continue
+        if not isinstance(actions, dict):
+            raise ValueError(
+                'Actions of control type "{control_type}" must be an object '
+                "or null".format(control_type=control_type)
+            )
+        unknown_actions = sorted(set(actions) - {"on", "dim", "off"})
+        if unknown_actions:
+            raise ValueError(
+                'Control type "{control_type}" has unknown action "{action}"'.format(
+                    control_type=control_type, action=unknown_actions[0]
+                )
+            )
+        for action in ("on", "off"):
+            if action not in actions:
+                raise ValueError(
+                    'Control type "{control_type}" is missing action "{action}"'.format(
+                        control_type=control_type, action=action
+                    )
+                )
+        for action, command in actions.items():
+            if not isinstance(command, str) or not command or "\0" in command:
+                raise ValueError(
+                    'Action "{action}" of control type "{control_type}" must be '
+                    "a non-empty string".format(
+                        action=action, control_type=control_type
+                    )
+                )
+
+    return control_actions_map
+
+
+def open_ha_bridge_devices_file(path, mode):
+    """Opens a HA-Bridge devices file, which is gzip compressed
+    if its name ends with .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def export_ha_bridge_devices(ha_bridge_devices_configuration, path):
+    """Streams devices into a file in HA-Bridge device.db format
+    and returns the number of written devices"""
+    count = 0
+    with open_ha_bridge_devices_file(path, "wb") as f:
+        f.write(b"[")
+        for count, device_configuration in enumerate(
+            ha_bridge_devices_configuration, 1
+        ):
+            device = OrderedDict([("id", str(count))])
+            device.update(device_configuration)
+            if count > 1:
+                f.write(b",")
+            f.write(b"\n")
+            f.write(json.dumps(device).encode("utf-8"))
+        f.write(b"\n]\n")
+    return count
+
+
+def read_ha_bridge_devices(path, chunk_size=65536):
+    """Reads devices incrementally from a file in HA-Bridge device.db format
+    and yields them without their HA-Bridge ID"""
+    with open_ha_bridge_devices_file(path, "rb") as f:
+        scanner = JsonSpanScanner(f, chunk_size)
+        for _ in scanner.iter_array():
+            device = scanner.read_value()
+            device.pop("id", None)
+            yield device
+
+
+def generate_ha_bridge_devices(generation_context, controls):
+    """Generates (mapId, hash, device) triples for (uuid, type, name, room,
+    category) tuples of controls. The hash is None unless changes are tracked."""
+    map_id_prefix = generation_context.map_id_prefix
+    room_names = generation_context.room_names
+    category_names = generation_context.category_names
+    compiled_control_actions_map = generation_context.templates
+    templates_digests = generation_context.templates_digests
+    encode_basestring_ascii = json.encoder.encode_basestring_ascii
+    sha1 = hashlib.sha1
+
+    for uuid, control_type, control_name, room_uuid, category_uuid in controls:
+        room_name = room_names[room_uuid]
+        category_name = category_names[category_uuid]
+        map_id = map_id_prefix + uuid
+
+        device_name = "{control_name} {room_name}".format(
+            control_name=control_name, room_name=room_name
+        )
+        device_name = device_name.strip()
+        device_description = (
+            "Control-Type: {control_type}, Category: {category}".format(
+                control_type=control_type,
+                category=category_name,
+            )
+        )
+        ha_bridge_device = {
+            "name": device_name,
+            "description": device_description,
+            "targetDevice": "Loxone",
+            "deviceType": "custom",
+            "mapType": "httpDevice",
+            "mapId": map_id,
+        }
+
+        escaped_uuid = encode_basestring_ascii(uuid)[1:-1]
+        for key, before, after in compiled_control_actions_map[control_type]:
+            ha_bridge_device[key] = before + escaped_uuid + after
+
+        device_hash = None
+        if templates_digests is not None:
+            # Name, description and the mapId with the templates define the device
+            device_hash = sha1(
+                "\0".join(
+                    (
+                        templates_digests[control_type],
+                        map_id,
+                        device_name,
+                        device_description,
+                    )
+                ).encode("utf-8")
+            ).hexdigest()
+
+        yield map_id, device_hash, ha_bridge_device
+
+
+# Generation context of a worker process, set once by init_generation_worker
+_generation_context = None
+
+
+def init_generation_worker(generation_context):
+    """Stores the generation context shared by all shards of a worker process"""
+    global _generation_context
+    _generation_context = generation_context
+
+
+def generate_ha_bridge_devices_shard(controls):
+    """Generates the devices of a shard of controls in a worker process"""
+    return list(generate_ha_bridge_devices(_generation_context, controls))
+
+
+class ImportJournal(object):
+    """Append-only JSON lines journal of the devices added into HA-Bridge,
+    which lets an interrupted import resume without creating duplicates"""
+
+    def __init__(self, path, resume=False, flush_size=100):
+        """Constructor"""
+        self.path = path
+        self.flush_size = flush_size
+        self.devices = self.load() if resume else {}
+        if not resume and os.path.isfile(path) and os.path.getsize(path):
+            logging.warning(
+                "Journal {path} of an earlier import is overwritten".format(path=path)
+            )
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.file = open(path, "ab" if resume else "wb")
+        if resume and self.file.tell():
+            # Terminate a line torn by an interrupted write
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write(b"\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, map_id):
+        return map_id in self.devices
+
+    def __len__(self):
+        return len(self.devices)
+
+    def load(self):
+        """Reads mapIds and HA-Bridge IDs of previously added devices"""
+        devices = {}
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return devices
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                devices[entry["mapId"]] = entry.get("id")
+        return devices
+
+    def record(self, map_id, device_id):
+        """Records an added device and writes the journal
+        once `flush_size` devices have been recorded"""
+        with self.lock:
+            self.devices[map_id] = device_id
+            self.buffer.append(json.dumps({"mapId": map_id, "id": device_id}))
+            if len(self.buffer) >= self.flush_size:
+                self.write_buffer()
+
+    def write_buffer(self):
+        """Appends recorded devices to the journal file"""
+        if self.buffer:
+            self.file.write(("\n".join(self.buffer) + "\n").encode("utf-8"))
+            self.file.flush()
+            self.buffer = []
+
+    def close(self):
+        """Writes remaining recorded devices and closes the journal file"""
+        with self.lock:
+            if not self.file.closed:
+                self.write_buffer()
+                self.file.close()
+
+    def remove(self):
+        """Closes and deletes the journal after a complete import"""
+        self.close()
+        os.remove(self.path)
+
+
+def fetch_loxone_structure_files(importers, stream=False):
+    """Retrieves visualisation structure files of all importers concurrently
+    and returns them in the order of the importers"""
+
+    def fetch(importer):
+        if stream:
+            return importer.get_loxone_structure_file_stream()
+        return importer.get_loxone_structure_file()
+
+    loxone_structure_files = [None] * len(importers)
+    errors = []
+    for index, _, loxone_structure_file, error in iter_bounded(
+        fetch, importers, len(importers)
+    ):
+        if error is not None:
+            errors.append((index, error))
+        else:
+            loxone_structure_files[index] = loxone_structure_file
+
+    if errors:
+        if stream:
+            for loxone_structure_file in loxone_structure_files:
+                if loxone_structure_file is not None:
+                    loxone_structure_file.close()
+        raise min(errors, key=lambda e: e[0])[1]
+
+    return loxone_structure_files
+
+
+class JsonSpanScanner(object):
+    """Incremental scanner over a binary JSON file which locates values
+    by their byte offsets without decoding them"""
+
+    WHITESPACE = re.compile(rb"\s*")
+    STRING_END = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+    STRUCTURE = re.compile(rb'["{}\[\]]')
+    SCALAR = re.compile(rb"[^\s,:\]}]+")
+
+    def __init__(self, fileobj, chunk_size=65536):
+        """Constructor"""
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.buffer = b""
+        self.position = 0
+        self.offset = 0
+        self.mark = None
+
+    def fill(self):
+        """Drops consumed bytes and reads the next chunk into the buffer.
+        Bytes after a mark set by read_value are kept"""
+        chunk = self.fileobj.read(self.chunk_size)
+        if not chunk:
+            return False
+        keep = self.position if self.mark is None else self.mark - self.offset
+        self.offset += keep
+        self.buffer = self.buffer[keep:] + chunk
+        self.position -= keep
+        return True
+
+    def tell(self):
+        """Returns the absolute byte offset of the scanner"""
+        return self.offset + self.position
+
+    def peek(self):
+        """Skips whitespace and returns the next byte"""
+        while True:
+            self.position = self.WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position : self.position + 1]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def skip_string(self):
+        """Skips the string starting at the current position"""
+        while True:
+            match = self.STRING_END.match(self.buffer, self.position + 1)
+            if match is not None:
+                self.position = match.end()
+                return
+            if not self.fill():
+                raise ValueError("Unterminated string in JSON document")
+
+    def skip_value(self):
+        """Skips the next value and returns its (start, end) byte offsets"""
+        char = self.peek()
+        start = self.tell()
+        if char == b'"':
+            self.skip_string()
+        elif char in (b"{", b"["):
+            depth = 0
+            while True:
+                match = self.STRUCTURE.search(self.buffer, self.position)
+                if match is None:
+                    self.position = len(self.buffer)
+                    if not self.fill():
+                        raise ValueError("Unexpected end of JSON document")
+                    continue
+                self.position = match.start()
+                token = match.group()
+                if token == b'"':
+                    self.skip_string()
+                    continue
+                self.position = match.end()
+                depth += 1 if token in (b"{", b"[") else -1
+                if depth == 0:
+                    break
+        else:
+            while True:
+                match = self.SCALAR.match(self.buffer, self.position)
+                if match is None:
+                    raise ValueError(
+                        "Unexpected character at offset {offset}".format(
+                            offset=self.tell()
+                        )
+                    )
+                if match.end() < len(self.buffer) or not self.fill():
+                    self.position = match.end()
+                    break
+        return start, self.tell()
+
+    def read_value(self):
+        """Decodes the next value"""
+        self.peek()
+        self.mark = self.tell()
+        try:
+            start, end = self.skip_value()
+            return json.loads(self.buffer[start - self.offset : end - self.offset])
+        finally:
+            self.mark = None
+
+    def iter_array(self):
+        """Yields the index of each item of the next array. Each item must be
+        consumed with read_value or skip_value before the next is requested"""
+        if self.peek() != b"[":
+            raise ValueError(
+                "Expected array at offset {offset}".format(offset=self.tell())
+            )
+        self.position += 1
+        if self.peek() == b"]":
+            self.position += 1
+            return
+
+        index = 0
+        while True:
+            yield index
+            index += 1
+
+            char = self.peek()
+            self.position += 1
+            if char == b"]":
+                return
+            if char != b",":
+                raise ValueError(
+                    "Expected comma at offset {offset}".format(offset=self.tell())
+                )
+
+    def iter_object(self):
+        """Yields the keys of the next object. Each value must be consumed
+        with skip_value or iter_object before the next key is requested"""
+        if self.peek() != b"{":
+            raise ValueError(
+                "Expected object at offset {offset}".format(offset=self.tell())
+            )
+        self.position += 1
+        if self.peek() == b"}":
+            self.position += 1
+            return
+
+        while True:
+            if self.peek() != b'"':
+                raise ValueError(
+                    "Expected key at offset {offset}".format(offset=self.tell())
+                )
+            start = self.tell()
+            self.skip_string()
+            key = json.loads(self.buffer[start - self.offset : self.position])
+            if self.peek() != b":":
+                raise ValueError(
+                    "Expected colon at offset {offset}".format(offset=self.tell())
+                )
+            self.position += 1
+            yield key
+
+            char = self.peek()
+            self.position += 1
+            if char == b"}":
+                return
+            if char != b",":
+                raise ValueError(
+                    "Expected comma at offset {offset}".format(offset=self.tell())
+                )
+
+
+class LoxoneStructureFileStream(object):
+    """Visualisation structure file read incrementally from a local file.
+    Top-level sections are decoded on access and controls are decoded
+    one at a time in UUID order, so only a single control is held in memory"""
+
+    def __init__(self, fileobj, chunk_size=65536):
+        """Constructor"""
+        self.fileobj = fileobj
+        self.spans = {}
+        self.control_spans = []
+
+        scanner = JsonSpanScanner(fileobj, chunk_size)
+        for key in scanner.iter_object():
+            if key == "controls":
+                for uuid in scanner.iter_object():
+                    self.control_spans.append((uuid, scanner.skip_value()))
+            else:
+                self.spans[key] = scanner.skip_value()
+        self.control_spans.sort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Closes the underlying file"""
+        self.fileobj.close()
+
+    def read(self, span):
+        """Decodes the value stored at the given byte offsets"""
+        start, end = span
+        self.fileobj.seek(start)
+        return json.loads(self.fileobj.read(end - start))
+
+    def get(self, key, default=None):
+        """Returns a decoded top-level section of the structure file"""
+        if key == "controls":
+            return LoxoneControlsStream(self)
+        if key not in self.spans:
+            return default
+        return self.read(self.spans[key])
+
+
+class LoxoneControlsStream(object):
+    """Lazy mapping of control UUIDs to controls
+    backed by a LoxoneStructureFileStream"""
+
+    def __init__(self, structure_file_stream):
+        """Constructor"""
+        self.structure_file_stream = structure_file_stream
+
+    def __len__(self):
+        return len(self.structure_file_stream.control_spans)
+
+    def __iter__(self):
+        for uuid, _ in self.structure_file_stream.control_spans:
+            yield uuid
+
+    def items(self):
+        """Yields (uuid, control) pairs sorted by UUID"""
+        for uuid, span in self.structure_file_stream.control_spans:
+            yield uuid, self.structure_file_stream.read(span)
 
 
 class Importer(object):
@@ -24,8 +1088,38 @@ class Importer(object):
         self.loxone_miniserver_port = None
         self.loxone_username = None
         self.loxone_password = None
+        self.map_id_prefix = ""
+        self.room_filters = []
+        self.category_filters = []
+        self.type_filters = []
+        self.name_filters = []
         self.ha_bridge_host = None
         self.ha_bridge_port = None
+        self.cache_dir = None
+        self.request_timeout = 5
+        self.ha_bridge_concurrency = 1
+        self.ha_bridge_fail_fast = True
+        self.ha_bridge_batch_size = 1
+        self.ha_bridge_retries = 0
+        self.ha_bridge_retry_backoff = 0.5
+        self.ha_bridge_retry_backoff_max = 30
+        self.ha_bridge_concurrency_controller = None
+        self.ha_bridge_replace = False
+        self.loxone_verify_concurrency = 8
+        self.loxone_verify_rate = 200
+        self.loxone_session = None
+        self.journal_path = None
+        self.journal_resume = False
+        self.journal = None
+        self.pipeline_queue_size = 100
+        self.generation_processes = 1
+        self.generation_shard_size = 2000
+        self.control_actions_map_path = None
+        self.loaded_control_actions_map = None
+        self.compiled_control_actions_map = None
+        self.track_device_changes = False
+        self.statistics = Statistics()
+        self.ha_bridge_session = None
         self.control_actions_map = {
             "Alarm": {"on": "delayedon", "off": "off"},
             "CentralAlarm": {"on": "delayedon", "off": "off"},
@@ -54,191 +1148,1867 @@ class Importer(object):
             "WindowMonitor": None,
         }
 
-    def print_configuration(self):
-        """Prints configuration of Importer"""
-        logging.debug(
-            'Loxone MiniServer host is set to "{host}"'.format(
-                host=self.loxone_miniserver_host
+    def print_configuration(self):
+        """Prints configuration of Importer"""
+        logging.debug(
+            'Loxone MiniServer host is set to "{host}"'.format(
+                host=self.loxone_miniserver_host
+            )
+        )
+        logging.debug(
+            'Loxone MiniServer port is set to "{port}"'.format(
+                port=self.loxone_miniserver_port
+            )
+        )
+        logging.debug(
+            'Loxone username is set to "{username}"'.format(
+                username=self.loxone_username
+            )
+        )
+        logging.debug(
+            'Loxone password is set to "{password}"'.format(
+                password=self.loxone_password
+            )
+        )
+        logging.debug(
+            'Control actions map is set to "{path}"'.format(
+                path=self.control_actions_map_path
+            )
+        )
+        logging.debug(
+            'Room filters are set to "{filters}"'.format(filters=self.room_filters)
+        )
+        logging.debug(
+            'Category filters are set to "{filters}"'.format(
+                filters=self.category_filters
+            )
+        )
+        logging.debug(
+            'Type filters are set to "{filters}"'.format(filters=self.type_filters)
+        )
+        logging.debug(
+            'Name filters are set to "{filters}"'.format(filters=self.name_filters)
+        )
+        logging.debug(
+            'HA-Bridge server host is set to "{host}"'.format(host=self.ha_bridge_host)
+        )
+        logging.debug(
+            'HA-Bridge server port is set to "{port}"'.format(port=self.ha_bridge_port)
+        )
+        logging.debug(
+            'Request timeout is set to "{timeout}"'.format(timeout=self.request_timeout)
+        )
+        logging.debug(
+            'Cache directory is set to "{cache_dir}"'.format(cache_dir=self.cache_dir)
+        )
+        logging.debug(
+            'Generation processes are set to "{processes}"'.format(
+                processes=self.generation_processes
+            )
+        )
+        logging.debug(
+            'HA-Bridge concurrency is set to "{concurrency}"'.format(
+                concurrency=self.ha_bridge_concurrency
+            )
+        )
+        logging.debug(
+            'HA-Bridge fail fast is set to "{fail_fast}"'.format(
+                fail_fast=self.ha_bridge_fail_fast
+            )
+        )
+        logging.debug(
+            'HA-Bridge batch size is set to "{batch_size}"'.format(
+                batch_size=self.ha_bridge_batch_size
+            )
+        )
+        logging.debug(
+            'HA-Bridge retries are set to "{retries}"'.format(
+                retries=self.ha_bridge_retries
+            )
+        )
+        logging.debug(
+            'HA-Bridge retry backoff is set to "{backoff}"'.format(
+                backoff=self.ha_bridge_retry_backoff
+            )
+        )
+        logging.debug(
+            'HA-Bridge adaptive concurrency is set to "{adaptive}"'.format(
+                adaptive=self.ha_bridge_concurrency_controller is not None
+            )
+        )
+        logging.debug(
+            'HA-Bridge replace is set to "{replace}"'.format(
+                replace=self.ha_bridge_replace
+            )
+        )
+        logging.debug(
+            'Loxone verify concurrency is set to "{concurrency}"'.format(
+                concurrency=self.loxone_verify_concurrency
+            )
+        )
+        logging.debug(
+            'Loxone verify rate is set to "{rate}"'.format(rate=self.loxone_verify_rate)
+        )
+        logging.debug('Journal is set to "{path}"'.format(path=self.journal_path))
+        logging.debug(
+            'Journal resume is set to "{resume}"'.format(resume=self.journal_resume)
+        )
+
+    def get_miniserver_importers(self, miniservers):
+        """Returns one Importer per Loxone MiniServer which shares all other
+        settings and prefixes device mapIds with the MiniServer name"""
+        importers = []
+        for miniserver in miniservers:
+            importer = copy.copy(self)
+            importer.loxone_miniserver_host = miniserver["host"]
+            importer.loxone_miniserver_port = miniserver["port"]
+            importer.loxone_username = miniserver["username"]
+            importer.loxone_password = miniserver["password"]
+            importer.map_id_prefix = "{name}:".format(name=miniserver["name"])
+            importers.append(importer)
+        return importers
+
+    def get_loxone_structure_file_version(self):
+        """Retrieves last modification timestamp of visualisation structure file
+        from Loxone MiniServer"""
+        url = "http://{host}:{port}/jdev/sps/LoxAPPversion3".format(
+            host=self.loxone_miniserver_host, port=self.loxone_miniserver_port
+        )
+        r = requests.get(
+            url,
+            auth=(self.loxone_username, self.loxone_password),
+            timeout=self.request_timeout,
+            hooks={"response": self.statistics.record_response},
+        )
+
+        if r.status_code != requests.codes.ok:
+            r.raise_for_status()
+
+        loxone_structure_file_version = r.json()["LL"]["value"]
+        logging.debug(
+            'Visualisation structure file version is "{version}"'.format(
+                version=loxone_structure_file_version
+            )
+        )
+
+        return loxone_structure_file_version
+
+    def get_cache_key(self):
+        """Returns file name prefix of cache files
+        for the configured Loxone MiniServer"""
+        return re.sub(
+            r"[^A-Za-z0-9.-]",
+            "_",
+            "{host}_{port}".format(
+                host=self.loxone_miniserver_host, port=self.loxone_miniserver_port
+            ),
+        )
+
+    def get_loxone_structure_file_cache_paths(self):
+        """Returns paths of cached visualisation structure file
+        and its version for the configured Loxone MiniServer"""
+        cache_file = os.path.join(
+            self.cache_dir, self.get_cache_key() + ".LoxAPP3.json"
+        )
+        return cache_file, cache_file + ".version"
+
+    def get_device_hashes_path(self):
+        """Returns path of the device hashes of the previous run
+        for the configured Loxone MiniServer"""
+        return os.path.join(
+            self.cache_dir, self.get_cache_key() + ".device-hashes.json"
+        )
+
+    def load_device_hashes(self):
+        """Reads device hashes of the previous run by mapId
+        or None if changes are not tracked"""
+        if self.cache_dir is None or not self.track_device_changes:
+            return None
+
+        try:
+            with open(self.get_device_hashes_path(), "rb") as f:
+                device_hashes = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(device_hashes, dict) or device_hashes.get("version") != 1:
+            return {}
+        return device_hashes["devices"]
+
+    def write_device_hashes(self, device_hashes):
+        """Stores device hashes by mapId for the next run,
+        readable by the owner only. Like the structure file cache,
+        failing to write them only logs a warning."""
+        hashes_file = self.get_device_hashes_path()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd = os.open(
+                hashes_file + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(fd, "w") as f:
+                # json.dumps uses the C encoder, json.dump does not
+                f.write(json.dumps({"version": 1, "devices": device_hashes}))
+            os.replace(hashes_file + ".tmp", hashes_file)
+        except OSError as e:
+            logging.warning(
+                "Could not write device hashes, changes are reported again "
+                "on the next run: {error}".format(error=e)
+            )
+            with contextlib.suppress(OSError):
+                os.remove(hashes_file + ".tmp")
+
+    def get_cached_loxone_structure_file(self, loxone_structure_file_version):
+        """Returns path of cached visualisation structure file
+        if it matches the given version"""
+        cache_file, version_file = self.get_loxone_structure_file_cache_paths()
+        try:
+            with open(version_file) as f:
+                if f.read() != loxone_structure_file_version:
+                    return None
+        except OSError:
+            return None
+
+        if not os.path.isfile(cache_file):
+            return None
+
+        return cache_file
+
+    def write_cached_loxone_structure_file(self, chunks, loxone_structure_file_version):
+        """Stores visualisation structure file content and its version in cache.
+        A cache which can not be written is bypassed with a warning."""
+        cache_file, version_file = self.get_loxone_structure_file_cache_paths()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(cache_file + ".tmp", "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(cache_file + ".tmp", cache_file)
+            with open(version_file + ".tmp", "w") as f:
+                f.write(loxone_structure_file_version)
+            os.replace(version_file + ".tmp", version_file)
+        except OSError as e:
+            logging.warning(
+                "Could not write visualisation structure file into cache, "
+                "cache is bypassed: {error}".format(error=e)
+            )
+            for path in (cache_file + ".tmp", version_file + ".tmp"):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+
+    def get_cacheable_loxone_structure_file_version(self):
+        """Returns visualisation structure file version to validate the cache with
+        or None if caching is disabled or the version is not available"""
+        if self.cache_dir is None:
+            return None
+
+        try:
+            return self.get_loxone_structure_file_version()
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            logging.warning(
+                "Could not retrieve visualisation structure file version, "
+                "cache is bypassed: {error}".format(error=e)
+            )
+            return None
+
+    def get_loxone_structure_file(self):
+        """Retrieves visualisation structure file from Loxone MiniServer
+        or from cache if it has not been modified since"""
+        loxone_structure_file_version = (
+            self.get_cacheable_loxone_structure_file_version()
+        )
+        if loxone_structure_file_version is not None:
+            cache_file = self.get_cached_loxone_structure_file(
+                loxone_structure_file_version
+            )
+            if cache_file is not None:
+                logging.debug("Use cached visualisation structure file")
+                with open(cache_file, "rb") as f:
+                    return json.load(f)
+
+        url = "http://{host}:{port}/data/LoxAPP3.json".format(
+            host=self.loxone_miniserver_host, port=self.loxone_miniserver_port
+        )
+        r = requests.get(
+            url,
+            auth=(self.loxone_username, self.loxone_password),
+            timeout=self.request_timeout,
+            hooks={"response": self.statistics.record_response},
+        )
+
+        if r.status_code != requests.codes.ok:
+            r.raise_for_status()
+
+        loxone_structure_file = r.json()
+        logging.debug(loxone_structure_file)
+
+        if loxone_structure_file_version is not None:
+            self.write_cached_loxone_structure_file(
+                [r.content], loxone_structure_file_version
+            )
+
+        return loxone_structure_file
+
+    def get_loxone_structure_file_stream(self):
+        """Retrieves visualisation structure file from Loxone MiniServer
+        in chunks into a local file and returns a stream over its contents"""
+        loxone_structure_file_version = (
+            self.get_cacheable_loxone_structure_file_version()
+        )
+        if loxone_structure_file_version is not None:
+            cache_file = self.get_cached_loxone_structure_file(
+                loxone_structure_file_version
+            )
+            if cache_file is not None:
+                logging.debug("Use cached visualisation structure file")
+                return LoxoneStructureFileStream(open(cache_file, "rb"))
+
+        url = "http://{host}:{port}/data/LoxAPP3.json".format(
+            host=self.loxone_miniserver_host, port=self.loxone_miniserver_port
+        )
+        r = requests.get(
+            url,
+            auth=(self.loxone_username, self.loxone_password),
+            timeout=self.request_timeout,
+            hooks={"response": self.statistics.record_response},
+            stream=True,
+        )
+
+        f = tempfile.TemporaryFile()
+        try:
+            if r.status_code != requests.codes.ok:
+                r.raise_for_status()
+
+            # The download is kept apart from the cache, so it can still be
+            # read if the cache can not be written
+            for chunk in r.iter_content(chunk_size=65536):
+                f.write(chunk)
+            f.seek(0)
+            if loxone_structure_file_version is not None:
+                self.write_cached_loxone_structure_file(
+                    iter(partial(f.read, 65536), b""), loxone_structure_file_version
+                )
+                f.seek(0)
+        except BaseException:
+            f.close()
+            raise
+        finally:
+            r.close()
+
+        return LoxoneStructureFileStream(f)
+
+    def get_loxone_controls(self, loxone_structure_file):
+        """Extracts controls from Loxone structure file"""
+        loxone_controls = loxone_structure_file.get("controls")
+        return loxone_controls
+
+    def get_sorted_loxone_controls(self, loxone_controls):
+        """Returns (uuid, control) pairs ordered by UUID"""
+        if isinstance(loxone_controls, LoxoneControlsStream):
+            return loxone_controls.items()
+        return sorted(loxone_controls.items())
+
+    def get_loxone_rooms(self, loxone_structure_file):
+        """Extracts rooms from Loxone structure file
+        and adds a blank room definition"""
+        loxone_rooms = loxone_structure_file.get("rooms")
+        loxone_rooms["00000000-0000-0000-0000000000000000"] = {
+            "uuid": "00000000-0000-0000-0000000000000000",
+            "name": "",
+        }
+        return loxone_rooms
+
+    def get_loxone_categories(self, loxone_structure_file):
+        """Extracts categories from Loxone structure file
+        and adds a blank category definition"""
+        loxone_categories = loxone_structure_file.get("cats")
+        loxone_categories["00000000-0000-0000-0000000000000000"] = {
+            "uuid": "00000000-0000-0000-0000000000000000",
+            "name": "undefined",
+            "type": "undefined",
+        }
+        return loxone_categories
+
+    def generate_ha_bridge_devices_configuration(self, loxone_structure_file):
+        """Generates HA-Bridge devices configruation
+        from visualisation structure file"""
+        return list(self.iter_ha_bridge_devices_configuration(loxone_structure_file))
+
+    def get_control_actions_map_version(self):
+        """Returns modification time of the control actions map file
+        or None if the built-in map is used"""
+        if self.control_actions_map_path is None:
+            return None
+        return os.stat(self.control_actions_map_path).st_mtime_ns
+
+    def get_control_actions_map(self):
+        """Returns the built-in control actions map updated with the entries of
+        the control actions map file, which is only read and validated again
+        when its modification time changed"""
+        version = self.get_control_actions_map_version()
+        if version is None:
+            return self.control_actions_map
+
+        if (
+            self.loaded_control_actions_map is None
+            or self.loaded_control_actions_map[0] != version
+        ):
+            control_actions_map = dict(self.control_actions_map)
+            control_actions_map.update(
+                load_control_actions_map(self.control_actions_map_path)
+            )
+            self.loaded_control_actions_map = (version, control_actions_map)
+        return self.loaded_control_actions_map[1]
+
+    def compile_control_actions_map(self):
+        """Compiles control actions map into serialized HA-Bridge URL templates
+        per control type, so generating a device only adds its control UUID.
+        The result is reused until the map or the connection settings change."""
+        control_actions_map = self.get_control_actions_map()
+        loxone_url_prefix = (
+            "http://{username}:{password}@{host}:{port}/dev/sps/io/".format(
+                username=self.loxone_username,
+                password=self.loxone_password,
+                host=self.loxone_miniserver_host,
+                port=self.loxone_miniserver_port,
+            )
+        )
+        if (
+            self.compiled_control_actions_map is not None
+            and self.compiled_control_actions_map[0] is control_actions_map
+            and self.compiled_control_actions_map[1] == loxone_url_prefix
+        ):
+            return self.compiled_control_actions_map[2]
+
+        placeholder = "\0"
+        escaped_placeholder = json.encoder.encode_basestring_ascii(placeholder)[1:-1]
+
+        compiled_control_actions_map = {}
+        for control_type, actions in control_actions_map.items():
+            if actions is None:
+                compiled_control_actions_map[control_type] = None
+                continue
+
+            templates = []
+            for action, key in (("on", "onUrl"), ("dim", "dimUrl"), ("off", "offUrl")):
+                if action not in actions:
+                    continue
+                item = OrderedDict()
+                item["item"] = "{prefix}{control}/{action}".format(
+                    prefix=loxone_url_prefix,
+                    control=placeholder,
+                    action=actions[action],
+                )
+                item["type"] = "httpDevice"
+                item["httpVerb"] = "GET"
+                item["contentType"] = "text/html"
+                before, after = json.dumps([item]).split(escaped_placeholder, 1)
+                templates.append((key, before, after))
+            compiled_control_actions_map[control_type] = tuple(templates)
+
+        self.compiled_control_actions_map = (
+            control_actions_map,
+            loxone_url_prefix,
+            compiled_control_actions_map,
+        )
+        return compiled_control_actions_map
+
+    def resolve_loxone_filters(self, loxone_items, filters, keys, label):
+        """Returns keys of rooms, categories or control types which themselves
+        or whose values for the given keys equal one of the filters,
+        ignoring case"""
+        index = {}
+        for uuid, item in loxone_items.items():
+            index.setdefault(uuid.casefold(), set()).add(uuid)
+            for key in keys:
+                value = item.get(key)
+                if value:
+                    index.setdefault(value.casefold(), set()).add(uuid)
+
+        uuids = set()
+        for value in filters:
+            matched = index.get(value.casefold())
+            if matched is None:
+                logging.warning(
+                    '{label} filter "{value}" does not match anything'.format(
+                        label=label, value=value
+                    )
+                )
+                continue
+            uuids.update(matched)
+        return frozenset(uuids)
+
+    def compile_control_filter(self, loxone_rooms, loxone_categories):
+        """Resolves room, category, type and name filters once into indexes
+        and returns a predicate for controls or None if nothing is filtered"""
+        blank_uuid = "00000000-0000-0000-0000000000000000"
+        checks = []
+        if self.type_filters:
+            control_types = self.resolve_loxone_filters(
+                self.get_control_actions_map(), self.type_filters, (), "Type"
+            )
+            checks.append(lambda control: control.get("type") in control_types)
+        if self.room_filters:
+            rooms = self.resolve_loxone_filters(
+                loxone_rooms, self.room_filters, ("name",), "Room"
+            )
+            checks.append(lambda control: control.get("room", blank_uuid) in rooms)
+        if self.category_filters:
+            categories = self.resolve_loxone_filters(
+                loxone_categories, self.category_filters, ("name", "type"), "Category"
+            )
+            checks.append(lambda control: control.get("cat", blank_uuid) in categories)
+        if self.name_filters:
+            pattern = re.compile(
+                "|".join(fnmatch.translate(value) for value in self.name_filters),
+                re.IGNORECASE,
+            )
+            checks.append(
+                lambda control: pattern.match(control.get("name") or "") is not None
+            )
+
+        if not checks:
+            return None
+        if len(checks) == 1:
+            return checks[0]
+        return lambda control: all(check(control) for check in checks)
+
+    def iter_selected_loxone_controls(
+        self, loxone_controls, control_filter, compiled_control_actions_map
+    ):
+        """Yields (uuid, type, name, room, category) tuples of the controls
+        which pass the filters and have a supported control type"""
+        blank_uuid = "00000000-0000-0000-0000000000000000"
+        for uuid, control in self.get_sorted_loxone_controls(loxone_controls):
+            if control_filter is not None and not control_filter(control):
+                continue
+            control_type = control.get("type")
+            if control_type not in compiled_control_actions_map:
+                logging.warning(
+                    'Control type "{control_type}" is not supported at the moment.'.format(
+                        control_type=control_type
+                    )
+                )
+                continue
+            if compiled_control_actions_map[control_type] is None:
+                continue
+            yield (
+                uuid,
+                control_type,
+                control.get("name"),
+                control.get("room", blank_uuid),
+                control.get("cat", blank_uuid),
+            )
+
+    def iter_ha_bridge_devices_configuration(self, loxone_structure_file):
+        """Generates HA-Bridge devices configruation
+        from visualisation structure file one device at a time.
+        When changes are tracked, the hash of every device is compared
+        with the previous run and the changes are recorded in the statistics."""
+        loxone_controls = self.get_loxone_controls(loxone_structure_file)
+        loxone_rooms = self.get_loxone_rooms(loxone_structure_file)
+        loxone_categories = self.get_loxone_categories(loxone_structure_file)
+        compiled_control_actions_map = self.compile_control_actions_map()
+        control_filter = self.compile_control_filter(loxone_rooms, loxone_categories)
+
+        previous_hashes = self.load_device_hashes()
+        templates_digests = None
+        if previous_hashes is not None:
+            # Templates contain the action map entry and the connection settings
+            templates_digests = {
+                control_type: hashlib.sha1(repr(templates).encode("utf-8")).hexdigest()
+                for control_type, templates in compiled_control_actions_map.items()
+            }
+            device_hashes = {}
+            added = []
+            changed = []
+
+        generation_context = GenerationContext(
+            self.map_id_prefix,
+            {uuid: room["name"] for uuid, room in loxone_rooms.items()},
+            {uuid: category["name"] for uuid, category in loxone_categories.items()},
+            compiled_control_actions_map,
+            templates_digests,
+        )
+        loxone_controls = self.iter_selected_loxone_controls(
+            loxone_controls, control_filter, compiled_control_actions_map
+        )
+        if self.generation_processes > 1:
+            generated_devices = self.generate_ha_bridge_devices_in_processes(
+                generation_context, loxone_controls
+            )
+        else:
+            generated_devices = generate_ha_bridge_devices(
+                generation_context, loxone_controls
+            )
+
+        for map_id, device_hash, ha_bridge_device in generated_devices:
+            if device_hash is not None:
+                device_hashes[map_id] = device_hash
+                # Only the hashes are kept, so memory stays bounded by mapIds
+                previous_hash = previous_hashes.pop(map_id, None)
+                if previous_hash is None:
+                    added.append(map_id)
+                elif previous_hash != device_hash:
+                    changed.append(map_id)
+
+            yield ha_bridge_device
+
+        if previous_hashes is not None:
+            removed = list(previous_hashes)
+            self.statistics.record_device_changes(
+                self.get_cache_key(),
+                DeviceChanges(
+                    added,
+                    changed,
+                    removed,
+                    len(device_hashes) - len(added) - len(changed),
+                ),
+            )
+            for action, map_ids in (
+                ("added", added),
+                ("changed", changed),
+                ("removed", removed),
+            ):
+                for map_id in map_ids:
+                    logging.debug(
+                        'Device "{map_id}" was {action} since last run'.format(
+                            map_id=map_id, action=action
+                        )
+                    )
+            if added or changed or removed:
+                self.write_device_hashes(device_hashes)
+
+    def generate_ha_bridge_devices_in_processes(self, generation_context, controls):
+        """Generates devices in shards of controls on a process pool and
+        yields them in control order. The context is sent once per worker.
+        Workers are spawned, since forking while the prefetching and
+        request threads run may copy locks held by them."""
+        # Only imported here, so startups without --processes do not pay for it
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(
+            max_workers=self.generation_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_generation_worker,
+            initargs=(generation_context,),
+        ) as executor:
+            shards = iter_ordered(
+                executor,
+                generate_ha_bridge_devices_shard,
+                iter_chunks(controls, self.generation_shard_size),
+                2 * self.generation_processes,
+            )
+            for shard in shards:
+                yield from shard
+
+    def get_loxone_session(self):
+        """Returns a keep-alive session to Loxone MiniServer
+        with a connection pool sized for the verification concurrency"""
+        if self.loxone_session is None:
+            pool_size = max(self.loxone_verify_concurrency, 1)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size
+            )
+            session = requests.Session()
+            session.auth = (self.loxone_username, self.loxone_password)
+            session.hooks["response"].append(self.statistics.record_response)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.loxone_session = session
+        return self.loxone_session
+
+    def verify_loxone_control(self, device_configuration, rate_limiter=None):
+        """Reads the state of the control behind a generated device
+        over the read-only io endpoint of Loxone MiniServer
+        and returns its value"""
+        uuid = device_configuration["mapId"][len(self.map_id_prefix) :]
+        url = "http://{host}:{port}/jdev/sps/io/{uuid}".format(
+            host=self.loxone_miniserver_host,
+            port=self.loxone_miniserver_port,
+            uuid=uuid,
+        )
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        r = self.get_loxone_session().get(url, timeout=self.request_timeout)
+
+        if r.status_code != requests.codes.ok:
+            r.raise_for_status()
+
+        # MiniServer reports unknown controls with HTTP 200 and the code in the body
+        response = r.json()
+        response = response.get("LL") if isinstance(response, dict) else None
+        if not isinstance(response, dict):
+            raise ValueError("Unexpected response from Loxone MiniServer")
+        code = str(response.get("Code", response.get("code")))
+        if code != "200":
+            raise ValueError(
+                "Loxone MiniServer answered with code {code}".format(code=code)
+            )
+        return response.get("value")
+
+    def verify_loxone_controls(self, ha_bridge_devices_configuration):
+        """Verifies the controls of all devices with the configured concurrency
+        and rate and returns a VerificationReport with failures in device order"""
+        rate_limiter = None
+        if self.loxone_verify_rate:
+            rate_limiter = RateLimiter(self.loxone_verify_rate)
+
+        verified = 0
+        failures = []
+        results = iter_bounded(
+            partial(self.verify_loxone_control, rate_limiter=rate_limiter),
+            ha_bridge_devices_configuration,
+            self.loxone_verify_concurrency,
+        )
+
+        try:
+            for index, device_configuration, value, error in results:
+                verified += 1
+                if error is None:
+                    logging.debug(
+                        'Control "{map_id}" has value "{value}"'.format(
+                            map_id=device_configuration["mapId"], value=value
+                        )
+                    )
+                    continue
+                if not isinstance(
+                    error, (requests.exceptions.RequestException, ValueError)
+                ):
+                    raise error
+                failures.append((index, device_configuration, error))
+        finally:
+            results.close()
+
+        failures.sort(key=lambda f: f[0])
+        return VerificationReport(verified, failures)
+
+    def get_ha_bridge_session(self):
+        """Returns a keep-alive session to HA-Bridge server
+        with a connection pool sized for the configured concurrency"""
+        if self.ha_bridge_session is None:
+            pool_size = max(self.ha_bridge_concurrency, 1)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size
+            )
+            session = requests.Session()
+            session.hooks["response"].append(self.statistics.record_response)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.ha_bridge_session = session
+        return self.ha_bridge_session
+
+    def retry_ha_bridge_request(self, function, *args):
+        """Calls a HA-Bridge request function and retries it with jittered
+        exponential backoff while it fails with a retryable error"""
+        for attempt in count():
+            started = time.perf_counter()
+            try:
+                result = function(*args)
+            except requests.exceptions.RequestException as error:
+                delay = self.get_ha_bridge_retry_delay(
+                    attempt, started, error, get_retryable_request_errors()
+                )
+                if delay is None:
+                    raise
+                time.sleep(delay)
+            else:
+                self.record_ha_bridge_latency(started)
+                return result
+
+    def record_ha_bridge_latency(self, started):
+        """Feeds the latency of a successful HA-Bridge request
+        started at `started` into adaptive concurrency"""
+        controller = self.ha_bridge_concurrency_controller
+        if controller is not None:
+            controller.record(started, time.perf_counter() - started)
+
+    def get_ha_bridge_retry_delay(self, attempt, started, error, retryable_errors):
+        """Decides whether a failed HA-Bridge request is sent again for both
+        engines. Returns the delay before the retry or None if the error
+        is final. Retryable errors also slow down adaptive concurrency."""
+        retryable = is_retryable_error(error, retryable_errors)
+        controller = self.ha_bridge_concurrency_controller
+        if retryable and controller is not None:
+            controller.record(started, 0, congested=True)
+        if not retryable or attempt >= self.ha_bridge_retries:
+            return None
+        return self.log_retry(attempt, error)
+
+    def log_retry(self, attempt, error):
+        """Logs a failed HA-Bridge request and returns the delay
+        before it is sent again"""
+        delay = backoff_delay(
+            attempt, self.ha_bridge_retry_backoff, self.ha_bridge_retry_backoff_max
+        )
+        logging.warning(
+            "HA-Bridge request failed, retry {attempt}/{retries} "
+            "in {delay:.2f}s: {error}".format(
+                attempt=attempt + 1,
+                retries=self.ha_bridge_retries,
+                delay=delay,
+                error=error,
+            )
+        )
+        return delay
+
+    def add_device_into_ha_bridge(self, device_configuration):
+        """Adds a single device or an array of devices
+        over REST API into HA-Bridge server"""
+        url = "http://{host}:{port}/api/devices".format(
+            host=self.ha_bridge_host, port=self.ha_bridge_port
+        )
+        r = self.get_ha_bridge_session().post(
+            url, json=device_configuration, timeout=self.request_timeout
+        )
+        logging.debug(r.text)
+
+        if r.status_code != requests.codes.created:
+            r.raise_for_status()
+
+        return r
+
+    def create_devices_in_ha_bridge(self, device_configuration):
+        """Adds a single device or an array of devices into HA-Bridge server
+        and records them in the journal. Unlike other requests, a create is
+        only sent again as is if HA-Bridge did not process it. After other
+        retryable errors, the devices HA-Bridge created anyway are looked up
+        by mapId and only the missing ones are sent again."""
+        for attempt in count():
+            started = time.perf_counter()
+            try:
+                r = self.add_device_into_ha_bridge(device_configuration)
+            except requests.exceptions.RequestException as error:
+                delay = self.get_ha_bridge_retry_delay(
+                    attempt, started, error, get_retryable_request_errors()
+                )
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                if not is_unprocessed_error(error, get_connect_request_errors()):
+                    device_configuration = self.skip_created_devices(
+                        device_configuration, self.get_ha_bridge_devices()
+                    )
+                    if not device_configuration:
+                        return
+            else:
+                self.record_ha_bridge_latency(started)
+                self.record_added_devices(device_configuration, r.content)
+                return
+
+    def skip_created_devices(self, device_configuration, ha_bridge_devices):
+        """Records devices which exist in HA-Bridge server with the same
+        configuration in the journal and returns the devices still to add"""
+        existing_devices = {
+            device.get("mapId"): device
+            for device in ha_bridge_devices
+            if self.is_imported_device(device)
+        }
+        devices = device_configuration
+        if not isinstance(devices, list):
+            devices = [devices]
+
+        missing_devices = []
+        for device in devices:
+            existing_device = existing_devices.get(device.get("mapId"))
+            if existing_device is None or any(
+                existing_device.get(key) != value for key, value in device.items()
+            ):
+                missing_devices.append(device)
+                continue
+            logging.debug(
+                'Device "{map_id}" was created by HA-Bridge before the error'.format(
+                    map_id=device.get("mapId")
+                )
+            )
+            if self.journal is not None:
+                self.journal.record(device["mapId"], existing_device.get("id"))
+
+        if not isinstance(device_configuration, list):
+            return missing_devices[0] if missing_devices else None
+        return missing_devices
+
+    def add_device_batch_into_ha_bridge(self, batch):
+        """Adds a batch of indexed devices into HA-Bridge server
+        with a single array request and falls back to one request per device
+        when HA-Bridge rejects the batch with a client error. After other errors
+        HA-Bridge may have stored the batch, so all its devices fail."""
+        if self.ha_bridge_batch_size > 1:
+            try:
+                self.create_devices_in_ha_bridge([device for _, device in batch])
+            except requests.exceptions.RequestException as error:
+                outcomes = self.get_failed_batch_outcomes(batch, error)
+                if outcomes is not None:
+                    return outcomes
+            else:
+                return [(index, device, None) for index, device in batch]
+
+        outcomes = []
+        for index, device in batch:
+            try:
+                self.create_devices_in_ha_bridge(device)
+            except requests.exceptions.RequestException as error:
+                if self.add_device_outcome(outcomes, index, device, error):
+                    break
+            else:
+                self.add_device_outcome(outcomes, index, device, None)
+        return outcomes
+
+    def get_failed_batch_outcomes(self, batch, error):
+        """Decides how a failed array request continues for both engines.
+        Returns the failed outcomes of all devices of the batch or None
+        if HA-Bridge rejected the batch, so its devices are sent one by one."""
+        if not is_rejected_error(error):
+            return [(index, device, error) for index, device in batch]
+        logging.warning(
+            "Batch of {count} devices was rejected, "
+            "retry one device at a time: {error}".format(
+                count=len(batch), error=error
+            )
+        )
+        return None
+
+    def add_device_outcome(self, outcomes, index, device_configuration, error):
+        """Appends the outcome of a single device request and returns
+        whether the remaining devices of a batch are skipped"""
+        outcomes.append((index, device_configuration, error))
+        return error is not None and self.ha_bridge_fail_fast
+
+    def open_journal(self):
+        """Opens the journal of added devices or a placeholder context
+        if no journal is configured"""
+        if self.journal_path is None:
+            return contextlib.nullcontext()
+        return ImportJournal(self.journal_path, self.journal_resume)
+
+    def skip_journaled_devices(self, ha_bridge_devices_configuration, journal):
+        """Yields devices which have not been added according to the journal"""
+        skipped = 0
+        for device_configuration in ha_bridge_devices_configuration:
+            if device_configuration["mapId"] in journal:
+                skipped += 1
+                continue
+            yield device_configuration
+        if skipped:
+            logging.info(
+                "Skipped {count} devices which were already added "
+                "according to the journal".format(count=skipped)
+            )
+
+    def record_added_devices(self, device_configuration, body):
+        """Records a single added device or an array of added devices
+        with the IDs returned by HA-Bridge server in the journal"""
+        if self.journal is None:
+            return
+        devices = device_configuration
+        if not isinstance(devices, list):
+            devices = [devices]
+        try:
+            added_devices = json.loads(body)
+        except (TypeError, ValueError):
+            added_devices = None
+        if isinstance(added_devices, dict):
+            added_devices = [added_devices]
+        if not isinstance(added_devices, list) or len(added_devices) != len(devices):
+            added_devices = [{}] * len(devices)
+        for device, added_device in zip(devices, added_devices):
+            device_id = (
+                added_device.get("id") if isinstance(added_device, dict) else None
+            )
+            self.journal.record(device["mapId"], device_id)
+
+    @contextlib.contextmanager
+    def journaled(self, ha_bridge_devices_configuration):
+        """Opens the journal around adding devices, skips devices it already
+        contains when resuming and deletes it once all devices were added"""
+        with self.open_journal() as journal:
+            if journal is None:
+                yield ha_bridge_devices_configuration
+                return
+            self.journal = journal
+            try:
+                yield self.skip_journaled_devices(
+                    ha_bridge_devices_configuration, journal
+                )
+            finally:
+                self.journal = None
+            journal.remove()
+
+    def add_devices_into_ha_bridge(self, ha_bridge_devices_configuration):
+        """Adds devices over REST API into HA-Bridge server"""
+        with self.journaled(ha_bridge_devices_configuration) as devices:
+            self.add_journaled_devices_into_ha_bridge(devices)
+
+    def add_journaled_devices_into_ha_bridge(self, ha_bridge_devices_configuration):
+        """Adds devices over REST API into HA-Bridge server
+        with the configured concurrency, batching and error handling"""
+        errors = []
+        batches = iter_chunks(
+            enumerate(ha_bridge_devices_configuration), self.ha_bridge_batch_size
+        )
+        results = iter_bounded(
+            self.add_device_batch_into_ha_bridge,
+            batches,
+            self.ha_bridge_concurrency,
+            self.ha_bridge_concurrency_controller,
+        )
+
+        try:
+            for _, _, outcomes, error in results:
+                if error is not None:
+                    raise error
+                for index, device_configuration, error in outcomes:
+                    if error is None:
+                        continue
+                    if self.ha_bridge_fail_fast:
+                        raise error
+                    errors.append((index, device_configuration, error))
+        finally:
+            results.close()
+
+        self.raise_ha_bridge_errors(errors, "added")
+
+    def get_ha_bridge_devices(self):
+        """Retrieves all configured devices over REST API from HA-Bridge server"""
+        url = "http://{host}:{port}/api/devices".format(
+            host=self.ha_bridge_host, port=self.ha_bridge_port
+        )
+
+        def get():
+            r = self.get_ha_bridge_session().get(url, timeout=self.request_timeout)
+
+            if r.status_code != requests.codes.ok:
+                r.raise_for_status()
+
+            return r
+
+        return self.retry_ha_bridge_request(get).json()
+
+    def is_imported_device(self, device_configuration):
+        """Checks if a HA-Bridge device was created by this importer"""
+        return (
+            device_configuration.get("targetDevice") == "Loxone"
+            and device_configuration.get("mapType") == "httpDevice"
+        )
+
+    def get_imported_devices(self, ha_bridge_devices):
+        """Selects the HA-Bridge devices which were created by this importer"""
+        return [
+            device for device in ha_bridge_devices if self.is_imported_device(device)
+        ]
+
+    def plan_ha_bridge_devices_sync(
+        self, ha_bridge_devices_configuration, ha_bridge_devices
+    ):
+        """Compares generated devices configuration with existing HA-Bridge devices
+        and returns the requests needed to bring HA-Bridge server up to date"""
+        existing_devices = OrderedDict()
+        delete = []
+        for device in ha_bridge_devices:
+            if not self.is_imported_device(device):
+                continue
+            if device.get("mapId") in existing_devices:
+                delete.append(device)
+            else:
+                existing_devices[device.get("mapId")] = device
+
+        create = []
+        update = []
+        unchanged = 0
+        for device_configuration in ha_bridge_devices_configuration:
+            existing_device = existing_devices.pop(device_configuration["mapId"], None)
+            if existing_device is None:
+                create.append(device_configuration)
+            elif all(
+                existing_device.get(key) == value
+                for key, value in device_configuration.items()
+            ):
+                unchanged += 1
+            else:
+                updated_device = dict(existing_device)
+                updated_device.update(device_configuration)
+                update.append(updated_device)
+        delete.extend(existing_devices.values())
+
+        return SyncPlan(create, update, delete, unchanged)
+
+    def update_device_in_ha_bridge(self, device_configuration):
+        """Updates an existing device over REST API in HA-Bridge server"""
+        url = "http://{host}:{port}/api/devices/{id}".format(
+            host=self.ha_bridge_host,
+            port=self.ha_bridge_port,
+            id=device_configuration["id"],
+        )
+        r = self.get_ha_bridge_session().put(
+            url, json=device_configuration, timeout=self.request_timeout
+        )
+        logging.debug(r.text)
+
+        if r.status_code != requests.codes.ok:
+            r.raise_for_status()
+
+        return r
+
+    def delete_device_from_ha_bridge(self, device_configuration):
+        """Deletes an existing device over REST API from HA-Bridge server"""
+        url = "http://{host}:{port}/api/devices/{id}".format(
+            host=self.ha_bridge_host,
+            port=self.ha_bridge_port,
+            id=device_configuration["id"],
+        )
+        r = self.get_ha_bridge_session().delete(url, timeout=self.request_timeout)
+        logging.debug(r.text)
+
+        if r.status_code not in (requests.codes.ok, requests.codes.no_content):
+            r.raise_for_status()
+
+        return r
+
+    def sync_devices_into_ha_bridge(self, sync_plan):
+        """Executes a sync plan over REST API against HA-Bridge server"""
+        self.add_devices_into_ha_bridge(sync_plan.create)
+        self.run_ha_bridge_requests(
+            self.update_device_in_ha_bridge, sync_plan.update, "updated"
+        )
+        self.run_ha_bridge_requests(
+            self.delete_device_from_ha_bridge, sync_plan.delete, "deleted"
+        )
+
+    def run_ha_bridge_requests(self, function, ha_bridge_devices, action):
+        """Calls function for every device with the configured
+        concurrency and error handling"""
+        errors = []
+        results = iter_bounded(
+            partial(self.retry_ha_bridge_request, function),
+            ha_bridge_devices,
+            self.ha_bridge_concurrency,
+            self.ha_bridge_concurrency_controller,
+        )
+
+        try:
+            for index, device_configuration, _, error in results:
+                if error is None:
+                    continue
+                if self.ha_bridge_fail_fast or not isinstance(
+                    error, requests.exceptions.RequestException
+                ):
+                    raise error
+                errors.append((index, device_configuration, error))
+        finally:
+            results.close()
+
+        self.raise_ha_bridge_errors(errors, action)
+
+    def raise_ha_bridge_errors(self, errors, action):
+        """Logs collected HA-Bridge errors in device order
+        and raises them as a single UploadError"""
+        if not errors:
+            return
+
+        errors.sort(key=lambda e: e[0])
+        for index, device_configuration, error in errors:
+            logging.error(
+                'Device #{index} "{name}" could not be {action}: {error}'.format(
+                    index=index,
+                    name=device_configuration.get("name"),
+                    action=action,
+                    error=error,
+                )
+            )
+        raise UploadError(errors)
+
+
+def format_sync_plan(sync_plan):
+    """Returns a one line summary of a sync plan"""
+    return (
+        "Sync plan: {create} to create, {update} to update, "
+        "{delete} to delete, {unchanged} unchanged".format(
+            create=len(sync_plan.create),
+            update=len(sync_plan.update),
+            delete=len(sync_plan.delete),
+            unchanged=sync_plan.unchanged,
+        )
+    )
+
+
+def format_replaced_devices(imported_devices):
+    """Returns a one line summary of the devices deleted before a replace"""
+    return (
+        "Delete {count} previously imported devices "
+        "over REST API from HA-Bridge server".format(count=len(imported_devices))
+    )
+
+
+def format_device_changes(device_changes):
+    """Returns a one line summary of device changes since the previous run"""
+    return (
+        "Devices since last run: {added} added, {changed} changed, "
+        "{removed} removed, {unchanged} unchanged".format(
+            added=len(device_changes.added),
+            changed=len(device_changes.changed),
+            removed=len(device_changes.removed),
+            unchanged=device_changes.unchanged,
+        )
+    )
+
+
+def echo_device_changes(statistics, echo=logging.info):
+    """Prints a summary of device changes since the previous run
+    if they were tracked"""
+    device_changes = statistics.get_device_changes()
+    if device_changes is not None:
+        echo(format_device_changes(device_changes))
+
+
+def run_importers(
+    importer, importers, sync=False, stream=False, echo=logging.info, export_path=None
+):
+    """Retrieves structure files of all importers, generates devices
+    and adds or synchronises them with HA-Bridge server
+    or exports them into a file"""
+    statistics = importer.statistics
+    echo("Retrieve visualisation structure file from Loxone MiniServer")
+    with statistics.phase("get_loxone_structure_file"):
+        loxone_structure_files = fetch_loxone_structure_files(importers, stream)
+    echo("Generate HA-Bridge devices configruation from visualisation structure file")
+    ha_bridge_devices_configuration = iter_prefetched(
+        statistics.timed(
+            "generate_ha_bridge_devices_configuration",
+            chain.from_iterable(
+                miniserver_importer.iter_ha_bridge_devices_configuration(
+                    loxone_structure_file
+                )
+                for miniserver_importer, loxone_structure_file in zip(
+                    importers, loxone_structure_files
+                )
+            ),
+        ),
+        importer.pipeline_queue_size,
+    )
+    try:
+        if export_path:
+            echo("Export devices configuration into {path}".format(path=export_path))
+            with statistics.phase("export_ha_bridge_devices"):
+                count = export_ha_bridge_devices(
+                    ha_bridge_devices_configuration, export_path
+                )
+            echo("Exported {count} devices".format(count=count))
+        else:
+            push_devices_into_ha_bridge(
+                importer, ha_bridge_devices_configuration, sync, echo
+            )
+        echo_device_changes(statistics, echo)
+    finally:
+        ha_bridge_devices_configuration.close()
+        if stream:
+            for loxone_structure_file in loxone_structure_files:
+                loxone_structure_file.close()
+
+
+def verify_importers(importer, importers, stream=False, echo=logging.info):
+    """Retrieves structure files of all importers, generates devices
+    and checks that Loxone MiniServer knows the control of every device.
+    Prints a report and returns the failures."""
+    statistics = importer.statistics
+    echo("Retrieve visualisation structure file from Loxone MiniServer")
+    with statistics.phase("get_loxone_structure_file"):
+        loxone_structure_files = fetch_loxone_structure_files(importers, stream)
+    echo("Verify controls over REST API of Loxone MiniServer")
+    verified = 0
+    failures = []
+    try:
+        with statistics.phase("verify_loxone_controls"):
+            for miniserver_importer, loxone_structure_file in zip(
+                importers, loxone_structure_files
+            ):
+                report = miniserver_importer.verify_loxone_controls(
+                    miniserver_importer.iter_ha_bridge_devices_configuration(
+                        loxone_structure_file
+                    )
+                )
+                verified += report.verified
+                failures.extend(report.failures)
+    finally:
+        if stream:
+            for loxone_structure_file in loxone_structure_files:
+                loxone_structure_file.close()
+
+    for _, device_configuration, error in failures:
+        echo(
+            'Control "{map_id}" of device "{name}" failed: {error}'.format(
+                map_id=device_configuration["mapId"],
+                name=device_configuration["name"],
+                error=error,
             )
         )
-        logging.debug(
-            'Loxone MiniServer port is set to "{port}"'.format(
-                port=self.loxone_miniserver_port
-            )
+    echo(
+        "Verified {verified} controls, {failed} failed".format(
+            verified=verified, failed=len(failures)
         )
-        logging.debug(
-            'Loxone username is set to "{username}"'.format(
-                username=self.loxone_username
-            )
+    )
+    return failures
+
+
+def replay_ha_bridge_devices(importer, path, sync=False, echo=logging.info):
+    """Reads exported devices from a file
+    and adds or synchronises them with HA-Bridge server"""
+    echo("Read devices configuration from {path}".format(path=path))
+    ha_bridge_devices_configuration = iter_prefetched(
+        importer.statistics.timed(
+            "read_ha_bridge_devices", read_ha_bridge_devices(path)
+        ),
+        importer.pipeline_queue_size,
+    )
+    try:
+        push_devices_into_ha_bridge(
+            importer, ha_bridge_devices_configuration, sync, echo
         )
-        logging.debug(
-            'Loxone password is set to "{password}"'.format(
-                password=self.loxone_password
+    finally:
+        ha_bridge_devices_configuration.close()
+
+
+def push_devices_into_ha_bridge(
+    importer, ha_bridge_devices_configuration, sync=False, echo=logging.info
+):
+    """Adds devices into HA-Bridge server or synchronises them with it"""
+    with importer.statistics.phase("add_devices_into_ha_bridge"):
+        if sync:
+            echo("Retrieve existing devices over REST API from HA-Bridge server")
+            sync_plan = importer.plan_ha_bridge_devices_sync(
+                ha_bridge_devices_configuration, importer.get_ha_bridge_devices()
             )
-        )
-        logging.debug(
-            'HA-Bridge server host is set to "{host}"'.format(host=self.ha_bridge_host)
-        )
-        logging.debug(
-            'HA-Bridge server port is set to "{port}"'.format(port=self.ha_bridge_port)
-        )
+            echo(format_sync_plan(sync_plan))
+            echo("Synchronise devices over REST API with HA-Bridge server")
+            importer.sync_devices_into_ha_bridge(sync_plan)
+        else:
+            if importer.ha_bridge_replace:
+                echo("Retrieve existing devices over REST API from HA-Bridge server")
+                imported_devices = importer.get_imported_devices(
+                    importer.get_ha_bridge_devices()
+                )
+                echo(format_replaced_devices(imported_devices))
+                importer.run_ha_bridge_requests(
+                    importer.delete_device_from_ha_bridge, imported_devices, "deleted"
+                )
+            echo("Add devices over REST API into HA-Bridge server")
+            importer.add_devices_into_ha_bridge(ha_bridge_devices_configuration)
 
-    def get_loxone_structure_file(self):
-        """Retrieves visualisation structure file from Loxone MiniServer"""
-        url = "http://{host}:{port}/data/LoxAPP3.json".format(
-            host=self.loxone_miniserver_host, port=self.loxone_miniserver_port
+
+def poll_loxone_structure_file_versions(importers):
+    """Retrieves the visualisation structure file version of every importer
+    or None if a MiniServer could not be polled"""
+    try:
+        return [
+            miniserver_importer.get_loxone_structure_file_version()
+            for miniserver_importer in importers
+        ]
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        logging.warning(
+            "Could not retrieve visualisation structure file version: {error}".format(
+                error=e
+            )
         )
-        r = requests.get(
-            url, auth=(self.loxone_username, self.loxone_password), timeout=5
+        return None
+
+
+def watch_importers(importers, run, interval, echo=logging.info, polls=None, errors=()):
+    """Polls the visualisation structure file versions of all importers
+    every `interval` seconds and calls `run` to synchronise HA-Bridge server
+    whenever one of them changed. Idle polls cost one version request
+    per MiniServer. Runs which fail with a request error, or one of `errors`
+    of the engine, are retried at the next poll."""
+    synchronised_versions = None
+    for poll in count() if polls is None else range(polls):
+        if poll:
+            time.sleep(interval)
+
+        versions = poll_loxone_structure_file_versions(importers)
+        if versions is None:
+            continue
+        try:
+            # Changes of the control actions map file also change the devices
+            versions.append(importers[0].get_control_actions_map_version())
+        except OSError as e:
+            logging.warning(
+                "Could not check control actions map: {error}".format(error=e)
+            )
+            continue
+        if versions == synchronised_versions:
+            logging.debug("Visualisation structure file has not been modified")
+            continue
+
+        echo(
+            "Visualisation structure file version {versions}".format(
+                versions=", ".join(versions[:-1])
+            )
         )
+        try:
+            run()
+        except (
+            requests.exceptions.RequestException,
+            UploadError,
+            ValueError,
+            OSError,
+        ) + tuple(errors) as e:
+            logging.error(
+                "Synchronisation failed, retry at next poll: {error}".format(error=e)
+            )
+            continue
+        synchronised_versions = versions
 
-        if r.status_code != requests.codes.ok:
-            r.raise_for_status()
 
-        loxone_structure_file = r.json()
-        logging.debug(loxone_structure_file)
+class AsyncImporter(object):
+    """asyncio version of the Importer workflow which runs the structure file
+    fetch and all HA-Bridge device requests on one event loop"""
 
-        return loxone_structure_file
+    def __init__(self, importer):
+        """Constructor"""
+        self.importer = importer
+        self.session = None
+        self.loxone_session = None
+        self.request_errors = ()
+        self.retryable_errors = ()
+        self.connect_errors = ()
 
-    def get_loxone_controls(self, loxone_structure_file):
-        """Extracts controls from Loxone structure file"""
-        loxone_controls = loxone_structure_file.get("controls")
-        return loxone_controls
+    def run(self, importers, sync=False, stream=False, echo=logging.info):
+        """Runs the import of all importers on a new event loop"""
+        return asyncio.run(self.import_devices(importers, sync, stream, echo))
 
-    def get_loxone_rooms(self, loxone_structure_file):
-        """Extracts rooms from Loxone structure file
-        and adds a blank room definition"""
-        loxone_rooms = loxone_structure_file.get("rooms")
-        loxone_rooms["00000000-0000-0000-0000000000000000"] = {
-            "uuid": "00000000-0000-0000-0000000000000000",
-            "name": "",
-        }
-        return loxone_rooms
+    def replay(self, path, sync=False, echo=logging.info):
+        """Runs the replay of an exported devices file on a new event loop"""
+        return asyncio.run(self.replay_devices(path, sync, echo))
 
-    def get_loxone_categories(self, loxone_structure_file):
-        """Extracts categories from Loxone structure file
-        and adds a blank category definition"""
-        loxone_categories = loxone_structure_file.get("cats")
-        loxone_categories["00000000-0000-0000-0000000000000000"] = {
-            "uuid": "00000000-0000-0000-0000000000000000",
-            "name": "undefined",
-            "type": "undefined",
-        }
-        return loxone_categories
+    @contextlib.asynccontextmanager
+    async def client_session(self):
+        """Opens the HTTP client session shared by all HA-Bridge requests
+        and a separate one for Loxone MiniServers, so the HA-Bridge
+        concurrency does not serialise the structure file downloads"""
+        import aiohttp
 
-    def generate_ha_bridge_devices_configuration(self, loxone_structure_file):
-        """Generates HA-Bridge devices configruation
-        from visualisation structure file"""
-        ha_bridge_devices_configuration = []
-        loxone_url_schema = (
-            "http://{username}:{password}@{host}:{port}/dev/sps/io/{control}/{action}"
+        self.request_errors = get_async_request_errors()
+        self.retryable_errors = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+        self.connect_errors = (aiohttp.ClientConnectorError,)
+        connector = aiohttp.TCPConnector(limit=self.importer.ha_bridge_concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.importer.request_timeout)
+        # Like requests, the timeout applies to connecting and to every read
+        loxone_timeout = aiohttp.ClientTimeout(
+            sock_connect=self.importer.request_timeout,
+            sock_read=self.importer.request_timeout,
         )
-        loxone_controls = self.get_loxone_controls(loxone_structure_file)
-        loxone_rooms = self.get_loxone_rooms(loxone_structure_file)
-        loxone_categories = self.get_loxone_categories(loxone_structure_file)
 
-        for uuid, control in sorted(loxone_controls.items()):
-            control_name = control.get("name")
-            control_type = control.get("type")
-            room_uuid = control.get("room", "00000000-0000-0000-0000000000000000")
-            category_uuid = control.get("cat", "00000000-0000-0000-0000000000000000")
-            device_name = "{control_name} {room_name}".format(
-                control_name=control_name, room_name=loxone_rooms[room_uuid]["name"]
-            )
-            device_name = device_name.strip()
-            device_description = (
-                "Control-Type: {control_type}, Category: {category}".format(
-                    control_type=control_type,
-                    category=loxone_categories[category_uuid]["name"],
-                )
-            )
-            ha_bridge_device = {
-                "name": device_name,
-                "description": device_description,
-                "targetDevice": "Loxone",
-                "deviceType": "custom",
-                "mapType": "httpDevice",
-                "mapId": uuid,
-            }
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as session, aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0), timeout=loxone_timeout
+        ) as loxone_session:
+            self.session = session
+            self.loxone_session = loxone_session
+            try:
+                yield session
+            finally:
+                self.session = None
+                self.loxone_session = None
 
-            item = OrderedDict()
-            item["item"] = ""
-            item["type"] = "httpDevice"
-            item["httpVerb"] = "GET"
-            item["contentType"] = "text/html"
-
-            ha_bridge_on = []
-            ha_bridge_on.append(item)
-            ha_bridge_dim = []
-            ha_bridge_dim.append(item)
-            ha_bridge_off = []
-            ha_bridge_off.append(item)
-
-            if control_type in self.control_actions_map:
-                if self.control_actions_map[control_type] is not None:
-                    if "on" in self.control_actions_map[control_type]:
-                        url = loxone_url_schema.format(
-                            username=self.loxone_username,
-                            password=self.loxone_password,
-                            host=self.loxone_miniserver_host,
-                            port=self.loxone_miniserver_port,
-                            control=uuid,
-                            action=self.control_actions_map[control_type]["on"],
-                        )
-                        ha_bridge_on[0]["item"] = url
-                        ha_bridge_device["onUrl"] = json.dumps(ha_bridge_on)
-                    if "dim" in self.control_actions_map[control_type]:
-                        url = loxone_url_schema.format(
-                            username=self.loxone_username,
-                            password=self.loxone_password,
-                            host=self.loxone_miniserver_host,
-                            port=self.loxone_miniserver_port,
-                            control=uuid,
-                            action=self.control_actions_map[control_type]["dim"],
+    async def import_devices(self, importers, sync=False, stream=False, echo=None):
+        """Retrieves structure files, generates devices and adds or synchronises
+        them with HA-Bridge server"""
+        echo = echo or logging.info
+        async with self.client_session():
+            statistics = self.importer.statistics
+            echo("Retrieve visualisation structure file from Loxone MiniServer")
+            with statistics.phase("get_loxone_structure_file"):
+                loxone_structure_files = await asyncio.gather(
+                    *[
+                        self.get_loxone_structure_file(importer, stream)
+                        for importer in importers
+                    ]
+                )
+            try:
+                echo(
+                    "Generate HA-Bridge devices configruation "
+                    "from visualisation structure file"
+                )
+                ha_bridge_devices_configuration = statistics.timed(
+                    "generate_ha_bridge_devices_configuration",
+                    chain.from_iterable(
+                        importer.iter_ha_bridge_devices_configuration(
+                            loxone_structure_file
                         )
-                        ha_bridge_dim[0]["item"] = url
-                        ha_bridge_device["dimUrl"] = json.dumps(ha_bridge_dim)
-                    if "off" in self.control_actions_map[control_type]:
-                        url = loxone_url_schema.format(
-                            username=self.loxone_username,
-                            password=self.loxone_password,
-                            host=self.loxone_miniserver_host,
-                            port=self.loxone_miniserver_port,
-                            control=uuid,
-                            action=self.control_actions_map[control_type]["off"],
+                        for importer, loxone_structure_file in zip(
+                            importers, loxone_structure_files
                         )
-                        ha_bridge_off[0]["item"] = url
-                        ha_bridge_device["offUrl"] = json.dumps(ha_bridge_off)
-                    ha_bridge_devices_configuration.append(ha_bridge_device)
+                    ),
+                )
+                await self.push_devices_into_ha_bridge(
+                    ha_bridge_devices_configuration, sync, echo
+                )
+                echo_device_changes(statistics, echo)
+            finally:
+                if stream:
+                    for loxone_structure_file in loxone_structure_files:
+                        loxone_structure_file.close()
+
+    async def replay_devices(self, path, sync=False, echo=None):
+        """Reads exported devices from a file and adds or synchronises them
+        with HA-Bridge server"""
+        echo = echo or logging.info
+        async with self.client_session():
+            echo("Read devices configuration from {path}".format(path=path))
+            await self.push_devices_into_ha_bridge(
+                self.importer.statistics.timed(
+                    "read_ha_bridge_devices", read_ha_bridge_devices(path)
+                ),
+                sync,
+                echo,
+            )
+
+    async def push_devices_into_ha_bridge(
+        self, ha_bridge_devices_configuration, sync=False, echo=logging.info
+    ):
+        """Adds devices into HA-Bridge server or synchronises them with it"""
+        with self.importer.statistics.phase("add_devices_into_ha_bridge"):
+            if sync:
+                echo("Retrieve existing devices over REST API from HA-Bridge server")
+                sync_plan = self.importer.plan_ha_bridge_devices_sync(
+                    ha_bridge_devices_configuration,
+                    await self.get_ha_bridge_devices(),
+                )
+                echo(format_sync_plan(sync_plan))
+                echo("Synchronise devices over REST API with HA-Bridge server")
+                await self.sync_devices_into_ha_bridge(sync_plan)
+            else:
+                if self.importer.ha_bridge_replace:
+                    echo(
+                        "Retrieve existing devices over REST API from HA-Bridge server"
+                    )
+                    imported_devices = self.importer.get_imported_devices(
+                        await self.get_ha_bridge_devices()
+                    )
+                    echo(format_replaced_devices(imported_devices))
+                    await self.run_bounded(
+                        self.delete_device_from_ha_bridge,
+                        enumerate(imported_devices),
+                        "deleted",
+                    )
+                echo("Add devices over REST API into HA-Bridge server")
+                await self.add_devices_into_ha_bridge(ha_bridge_devices_configuration)
+
+    async def request(
+        self, method, url, expected_status, payload=None, session=None, **kwargs
+    ):
+        """Sends a request with an optional JSON payload, records its statistics
+        and returns the response body"""
+        data = None
+        if payload is not None:
+            data = json.dumps(payload).encode("utf-8")
+            kwargs["headers"] = {"Content-Type": "application/json"}
+
+        start = time.perf_counter()
+        session = session or self.session
+        async with session.request(method, url, data=data, **kwargs) as r:
+            body = await r.read()
+            self.importer.statistics.record_request(
+                method,
+                url,
+                r.status,
+                time.perf_counter() - start,
+                len(data or b""),
+                len(body),
+            )
+            logging.debug(body)
+            if r.status not in expected_status:
+                r.raise_for_status()
+            return body
+
+    async def send_ha_bridge_request(self, method, url, expected_status, **kwargs):
+        """Sends a request to HA-Bridge server and retries it with jittered
+        exponential backoff while it fails with a retryable error"""
+        importer = self.importer
+        for attempt in count():
+            started = time.perf_counter()
+            try:
+                body = await self.request(method, url, expected_status, **kwargs)
+            except self.request_errors as error:
+                delay = importer.get_ha_bridge_retry_delay(
+                    attempt, started, error, self.retryable_errors
+                )
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
             else:
+                importer.record_ha_bridge_latency(started)
+                return body
+
+    async def download(self, url, fileobj, chunk_size=65536, **kwargs):
+        """Writes the body of a Loxone MiniServer response into a file
+        in chunks and records its statistics"""
+        start = time.perf_counter()
+        received = 0
+        async with self.loxone_session.get(url, **kwargs) as r:
+            if r.status == 200:
+                async for chunk in r.content.iter_chunked(chunk_size):
+                    fileobj.write(chunk)
+                    received += len(chunk)
+            self.importer.statistics.record_request(
+                "GET", url, r.status, time.perf_counter() - start, 0, received
+            )
+            if r.status != 200:
+                r.raise_for_status()
+
+    async def get_loxone_structure_file(self, importer, stream=False):
+        """Retrieves visualisation structure file from Loxone MiniServer
+        or from cache if it has not been modified since"""
+        credentials = "{username}:{password}".format(
+            username=importer.loxone_username, password=importer.loxone_password
+        )
+        headers = {
+            "Authorization": "Basic "
+            + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+        }
+        base_url = "http://{host}:{port}".format(
+            host=importer.loxone_miniserver_host, port=importer.loxone_miniserver_port
+        )
+
+        loxone_structure_file_version = None
+        if importer.cache_dir is not None:
+            try:
+                body = await self.request(
+                    "GET",
+                    base_url + "/jdev/sps/LoxAPPversion3",
+                    (200,),
+                    session=self.loxone_session,
+                    headers=headers,
+                )
+                loxone_structure_file_version = json.loads(body)["LL"]["value"]
+            except self.request_errors + (KeyError, ValueError) as e:
                 logging.warning(
-                    'Control type "{control_type}" is not supported at the moment.'.format(
-                        control_type=control_type
+                    "Could not retrieve visualisation structure file version, "
+                    "cache is bypassed: {error}".format(error=e)
+                )
+            else:
+                cache_file = importer.get_cached_loxone_structure_file(
+                    loxone_structure_file_version
+                )
+                if cache_file is not None:
+                    logging.debug("Use cached visualisation structure file")
+                    if stream:
+                        return LoxoneStructureFileStream(open(cache_file, "rb"))
+                    with open(cache_file, "rb") as f:
+                        return json.load(f)
+
+        url = base_url + "/data/LoxAPP3.json"
+        if stream:
+            f = tempfile.TemporaryFile()
+            try:
+                await self.download(url, f, headers=headers)
+                f.seek(0)
+                if loxone_structure_file_version is not None:
+                    importer.write_cached_loxone_structure_file(
+                        iter(partial(f.read, 65536), b""),
+                        loxone_structure_file_version,
                     )
+                    f.seek(0)
+            except BaseException:
+                f.close()
+                raise
+            return LoxoneStructureFileStream(f)
+
+        body = await self.request(
+            "GET", url, (200,), session=self.loxone_session, headers=headers
+        )
+        if loxone_structure_file_version is not None:
+            importer.write_cached_loxone_structure_file(
+                [body], loxone_structure_file_version
+            )
+        return json.loads(body)
+
+    def get_ha_bridge_url(self, path=""):
+        """Returns URL of HA-Bridge devices REST API"""
+        return "http://{host}:{port}/api/devices{path}".format(
+            host=self.importer.ha_bridge_host,
+            port=self.importer.ha_bridge_port,
+            path=path,
+        )
+
+    async def get_ha_bridge_devices(self):
+        """Retrieves all configured devices over REST API from HA-Bridge server"""
+        body = await self.send_ha_bridge_request(
+            "GET", self.get_ha_bridge_url(), (200,)
+        )
+        return json.loads(body)
+
+    async def send_device_request(
+        self, index, device_configuration, method, url, expected_status, **kwargs
+    ):
+        """Sends a request for a single device and returns its outcome"""
+        try:
+            await self.send_ha_bridge_request(method, url, expected_status, **kwargs)
+        except self.request_errors as error:
+            return [(index, device_configuration, error)]
+        return [(index, device_configuration, None)]
+
+    async def create_devices_in_ha_bridge(self, device_configuration):
+        """Adds a single device or an array of devices into HA-Bridge server
+        and records them in the journal. Unlike other requests, a create is
+        only sent again as is if HA-Bridge did not process it. After other
+        retryable errors, the devices HA-Bridge created anyway are looked up
+        by mapId and only the missing ones are sent again."""
+        importer = self.importer
+        for attempt in count():
+            started = time.perf_counter()
+            try:
+                body = await self.request(
+                    "POST",
+                    self.get_ha_bridge_url(),
+                    (201,),
+                    payload=device_configuration,
+                )
+            except self.request_errors as error:
+                delay = importer.get_ha_bridge_retry_delay(
+                    attempt, started, error, self.retryable_errors
                 )
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                if not is_unprocessed_error(error, self.connect_errors):
+                    device_configuration = importer.skip_created_devices(
+                        device_configuration, await self.get_ha_bridge_devices()
+                    )
+                    if not device_configuration:
+                        return
+            else:
+                importer.record_ha_bridge_latency(started)
+                importer.record_added_devices(device_configuration, body)
+                return
 
-        return ha_bridge_devices_configuration
+    async def add_device_batch_into_ha_bridge(self, batch):
+        """Adds a batch of indexed devices into HA-Bridge server
+        with a single array request and falls back to one request per device
+        when HA-Bridge rejects the batch with a client error. After other errors
+        HA-Bridge may have stored the batch, so all its devices fail."""
+        importer = self.importer
+        if importer.ha_bridge_batch_size > 1:
+            try:
+                await self.create_devices_in_ha_bridge([device for _, device in batch])
+            except self.request_errors as error:
+                outcomes = importer.get_failed_batch_outcomes(batch, error)
+                if outcomes is not None:
+                    return outcomes
+            else:
+                return [(index, device, None) for index, device in batch]
 
-    def add_devices_into_ha_bridge(self, ha_bridge_devices_configuration):
-        """Adds devices over REST API into HA-Bridge server"""
-        url = "http://{host}:{port}/api/devices".format(
-            host=self.ha_bridge_host, port=self.ha_bridge_port
+        outcomes = []
+        for index, device in batch:
+            try:
+                await self.create_devices_in_ha_bridge(device)
+            except self.request_errors as error:
+                if importer.add_device_outcome(outcomes, index, device, error):
+                    break
+            else:
+                importer.add_device_outcome(outcomes, index, device, None)
+        return outcomes
+
+    async def update_device_in_ha_bridge(self, indexed_device):
+        """Updates an existing device over REST API in HA-Bridge server"""
+        index, device_configuration = indexed_device
+        return await self.send_device_request(
+            index,
+            device_configuration,
+            "PUT",
+            self.get_ha_bridge_url("/" + device_configuration["id"]),
+            (200,),
+            payload=device_configuration,
         )
 
-        for device_configuration in ha_bridge_devices_configuration:
-            r = requests.post(url, json=device_configuration, timeout=5)
-            logging.debug(r.text)
+    async def delete_device_from_ha_bridge(self, indexed_device):
+        """Deletes an existing device over REST API from HA-Bridge server"""
+        index, device_configuration = indexed_device
+        return await self.send_device_request(
+            index,
+            device_configuration,
+            "DELETE",
+            self.get_ha_bridge_url("/" + device_configuration["id"]),
+            (200, 204),
+        )
 
-            if r.status_code != requests.codes.created:
-                r.raise_for_status()
+    async def run_bounded(self, coroutine_function, items, action):
+        """Awaits coroutine_function for every item with at most
+        the configured concurrency in flight and the configured error handling"""
+        concurrency = self.importer.ha_bridge_concurrency
+        controller = self.importer.ha_bridge_concurrency_controller
+        fail_fast = self.importer.ha_bridge_fail_fast
+        errors = []
+        failures = []
+        tasks = set()
+
+        async def run(item):
+            try:
+                outcomes = await coroutine_function(item)
+            except Exception as failure:
+                failures.append(failure)
+                return
+            errors.extend(outcome for outcome in outcomes if outcome[2] is not None)
+
+        def bound():
+            if controller is None:
+                return concurrency
+            return min(concurrency, controller.current())
+
+        def stopped():
+            return failures or (errors and fail_fast)
+
+        try:
+            for item in items:
+                while len(tasks) >= bound() and not stopped():
+                    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                if stopped():
+                    break
+                task = asyncio.ensure_future(run(item))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            while tasks and not stopped():
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            # Like the thread pool of iter_bounded, no new item is started
+            # once stopped, but requests in flight finish, so HA-Bridge
+            # may not store devices which are missing in the journal
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if failures:
+            raise failures[0]
+        if errors and fail_fast:
+            raise min(errors, key=lambda e: e[0])[2]
+        self.importer.raise_ha_bridge_errors(errors, action)
+
+    async def add_devices_into_ha_bridge(self, ha_bridge_devices_configuration):
+        """Adds devices over REST API into HA-Bridge server"""
+        with self.importer.journaled(ha_bridge_devices_configuration) as devices:
+            batches = iter_chunks(
+                enumerate(devices), self.importer.ha_bridge_batch_size
+            )
+            await self.run_bounded(
+                self.add_device_batch_into_ha_bridge, batches, "added"
+            )
+
+    async def sync_devices_into_ha_bridge(self, sync_plan):
+        """Executes a sync plan over REST API against HA-Bridge server"""
+        await self.add_devices_into_ha_bridge(sync_plan.create)
+        await self.run_bounded(
+            self.update_device_in_ha_bridge, enumerate(sync_plan.update), "updated"
+        )
+        await self.run_bounded(
+            self.delete_device_from_ha_bridge, enumerate(sync_plan.delete), "deleted"
+        )
 
 
 @click.command()
 @click.option(
     "--loxone-miniserver-host",
-    required=True,
     type=str,
-    help="Set IP address / hostname of Loxone MiniServer",
+    help="Set IP address / hostname of Loxone MiniServer (Required without --config)",
 )
 @click.option(
     "--loxone-miniserver-port",
@@ -249,15 +3019,71 @@ class Importer(object):
 )
 @click.option(
     "--loxone-username",
-    required=True,
     type=str,
-    help="Set username for Loxone MiniServer login",
+    help="Set username for Loxone MiniServer login (Required without --config)",
 )
 @click.option(
     "--loxone-password",
-    required=True,
     type=str,
-    help="Set password for Loxone MiniServer login",
+    help="Set password for Loxone MiniServer login (Required without --config)",
+)
+@click.option(
+    "--config",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Import from all Loxone MiniServers listed in a JSON configuration file",
+)
+@click.option(
+    "--actions-map",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Add or override control type actions with a JSON or YAML file",
+)
+@click.option(
+    "--room",
+    multiple=True,
+    help="Only import controls of a room given by name or UUID, can be repeated",
+)
+@click.option(
+    "--category",
+    multiple=True,
+    help="Only import controls of a category given by name, type (e.g. lights, shading) or UUID, can be repeated",
+)
+@click.option(
+    "--type",
+    "control_type",
+    multiple=True,
+    help="Only import controls of a control type (e.g. Jalousie), can be repeated",
+)
+@click.option(
+    "--name",
+    multiple=True,
+    help="Only import controls whose name matches a glob pattern (e.g. 'Deckenlicht*'), can be repeated",
+)
+@click.option(
+    "--export",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write devices into a HA-Bridge device.db file instead of uploading them, gzip compressed if the name ends with .gz",
+)
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Upload devices from a file written by --export without contacting Loxone MiniServer",
+)
+@click.option(
+    "--verify",
+    is_flag=True,
+    help="Check that Loxone MiniServer knows the control of every device instead of uploading them and report failures",
+)
+@click.option(
+    "--verify-concurrency",
+    type=click.IntRange(min=1),
+    default=8,
+    help="Set number of concurrent requests to Loxone MiniServer with --verify (Default: 8)",
+)
+@click.option(
+    "--verify-rate",
+    type=click.FloatRange(min=0),
+    default=200,
+    help="Set maximum requests per second to Loxone MiniServer with --verify, 0 for no limit (Default: 200)",
 )
 @click.option(
     "--ha-bridge-host",
@@ -273,6 +3099,132 @@ class Importer(object):
     default=8080,
     help="Set port of HA-Bridge server (Default: 8080)",
 )
+@click.option(
+    "--timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=5,
+    help="Set timeout in seconds for every request (Default: 5)",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    default=os.path.join("~", ".cache", "loxone-ha-bridge-importer"),
+    help="Set directory to cache visualisation structure file and device hashes in (Default: ~/.cache/loxone-ha-bridge-importer)",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Always download visualisation structure file from Loxone MiniServer and do not track changes",
+)
+@click.option(
+    "--track-changes",
+    is_flag=True,
+    help="Report devices added, changed or removed since the last run, with hashes of the devices kept in the cache directory",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Read visualisation structure file incrementally to reduce memory usage",
+)
+@click.option(
+    "--queue-size",
+    type=click.IntRange(min=1),
+    default=100,
+    help="Set number of generated devices buffered ahead of the upload (Default: 100)",
+)
+@click.option(
+    "--processes",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Set number of processes generating devices from very large visualisation structure files (Default: 1)",
+)
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Set number of concurrent requests to HA-Bridge server (Default: 1)",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Set number of devices sent to HA-Bridge server per request (Default: 1)",
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    default=0,
+    help="Set number of retries of HA-Bridge requests which failed with a timeout, connection or server error (Default: 0)",
+)
+@click.option(
+    "--retry-backoff",
+    type=click.FloatRange(min=0),
+    default=0.5,
+    help="Set base delay in seconds of the jittered exponential backoff between retries (Default: 0.5)",
+)
+@click.option(
+    "--adaptive-concurrency",
+    is_flag=True,
+    help="Adjust number of concurrent requests between 1 and --concurrency to the latency and errors of HA-Bridge server",
+)
+@click.option(
+    "--latency-target",
+    type=click.FloatRange(min=0, min_open=True),
+    default=1,
+    help="Set response time in seconds above which adaptive concurrency backs off (Default: 1)",
+)
+@click.option(
+    "--journal",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Record every device added into HA-Bridge server in a journal file, which is deleted once all devices were added",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Skip devices which were already added according to --journal",
+)
+@click.option(
+    "--fail-fast/--no-fail-fast",
+    default=True,
+    help="Stop at the first device HA-Bridge rejects or report all failures at the end (Default: fail fast)",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(["sync", "async"]),
+    default="sync",
+    help="Run requests on a thread pool or on an asyncio event loop (Default: sync)",
+)
+@click.option(
+    "--sync",
+    is_flag=True,
+    help="Only create, update and delete the HA-Bridge devices which differ from the Loxone controls",
+)
+@click.option(
+    "--replace",
+    is_flag=True,
+    help="Delete all devices previously imported into HA-Bridge server before adding the devices",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Keep running and synchronise devices whenever the visualisation structure file changes",
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=60,
+    help="Set seconds between polls of the visualisation structure file version in watch mode (Default: 60)",
+)
+@click.option(
+    "--stats-json",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write phase timings and request latency statistics into a JSON file",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Print cProfile results of all threads and tracemalloc results to stderr",
+)
 @click.option(
     "--verbose",
     is_flag=True,
@@ -288,6 +3240,67 @@ def cli(*args, **kwargs):
     else:
         logging.basicConfig(format=log_format)
 
+    # Check required options
+    ctx = click.get_current_context()
+    if kwargs["export"] and kwargs["replay"]:
+        raise click.UsageError(
+            "Options --export and --replay are mutually exclusive", ctx=ctx
+        )
+    if kwargs["export"] and kwargs["sync"]:
+        # Exporting sends no request to HA-Bridge server to synchronise with
+        raise click.UsageError(
+            "Option --sync can not be combined with --export", ctx=ctx
+        )
+    if kwargs["resume"] and not kwargs["journal"]:
+        raise click.UsageError("Option --resume requires --journal", ctx=ctx)
+    if (
+        kwargs["journal"]
+        and not kwargs["resume"]
+        and os.path.isfile(kwargs["journal"])
+        and os.path.getsize(kwargs["journal"])
+    ):
+        # The journal is deleted after a complete import, so it belongs to
+        # an interrupted one whose devices would be added again
+        raise click.UsageError(
+            "Journal {path} of an interrupted import exists, "
+            "add --resume to continue it or delete it".format(path=kwargs["journal"]),
+            ctx=ctx,
+        )
+    if kwargs["watch"] and (kwargs["export"] or kwargs["replay"]):
+        raise click.UsageError(
+            "Option --watch can not be combined with --export or --replay", ctx=ctx
+        )
+    if kwargs["replace"] and (
+        kwargs["sync"] or kwargs["watch"] or kwargs["export"] or kwargs["verify"]
+    ):
+        raise click.UsageError(
+            "Option --replace can not be combined with --sync, --watch, --export or --verify",
+            ctx=ctx,
+        )
+    if kwargs["replace"] and kwargs["resume"]:
+        # The devices added before the interruption would be deleted again
+        raise click.UsageError(
+            "Option --replace can not be combined with --resume", ctx=ctx
+        )
+    if kwargs["verify"] and (kwargs["export"] or kwargs["replay"] or kwargs["watch"]):
+        raise click.UsageError(
+            "Option --verify can not be combined with --export, --replay or --watch",
+            ctx=ctx,
+        )
+    if kwargs["config"] and not kwargs["replay"]:
+        try:
+            miniservers = load_miniservers_configuration(kwargs["config"])
+        except ValueError as e:
+            raise click.BadParameter(str(e), ctx=ctx, param_hint="'--config'")
+    elif not kwargs["replay"]:
+        for param in ctx.command.params:
+            if (
+                param.name
+                in ("loxone_miniserver_host", "loxone_username", "loxone_password")
+                and kwargs[param.name] is None
+            ):
+                raise click.MissingParameter(ctx=ctx, param=param)
+
     # Instantiate Importer
     importer = Importer()
 
@@ -298,19 +3311,122 @@ def cli(*args, **kwargs):
     importer.loxone_password = kwargs["loxone_password"]
     importer.ha_bridge_host = kwargs["ha_bridge_host"]
     importer.ha_bridge_port = kwargs["ha_bridge_port"]
+
+    # Handle optional options
+    if kwargs["actions_map"]:
+        importer.control_actions_map_path = kwargs["actions_map"]
+        try:
+            importer.get_control_actions_map()
+        except ValueError as e:
+            raise click.BadParameter(str(e), ctx=ctx, param_hint="'--actions-map'")
+    importer.room_filters = list(kwargs["room"])
+    importer.category_filters = list(kwargs["category"])
+    importer.type_filters = list(kwargs["control_type"])
+    importer.name_filters = list(kwargs["name"])
+    importer.request_timeout = kwargs["timeout"]
+    if not kwargs["no_cache"]:
+        importer.cache_dir = os.path.expanduser(kwargs["cache_dir"])
+    importer.ha_bridge_concurrency = kwargs["concurrency"]
+    importer.ha_bridge_fail_fast = kwargs["fail_fast"]
+    importer.ha_bridge_batch_size = kwargs["batch_size"]
+    importer.ha_bridge_retries = kwargs["retries"]
+    importer.ha_bridge_retry_backoff = kwargs["retry_backoff"]
+    importer.ha_bridge_replace = kwargs["replace"]
+    importer.loxone_verify_concurrency = kwargs["verify_concurrency"]
+    importer.loxone_verify_rate = kwargs["verify_rate"]
+    # Verification must not mark devices as known for the next import
+    importer.track_device_changes = kwargs["track_changes"] and not kwargs["verify"]
+    importer.journal_path = kwargs["journal"]
+    importer.journal_resume = kwargs["resume"]
+    if kwargs["adaptive_concurrency"]:
+        importer.ha_bridge_concurrency_controller = AdaptiveConcurrency(
+            kwargs["concurrency"], kwargs["latency_target"]
+        )
+    importer.pipeline_queue_size = kwargs["queue_size"]
+    importer.generation_processes = kwargs["processes"]
     importer.print_configuration()
 
+    if kwargs["replay"]:
+        importers = []
+    elif kwargs["config"]:
+        importers = importer.get_miniserver_importers(miniservers)
+    else:
+        importers = [importer]
+
     # Run Importer
-    click.echo("Retrieve visualisation structure file from Loxone MiniServer")
-    loxone_structure_file = importer.get_loxone_structure_file()
-    click.echo(
-        "Generate HA-Bridge devices configruation from visualisation structure file"
-    )
-    ha_bridge_devices_configuration = importer.generate_ha_bridge_devices_configuration(
-        loxone_structure_file
-    )
-    click.echo("Add devices over REST API into HA-Bridge server")
-    importer.add_devices_into_ha_bridge(ha_bridge_devices_configuration)
+    with contextlib.ExitStack() as stack:
+        if kwargs["profile"]:
+            stack.enter_context(profiled())
+        try:
+            if kwargs["replay"] and kwargs["engine"] == "async":
+                async_importer = AsyncImporter(importer)
+                async_importer.replay(kwargs["replay"], kwargs["sync"], click.echo)
+            elif kwargs["replay"]:
+                replay_ha_bridge_devices(
+                    importer, kwargs["replay"], kwargs["sync"], click.echo
+                )
+            elif kwargs["verify"]:
+                # Verification sends no request to HA-Bridge server,
+                # so it always runs on the sync engine
+                failures = verify_importers(
+                    importer, importers, kwargs["stream"], click.echo
+                )
+                if failures:
+                    raise click.ClickException(
+                        "{count} control(s) failed verification".format(
+                            count=len(failures)
+                        )
+                    )
+            elif kwargs["export"]:
+                # Exporting sends no request to HA-Bridge server,
+                # so it always runs on the sync engine
+                run_importers(
+                    importer,
+                    importers,
+                    stream=kwargs["stream"],
+                    echo=click.echo,
+                    export_path=kwargs["export"],
+                )
+            elif kwargs["watch"]:
+                # Watch mode always synchronises, so unchanged devices
+                # are not sent to HA-Bridge server again
+                errors = ()
+                if kwargs["engine"] == "async":
+                    run = partial(
+                        AsyncImporter(importer).run,
+                        importers,
+                        True,
+                        kwargs["stream"],
+                        click.echo,
+                    )
+                    errors = get_async_request_errors()
+                else:
+                    run = partial(
+                        run_importers,
+                        importer,
+                        importers,
+                        True,
+                        kwargs["stream"],
+                        click.echo,
+                    )
+                try:
+                    watch_importers(
+                        importers, run, kwargs["interval"], click.echo, errors=errors
+                    )
+                except KeyboardInterrupt:
+                    click.echo("Stop watching visualisation structure file")
+            elif kwargs["engine"] == "async":
+                async_importer = AsyncImporter(importer)
+                async_importer.run(
+                    importers, kwargs["sync"], kwargs["stream"], click.echo
+                )
+            else:
+                run_importers(
+                    importer, importers, kwargs["sync"], kwargs["stream"], click.echo
+                )
+        finally:
+            if kwargs["stats_json"]:
+                importer.statistics.write_json(kwargs["stats_json"])
 
 
 if __name__ == "__main__":
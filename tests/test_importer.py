@@ -1,17 +1,66 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
+import copy
+import datetime
+import gzip
+import io
 import json
 import os
+import subprocess
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 from unittest import mock
 
+import aiohttp
+import click
 import pytest
 import requests
+from aiohttp import web
 from click.testing import CliRunner
 from requests.exceptions import HTTPError, Timeout
 
-from importer import Importer, cli
+from importer import (
+    AdaptiveConcurrency,
+    AsyncImporter,
+    DeviceChanges,
+    Importer,
+    ImportJournal,
+    LazyModule,
+    LoxoneStructureFileStream,
+    RateLimiter,
+    Statistics,
+    SyncPlan,
+    UploadError,
+    backoff_delay,
+    cli,
+    export_ha_bridge_devices,
+    fetch_loxone_structure_files,
+    get_async_request_errors,
+    get_connect_request_errors,
+    get_retryable_request_errors,
+    is_retryable_error,
+    is_unprocessed_error,
+    iter_bounded,
+    iter_ordered,
+    iter_prefetched,
+    load_control_actions_map,
+    load_miniservers_configuration,
+    profiled,
+    push_devices_into_ha_bridge,
+    read_ha_bridge_devices,
+    replay_ha_bridge_devices,
+    run_importers,
+    verify_importers,
+    watch_importers,
+)
 
 FIXTURES_DIR = os.path.abspath("tests/fixtures")
 
@@ -37,6 +86,56 @@ def load_json_fixture_file(file_name):
     return json.loads(Path(json_file).read_text())
 
 
+class MiniServerStub(object):
+    """Test double for the HTTP endpoints of a Loxone MiniServer"""
+
+    def __init__(self, structure_file, last_modified="2018-01-01 15:30:45"):
+        self.structure_file = structure_file
+        self.last_modified = last_modified
+        self.unknown_controls = set()
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        path = url.split("/", 3)[3]
+        self.requests.append(path)
+        if path == "jdev/sps/LoxAPPversion3" and self.last_modified is not None:
+            json_data = {
+                "LL": {
+                    "control": "dev/sps/LoxAPPversion3",
+                    "value": self.last_modified,
+                    "Code": "200",
+                }
+            }
+        elif path == "data/LoxAPP3.json":
+            json_data = self.structure_file
+        elif path.startswith("jdev/sps/io/"):
+            uuid = path[len("jdev/sps/io/") :]
+            known = (
+                uuid in self.structure_file["controls"]
+                and uuid not in self.unknown_controls
+            )
+            json_data = {
+                "LL": {
+                    "control": "dev/sps/io/" + uuid,
+                    "value": "0",
+                    "Code": "200" if known else "500",
+                }
+            }
+        else:
+            return mock_requests_response(
+                status=requests.codes.not_found,
+                raise_for_status=HTTPError("NOT FOUND"),
+            )
+        mock_resp = mock_requests_response(status=requests.codes.ok)
+        mock_resp.json = mock.Mock(return_value=json.loads(json.dumps(json_data)))
+        mock_resp.content = json.dumps(json_data).encode("utf-8")
+        mock_resp.iter_content = lambda chunk_size: (
+            mock_resp.content[i : i + chunk_size]
+            for i in range(0, len(mock_resp.content), chunk_size)
+        )
+        return mock_resp
+
+
 @pytest.fixture(scope="function")
 def unconfigured_importer():
     return Importer()
@@ -90,6 +189,202 @@ class TestGetLoxoneStructureFile(object):
             configured_importer.get_loxone_structure_file()
 
 
+@pytest.mark.usefixtures("configured_importer")
+class TestGetLoxoneStructureFileCache(object):
+
+    @mock.patch("importer.requests.get")
+    def test_download_and_reuse(self, mock_get, configured_importer, tmp_path):
+        miniserver = MiniServerStub(load_json_fixture_file("LoxAPP3_1.json"))
+        mock_get.side_effect = miniserver.get
+        configured_importer.cache_dir = str(tmp_path)
+        first = configured_importer.get_loxone_structure_file()
+        second = configured_importer.get_loxone_structure_file()
+        assert first == second == miniserver.structure_file
+        assert miniserver.requests == [
+            "jdev/sps/LoxAPPversion3",
+            "data/LoxAPP3.json",
+            "jdev/sps/LoxAPPversion3",
+        ]
+        assert sorted(os.listdir(str(tmp_path))) == [
+            "192.168.1.2_80.LoxAPP3.json",
+            "192.168.1.2_80.LoxAPP3.json.version",
+        ]
+
+    @mock.patch("importer.requests.get")
+    def test_modified(self, mock_get, configured_importer, tmp_path):
+        miniserver = MiniServerStub({"lastModified": "1", "controls": {}})
+        mock_get.side_effect = miniserver.get
+        configured_importer.cache_dir = str(tmp_path)
+        configured_importer.get_loxone_structure_file()
+        miniserver.structure_file = {"lastModified": "2", "controls": {}}
+        miniserver.last_modified = "2"
+        actual = configured_importer.get_loxone_structure_file()
+        assert actual == miniserver.structure_file
+        assert miniserver.requests.count("data/LoxAPP3.json") == 2
+
+    @mock.patch("importer.requests.get")
+    def test_version_unavailable(self, mock_get, configured_importer, tmp_path):
+        miniserver = MiniServerStub({"controls": {}})
+        miniserver.last_modified = None
+        mock_get.side_effect = miniserver.get
+        configured_importer.cache_dir = str(tmp_path)
+        configured_importer.get_loxone_structure_file()
+        configured_importer.get_loxone_structure_file()
+        assert miniserver.requests.count("data/LoxAPP3.json") == 2
+        assert os.listdir(str(tmp_path)) == []
+
+    @pytest.mark.parametrize("stream", [False, True])
+    @mock.patch("importer.requests.get")
+    def test_unwritable(self, mock_get, stream, configured_importer, tmp_path):
+        miniserver = MiniServerStub(load_json_fixture_file("LoxAPP3_1.json"))
+        mock_get.side_effect = miniserver.get
+        (tmp_path / "file").write_text("")
+        configured_importer.cache_dir = str(tmp_path / "file" / "cache")
+        if stream:
+            with configured_importer.get_loxone_structure_file_stream() as actual:
+                controls = dict(actual.get("controls").items())
+        else:
+            controls = configured_importer.get_loxone_structure_file()["controls"]
+        assert controls == miniserver.structure_file["controls"]
+
+    @mock.patch("importer.requests.get")
+    def test_no_cache(self, mock_get, configured_importer):
+        miniserver = MiniServerStub({"controls": {}})
+        mock_get.side_effect = miniserver.get
+        configured_importer.get_loxone_structure_file()
+        assert miniserver.requests == ["data/LoxAPP3.json"]
+
+
+@pytest.mark.usefixtures("configured_importer")
+class TestGetLoxoneStructureFileStream(object):
+
+    @pytest.mark.parametrize("use_cache", [False, True])
+    @mock.patch("importer.requests.get")
+    def test_ok(self, mock_get, use_cache, configured_importer, tmp_path):
+        miniserver = MiniServerStub(load_json_fixture_file("LoxAPP3_1.json"))
+        mock_get.side_effect = miniserver.get
+        if use_cache:
+            configured_importer.cache_dir = str(tmp_path)
+        with configured_importer.get_loxone_structure_file_stream() as actual:
+            assert actual.get("rooms") == miniserver.structure_file["rooms"]
+            assert actual.get("cats") == miniserver.structure_file["cats"]
+            assert list(actual.get("controls").items()) == sorted(
+                miniserver.structure_file["controls"].items()
+            )
+        assert miniserver.requests[-1] == "data/LoxAPP3.json"
+        assert mock_get.call_args.kwargs["stream"] is True
+
+    @mock.patch("importer.requests.get")
+    def test_cached(self, mock_get, configured_importer, tmp_path):
+        miniserver = MiniServerStub(load_json_fixture_file("LoxAPP3_1.json"))
+        mock_get.side_effect = miniserver.get
+        configured_importer.cache_dir = str(tmp_path)
+        configured_importer.get_loxone_structure_file()
+        with configured_importer.get_loxone_structure_file_stream() as actual:
+            assert len(actual.get("controls")) == len(
+                miniserver.structure_file["controls"]
+            )
+        assert miniserver.requests.count("data/LoxAPP3.json") == 1
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 65536])
+    def test_scanner(self, chunk_size):
+        document = (
+            b' { "a" : [1, "x\\"]", {"b": null}] ,'
+            b' "controls": {"k\\u00e9": {"x": -1.5e3, "y": true}},'
+            b' "z": "\xc3\xa9" } '
+        )
+        stream = LoxoneStructureFileStream(io.BytesIO(document), chunk_size)
+        assert stream.get("a") == [1, 'x"]', {"b": None}]
+        assert stream.get("z") == "\u00e9"
+        assert stream.get("missing") is None
+        assert list(stream.get("controls").items()) == [
+            ("k\u00e9", {"x": -1500.0, "y": True})
+        ]
+
+
+def write_miniservers_configuration(tmp_path, miniservers):
+    config_file = tmp_path / "miniservers.json"
+    config_file.write_text(json.dumps({"miniservers": miniservers}))
+    return str(config_file)
+
+
+@pytest.mark.usefixtures("configured_importer")
+class TestMultipleMiniServers(object):
+
+    def test_load_miniservers_configuration(self, tmp_path):
+        config_file = write_miniservers_configuration(
+            tmp_path,
+            [
+                {"host": "192.168.1.2", "username": "u", "password": "p"},
+                {
+                    "name": "garage",
+                    "host": "192.168.1.4",
+                    "port": 8080,
+                    "username": "u",
+                    "password": "p",
+                },
+            ],
+        )
+        actual = load_miniservers_configuration(config_file)
+        assert [(m["name"], m["port"]) for m in actual] == [
+            ("192.168.1.2", 80),
+            ("garage", 8080),
+        ]
+
+    @pytest.mark.parametrize(
+        "miniservers",
+        [
+            [{"host": "192.168.1.2", "username": "u"}],
+            [
+                {"name": "a", "host": "192.168.1.2", "username": "u", "password": "p"},
+                {"name": "a", "host": "192.168.1.4", "username": "u", "password": "p"},
+            ],
+        ],
+    )
+    def test_load_invalid_miniservers_configuration(self, miniservers, tmp_path):
+        config_file = write_miniservers_configuration(tmp_path, miniservers)
+        with pytest.raises(ValueError):
+            load_miniservers_configuration(config_file)
+
+    @mock.patch("importer.requests.get")
+    def test_fetch_and_generate(self, mock_get, configured_importer):
+        miniservers = {
+            "192.168.1.2": MiniServerStub(load_json_fixture_file("LoxAPP3_1.json")),
+            "192.168.1.4": MiniServerStub(load_json_fixture_file("LoxAPP3_1.json")),
+        }
+        mock_get.side_effect = lambda url, **kwargs: miniservers[
+            url.split("/")[2].split(":")[0]
+        ].get(url, **kwargs)
+        importers = configured_importer.get_miniserver_importers(
+            [
+                {
+                    "name": name,
+                    "host": host,
+                    "port": 80,
+                    "username": "u",
+                    "password": "p",
+                }
+                for name, host in (("house", "192.168.1.2"), ("garage", "192.168.1.4"))
+            ]
+        )
+        loxone_structure_files = fetch_loxone_structure_files(importers)
+        assert loxone_structure_files == [
+            miniservers["192.168.1.2"].structure_file,
+            miniservers["192.168.1.4"].structure_file,
+        ]
+        house, garage = [
+            importer.generate_ha_bridge_devices_configuration(loxone_structure_file)
+            for importer, loxone_structure_file in zip(
+                importers, loxone_structure_files
+            )
+        ]
+        assert len(house) == len(garage) > 0
+        assert all(device["mapId"].startswith("house:") for device in house)
+        assert all(device["mapId"].startswith("garage:") for device in garage)
+        assert "http://u:p@192.168.1.4:80/" in garage[0]["onUrl"]
+        assert configured_importer.map_id_prefix == ""
+
+
 @pytest.mark.parametrize(
     "loxone_structure_file,loxone_controls",
     [
@@ -177,49 +472,1309 @@ class TestGenerateHaBridgeDevicesConfiguration(object):
         expected = load_json_fixture_file(ha_bridge_devices_configuration)
         assert actual == expected
 
+    @pytest.mark.parametrize(
+        "loxone_structure_file,ha_bridge_devices_configuration",
+        [
+            ("LoxAPP3_1.json", "LoxAPP3_1_ha_bridge.json"),
+            ("LoxAPP3_2.json", "LoxAPP3_2_ha_bridge.json"),
+        ],
+    )
+    def test_processes(
+        self,
+        loxone_structure_file,
+        ha_bridge_devices_configuration,
+        configured_importer,
+    ):
+        configured_importer.generation_processes = 2
+        configured_importer.generation_shard_size = 7
+        configured_importer.map_id_prefix = "a:"
+        serial_importer = copy.copy(configured_importer)
+        serial_importer.generation_processes = 1
+        expected = serial_importer.generate_ha_bridge_devices_configuration(
+            load_json_fixture_file(loxone_structure_file)
+        )
+        actual = configured_importer.generate_ha_bridge_devices_configuration(
+            load_json_fixture_file(loxone_structure_file)
+        )
+        assert actual == expected
+        assert len(actual) == len(
+            load_json_fixture_file(ha_bridge_devices_configuration)
+        )
+
+    def test_processes_in_producer_thread(self, configured_importer):
+        configured_importer.generation_processes = 2
+        configured_importer.generation_shard_size = 7
+        serial_importer = copy.copy(configured_importer)
+        serial_importer.generation_processes = 1
+        expected = serial_importer.generate_ha_bridge_devices_configuration(
+            load_json_fixture_file("LoxAPP3_1.json")
+        )
+        with mock.patch(
+            "concurrent.futures.ProcessPoolExecutor", wraps=ProcessPoolExecutor
+        ) as mock_executor:
+            actual = list(
+                iter_prefetched(
+                    configured_importer.iter_ha_bridge_devices_configuration(
+                        load_json_fixture_file("LoxAPP3_1.json")
+                    ),
+                    10,
+                )
+            )
+        assert actual == expected
+        # Forking while other threads run may copy locks held by them
+        mp_context = mock_executor.call_args.kwargs["mp_context"]
+        assert mp_context.get_start_method() == "spawn"
+
+    @pytest.mark.parametrize(
+        "filters,predicate",
+        [
+            (
+                {"room_filters": ["küche", "0a64f50e-0365-0019-0f00000000000000"]},
+                lambda control, room, cat: room in ("Küche", "Schlafzimmer"),
+            ),
+            (
+                {"category_filters": ["lights", "Jalousie"]},
+                lambda control, room, cat: cat in ("Beleuchtung", "Jalousie"),
+            ),
+            (
+                {"type_filters": ["jalousie", "Dimmer"]},
+                lambda control, room, cat: control["type"] in ("Jalousie", "Dimmer"),
+            ),
+            (
+                {"name_filters": ["deckenlicht*", "*Jalousie"]},
+                lambda control, room, cat: control["name"].startswith("Deckenlicht")
+                or control["name"].endswith("Jalousie"),
+            ),
+            (
+                {"room_filters": ["Wohnzimmer"], "category_filters": ["Steckdosen"]},
+                lambda control, room, cat: room == "Wohnzimmer" and cat == "Steckdosen",
+            ),
+            ({"room_filters": ["Keller"]}, lambda control, room, cat: False),
+        ],
+    )
+    def test_filters(self, filters, predicate, configured_importer):
+        loxone_structure_file = load_json_fixture_file("LoxAPP3_1.json")
+        rooms = loxone_structure_file["rooms"]
+        cats = loxone_structure_file["cats"]
+        selected = set(
+            uuid
+            for uuid, control in loxone_structure_file["controls"].items()
+            if predicate(
+                control,
+                rooms.get(control.get("room"), {}).get("name"),
+                cats.get(control.get("cat"), {}).get("name"),
+            )
+        )
+        expected = [
+            device
+            for device in load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+            if device["mapId"] in selected
+        ]
+        for name, values in filters.items():
+            setattr(configured_importer, name, values)
+        actual = configured_importer.generate_ha_bridge_devices_configuration(
+            loxone_structure_file
+        )
+        assert actual == expected
+
+    @pytest.mark.parametrize("processes", [1, 2])
+    def test_track_changes(self, processes, configured_importer, tmp_path):
+        configured_importer.cache_dir = str(tmp_path)
+        configured_importer.track_device_changes = True
+        configured_importer.generation_processes = processes
+        configured_importer.generation_shard_size = 10
+        expected = load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+
+        def generate(loxone_structure_file):
+            configured_importer.statistics = Statistics()
+            actual = configured_importer.generate_ha_bridge_devices_configuration(
+                loxone_structure_file
+            )
+            return actual, configured_importer.statistics.get_device_changes()
+
+        actual, changes = generate(load_json_fixture_file("LoxAPP3_1.json"))
+        assert actual == expected
+        assert changes.added == [device["mapId"] for device in expected]
+        assert (changes.changed, changes.removed, changes.unchanged) == ([], [], 0)
+        hashes_file = configured_importer.get_device_hashes_path()
+        assert os.stat(hashes_file).st_mode & 0o777 == 0o600
+        assert "secret" not in Path(hashes_file).read_text()
+
+        actual, changes = generate(load_json_fixture_file("LoxAPP3_1.json"))
+        assert actual == expected
+        assert (changes.added, changes.changed, changes.removed) == ([], [], [])
+        assert changes.unchanged == len(expected)
+
+        loxone_structure_file = load_json_fixture_file("LoxAPP3_1.json")
+        renamed, removed = expected[0]["mapId"], expected[1]["mapId"]
+        loxone_structure_file["controls"][renamed]["name"] = "Renamed"
+        del loxone_structure_file["controls"][removed]
+        actual, changes = generate(loxone_structure_file)
+        assert actual[0]["name"].startswith("Renamed")
+        assert actual[1:] == expected[2:]
+        assert (changes.added, changes.changed, changes.removed) == (
+            [],
+            [renamed],
+            [removed],
+        )
+        assert changes.unchanged == len(expected) - 2
+
+        configured_importer.loxone_password = "changed"
+        actual, changes = generate(loxone_structure_file)
+        assert all("player1:changed@" in device["onUrl"] for device in actual)
+        assert len(changes.changed) == len(expected) - 1
+
+    def test_track_changes_unwritable(self, configured_importer, tmp_path):
+        (tmp_path / "file").write_text("")
+        configured_importer.cache_dir = str(tmp_path / "file" / "cache")
+        configured_importer.track_device_changes = True
+        actual = configured_importer.generate_ha_bridge_devices_configuration(
+            load_json_fixture_file("LoxAPP3_1.json")
+        )
+        assert actual == load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+        changes = configured_importer.statistics.get_device_changes()
+        assert len(changes.added) == len(actual)
+
+    def test_changes_not_tracked_by_default(self, configured_importer, tmp_path):
+        configured_importer.cache_dir = str(tmp_path)
+        configured_importer.generate_ha_bridge_devices_configuration(
+            load_json_fixture_file("LoxAPP3_1.json")
+        )
+        assert configured_importer.statistics.get_device_changes() is None
+        assert os.listdir(str(tmp_path)) == []
+
+    def test_compiled_templates_match_serialized_urls(self, configured_importer):
+        configured_importer.loxone_password = 'sécret"/\\'
+        configured_importer.control_actions_map = {
+            "Dimmer": {"on": "on", "dim": "value", "off": "off"},
+            "Meter": None,
+        }
+        loxone_structure_file = {
+            "rooms": {},
+            "cats": {},
+            "controls": {
+                "1": {"name": "Light", "type": "Dimmer"},
+                "2": {"name": "Meter", "type": "Meter"},
+            },
+        }
+        actual = configured_importer.generate_ha_bridge_devices_configuration(
+            loxone_structure_file
+        )
+        assert len(actual) == 1
+        for key, action in (("onUrl", "on"), ("dimUrl", "value"), ("offUrl", "off")):
+            item = OrderedDict()
+            item["item"] = (
+                'http://player1:sécret"/\\@192.168.1.2:80/dev/sps/io/1/' + action
+            )
+            item["type"] = "httpDevice"
+            item["httpVerb"] = "GET"
+            item["contentType"] = "text/html"
+            assert actual[0][key] == json.dumps([item])
+
+    def test_iter_ha_bridge_devices_configuration(self, configured_importer):
+        actual = configured_importer.iter_ha_bridge_devices_configuration(
+            load_json_fixture_file("LoxAPP3_1.json")
+        )
+        assert isinstance(actual, types.GeneratorType)
+        assert list(actual) == load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+
+    @pytest.mark.parametrize(
+        "loxone_structure_file,ha_bridge_devices_configuration",
+        [
+            ("LoxAPP3_1.json", "LoxAPP3_1_ha_bridge.json"),
+            ("LoxAPP3_2.json", "LoxAPP3_2_ha_bridge.json"),
+        ],
+    )
+    def test_generate_ha_bridge_devices_configuration_from_stream(
+        self,
+        loxone_structure_file,
+        ha_bridge_devices_configuration,
+        configured_importer,
+    ):
+        json_file = os.path.join(FIXTURES_DIR, loxone_structure_file)
+        with LoxoneStructureFileStream(open(json_file, "rb"), 4096) as stream:
+            actual = configured_importer.generate_ha_bridge_devices_configuration(
+                stream
+            )
+        expected = load_json_fixture_file(ha_bridge_devices_configuration)
+        assert actual == expected
+
+
+@pytest.mark.usefixtures("configured_importer")
+class TestControlActionsMap(object):
+
+    @pytest.mark.parametrize(
+        "file_name,content",
+        [
+            (
+                "actions.json",
+                '{"Dimmer": {"on": "on", "dim": "${intensity.percent}", "off": "off"},'
+                ' "Switch": null, "Ventilation": {"on": "on", "off": "off"}}',
+            ),
+            (
+                "actions.yaml",
+                "Dimmer:\n  on: 'on'\n  dim: ${intensity.percent}\n  off: 'off'\n"
+                "Switch:\nVentilation: {on: 'on', 'off': 'off'}\n",
+            ),
+        ],
+    )
+    def test_generate(self, file_name, content, configured_importer, tmp_path):
+        path = tmp_path / file_name
+        path.write_text(content)
+        configured_importer.control_actions_map_path = str(path)
+        loxone_structure_file = {
+            "rooms": {},
+            "cats": {},
+            "controls": {
+                "1": {"name": "Light", "type": "Dimmer"},
+                "2": {"name": "Switch", "type": "Switch"},
+                "3": {"name": "Fan", "type": "Ventilation"},
+                "4": {"name": "Gate", "type": "Gate"},
+            },
+        }
+        actual = configured_importer.generate_ha_bridge_devices_configuration(
+            loxone_structure_file
+        )
+        assert [device["mapId"] for device in actual] == ["1", "3", "4"]
+        assert json.loads(actual[0]["dimUrl"])[0]["item"].endswith(
+            "/dev/sps/io/1/${intensity.percent}"
+        )
+        assert "dimUrl" not in actual[1]
+        assert json.loads(actual[2]["onUrl"])[0]["item"].endswith("/4/open")
+
+    @pytest.mark.parametrize(
+        "content,message",
+        [
+            ("[]", "must map control types"),
+            ('{"Switch": "pulse"}', "must be an object or null"),
+            ('{"Switch": {"on": "pulse"}}', 'missing action "off"'),
+            ('{"Switch": {"on": "a", "off": "b", "up": "c"}}', 'unknown action "up"'),
+            ('{"Switch": {"on": "", "off": "b"}}', "must be a non-empty string"),
+            ('{"Switch": {"on": 1, "off": "b"}}', "must be a non-empty string"),
+            ("{", "Expecting"),
+        ],
+    )
+    def test_invalid(self, content, message, tmp_path):
+        path = tmp_path / "actions.json"
+        path.write_text(content)
+        with pytest.raises(ValueError) as e:
+            load_control_actions_map(str(path))
+        assert message in str(e.value)
+
+    def test_unquoted_yaml_command(self, tmp_path):
+        path = tmp_path / "actions.yaml"
+        path.write_text("Switch:\n  on: yes\n  off: 'off'\n")
+        with pytest.raises(ValueError) as e:
+            load_control_actions_map(str(path))
+        assert 'Action "on" of control type "Switch"' in str(e.value)
+
+    def test_cached_by_modification_time(self, configured_importer, tmp_path):
+        path = tmp_path / "actions.json"
+        path.write_text('{"Switch": {"on": "on", "off": "off"}}')
+        os.utime(str(path), ns=(1, 1))
+        configured_importer.control_actions_map_path = str(path)
+        with mock.patch(
+            "importer.load_control_actions_map", wraps=load_control_actions_map
+        ) as mock_load:
+            compiled = configured_importer.compile_control_actions_map()
+            assert configured_importer.compile_control_actions_map() is compiled
+            assert mock_load.call_count == 1
+
+            path.write_text('{"Switch": {"on": "pulse", "off": "pulse"}}')
+            os.utime(str(path), ns=(2, 2))
+            recompiled = configured_importer.compile_control_actions_map()
+            assert mock_load.call_count == 2
+            assert recompiled["Switch"] != compiled["Switch"]
+
+            configured_importer.loxone_password = "changed"
+            assert configured_importer.compile_control_actions_map() is not recompiled
+            assert mock_load.call_count == 2
+
+
+def test_iter_ordered():
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        actual = list(
+            iter_ordered(
+                executor, lambda i: time.sleep(0.001 * (i % 3)) or i * 2, range(20), 4
+            )
+        )
+    assert actual == [i * 2 for i in range(20)]
+
+
+class TestIterPrefetched(object):
+
+    def test_ok(self):
+        actual = list(iter_prefetched(iter(range(1000)), 10))
+        assert actual == list(range(1000))
+
+    def test_error(self):
+        def items():
+            yield 1
+            raise ValueError("ERROR")
+
+        actual = iter_prefetched(items(), 10)
+        assert next(actual) == 1
+        with pytest.raises(ValueError):
+            next(actual)
+
+    def test_close(self):
+        produced = []
+
+        def items():
+            for i in range(1000):
+                produced.append(i)
+                yield i
+
+        actual = iter_prefetched(items(), 2)
+        assert next(actual) == 0
+        actual.close()
+        assert len(produced) < 1000
+
+    @mock.patch("importer.requests.Session")
+    def test_overlap_with_upload(self, mock_session, configured_importer):
+        first_post = threading.Event()
+
+        def post(url, json, timeout):
+            first_post.set()
+            return mock_requests_response(status=requests.codes.created)
+
+        def devices():
+            yield {"name": "1"}
+            assert first_post.wait(timeout=5)
+            yield {"name": "2"}
+
+        mock_session.return_value.post.side_effect = post
+        configured_importer.add_devices_into_ha_bridge(iter_prefetched(devices(), 10))
+        assert mock_session.return_value.post.call_count == 2
+
+
+class TestStatistics(object):
+
+    def test_phases(self):
+        statistics = Statistics()
+        with statistics.phase("fetch"):
+            pass
+        assert list(statistics.timed("generate", iter(range(3)))) == [0, 1, 2]
+        assert list(statistics.to_dict()["phases"]) == ["fetch", "generate"]
+
+    def test_requests(self):
+        statistics = Statistics()
+        for latency in range(1, 101):
+            statistics.record_request(
+                "POST", "http://host:8080/api/devices", 201, latency / 1000.0, 10, 20
+            )
+        statistics.record_request(
+            "PUT", "http://host:8080/api/devices/42", 500, 0.5, 5, 0
+        )
+        actual = statistics.to_dict()
+        post = actual["requests"]["POST /api/devices"]
+        assert post["count"] == 100
+        assert post["latency"]["p50"] == 0.05
+        assert post["latency"]["p95"] == 0.095
+        assert post["latency"]["p99"] == 0.099
+        assert post["latency"]["max"] == 0.1
+        assert actual["requests"]["PUT /api/devices/{id}"]["errors"] == 1
+        assert actual["bytes_sent"] == 1005
+        assert actual["bytes_received"] == 2000
+
+    def test_device_changes(self):
+        statistics = Statistics()
+        assert "device_changes" not in statistics.to_dict()
+        statistics.record_device_changes("a", DeviceChanges(["1"], [], [], 2))
+        statistics.record_device_changes("b", DeviceChanges([], ["2"], ["3"], 1))
+        statistics.record_device_changes("a", DeviceChanges([], [], [], 3))
+        assert statistics.to_dict()["device_changes"] == {
+            "added": [],
+            "changed": ["2"],
+            "removed": ["3"],
+            "unchanged": 4,
+        }
+
+    def test_record_response(self):
+        statistics = Statistics()
+        r = requests.Response()
+        r.status_code = 201
+        r._content = b"[]"
+        r.elapsed = datetime.timedelta(milliseconds=20)
+        r.request = requests.Request(
+            "POST", "http://host:8080/api/devices", json={"name": "x"}
+        ).prepare()
+        statistics.record_response(r, stream=False)
+        actual = statistics.to_dict()["requests"]["POST /api/devices"]
+        assert actual["bytes_sent"] == len(b'{"name": "x"}')
+        assert actual["bytes_received"] == 2
+        assert actual["latency"]["max"] == 0.02
+
+    def test_profiled_threads(self):
+        def generate_in_thread():
+            return sum(range(1000))
+
+        output = io.StringIO()
+        with profiled(output):
+            thread = threading.Thread(target=generate_in_thread)
+            thread.start()
+            thread.join()
+        assert "generate_in_thread" in output.getvalue()
+        assert "Peak traced memory" in output.getvalue()
+
 
 @pytest.mark.usefixtures("configured_importer")
 class TestAddDevicesIntoHaBridge(object):
 
-    @mock.patch("importer.requests.post")
-    def test_ok(self, mock_post, configured_importer):
+    @mock.patch("importer.requests.Session")
+    def test_ok(self, mock_session, configured_importer):
         ha_bridge_devices_configuration = [{"key": "value"}]
         device_configuration = {"key": "value"}
         mock_resp = mock_requests_response(
             status=requests.codes.created, json_data='{"key": "value"}'
         )
-        mock_post.return_value = mock_resp
+        mock_session.return_value.post.return_value = mock_resp
         configured_importer.add_devices_into_ha_bridge(ha_bridge_devices_configuration)
         url = "http://192.168.1.3:8080/api/devices"
-        mock_post.assert_called_once_with(url, json=device_configuration, timeout=5)
+        mock_session.return_value.post.assert_called_once_with(
+            url, json=device_configuration, timeout=5
+        )
 
-    @mock.patch("importer.requests.post")
-    def test_internal_server_error(self, mock_post, configured_importer):
+    @mock.patch("importer.requests.Session")
+    def test_session_is_reused(self, mock_session, configured_importer):
+        ha_bridge_devices_configuration = [{"key": "value1"}, {"key": "value2"}]
+        mock_resp = mock_requests_response(status=requests.codes.created)
+        mock_session.return_value.post.return_value = mock_resp
+        configured_importer.add_devices_into_ha_bridge(ha_bridge_devices_configuration)
+        configured_importer.add_devices_into_ha_bridge(ha_bridge_devices_configuration)
+        mock_session.assert_called_once_with()
+        assert mock_session.return_value.post.call_count == 4
+
+    @mock.patch("importer.requests.Session")
+    def test_concurrent(self, mock_session, configured_importer):
+        ha_bridge_devices_configuration = [{"key": i} for i in range(20)]
+        mock_resp = mock_requests_response(status=requests.codes.created)
+        mock_session.return_value.post.return_value = mock_resp
+        configured_importer.ha_bridge_concurrency = 4
+        configured_importer.add_devices_into_ha_bridge(ha_bridge_devices_configuration)
+        actual = sorted(
+            c.kwargs["json"]["key"]
+            for c in mock_session.return_value.post.call_args_list
+        )
+        assert actual == list(range(20))
+
+    @mock.patch("importer.requests.Session")
+    def test_internal_server_error(self, mock_session, configured_importer):
         ha_bridge_devices_configuration = {"key": "value"}
         mock_resp = mock_requests_response(
             status=requests.codes.internal_server_error,
             raise_for_status=HTTPError("ERROR"),
         )
-        mock_post.return_value = mock_resp
+        mock_session.return_value.post.return_value = mock_resp
         with pytest.raises(HTTPError):
             configured_importer.add_devices_into_ha_bridge(
                 ha_bridge_devices_configuration
             )
 
-    @mock.patch("importer.requests.post")
-    def test_timeout(self, mock_post, configured_importer):
+    @mock.patch("importer.requests.Session")
+    def test_timeout(self, mock_session, configured_importer):
         ha_bridge_devices_configuration = {"key": "value"}
         mock_resp = mock_requests_response(
             status=None, raise_for_status=Timeout("TIMEOUT")
         )
-        mock_post.return_value = mock_resp
+        mock_session.return_value.post.return_value = mock_resp
         with pytest.raises(Timeout):
             configured_importer.add_devices_into_ha_bridge(
                 ha_bridge_devices_configuration
             )
 
+    @pytest.mark.parametrize("concurrency", [1, 4])
+    @mock.patch("importer.requests.Session")
+    def test_collect_all_errors(self, mock_session, concurrency, configured_importer):
+        ha_bridge_devices_configuration = [{"name": str(i)} for i in range(10)]
+
+        def post(url, json, timeout):
+            if json["name"] in ("3", "7"):
+                return mock_requests_response(
+                    status=requests.codes.internal_server_error,
+                    raise_for_status=HTTPError("ERROR"),
+                )
+            return mock_requests_response(status=requests.codes.created)
+
+        mock_session.return_value.post.side_effect = post
+        configured_importer.ha_bridge_concurrency = concurrency
+        configured_importer.ha_bridge_fail_fast = False
+        with pytest.raises(UploadError) as e:
+            configured_importer.add_devices_into_ha_bridge(
+                ha_bridge_devices_configuration
+            )
+        assert [index for index, _, _ in e.value.errors] == [3, 7]
+        assert mock_session.return_value.post.call_count == 10
+
+    @mock.patch("importer.requests.Session")
+    def test_batch(self, mock_session, configured_importer):
+        ha_bridge_devices_configuration = [{"name": str(i)} for i in range(5)]
+        mock_resp = mock_requests_response(status=requests.codes.created)
+        mock_session.return_value.post.return_value = mock_resp
+        configured_importer.ha_bridge_batch_size = 2
+        configured_importer.add_devices_into_ha_bridge(ha_bridge_devices_configuration)
+        actual = [
+            c.kwargs["json"] for c in mock_session.return_value.post.call_args_list
+        ]
+        expected = [
+            [{"name": "0"}, {"name": "1"}],
+            [{"name": "2"}, {"name": "3"}],
+            [{"name": "4"}],
+        ]
+        assert actual == expected
+
+    @mock.patch("importer.requests.Session")
+    def test_batch_failure_without_fallback(self, mock_session, configured_importer):
+        mock_session.return_value.post.side_effect = [
+            mock_requests_response(status=500, raise_for_status=http_error(500)),
+            mock_requests_response(status=requests.codes.created),
+        ]
+        configured_importer.ha_bridge_batch_size = 2
+        configured_importer.ha_bridge_fail_fast = False
+        with pytest.raises(UploadError) as e:
+            configured_importer.add_devices_into_ha_bridge(
+                [{"name": str(i)} for i in range(3)]
+            )
+        # HA-Bridge may have stored the batch, so it is not sent again
+        assert [index for index, _, _ in e.value.errors] == [0, 1]
+        assert mock_session.return_value.post.call_count == 2
+
+    @mock.patch("importer.requests.Session")
+    def test_batch_fallback(self, mock_session, configured_importer):
+        ha_bridge_devices_configuration = [{"name": str(i)} for i in range(4)]
+
+        def post(url, json, timeout):
+            devices = json if isinstance(json, list) else [json]
+            if {"name": "2"} in devices:
+                return mock_requests_response(
+                    status=requests.codes.bad_request,
+                    raise_for_status=http_error(requests.codes.bad_request),
+                )
+            return mock_requests_response(status=requests.codes.created)
+
+        mock_session.return_value.post.side_effect = post
+        configured_importer.ha_bridge_batch_size = 2
+        configured_importer.ha_bridge_fail_fast = False
+        with pytest.raises(UploadError) as e:
+            configured_importer.add_devices_into_ha_bridge(
+                ha_bridge_devices_configuration
+            )
+        assert [index for index, _, _ in e.value.errors] == [2]
+        actual = [
+            c.kwargs["json"] for c in mock_session.return_value.post.call_args_list
+        ]
+        expected = [
+            [{"name": "0"}, {"name": "1"}],
+            [{"name": "2"}, {"name": "3"}],
+            {"name": "2"},
+            {"name": "3"},
+        ]
+        assert actual == expected
+
+
+def ha_bridge_device(map_id, name, **kwargs):
+    device = {
+        "name": name,
+        "targetDevice": "Loxone",
+        "mapType": "httpDevice",
+        "mapId": map_id,
+    }
+    device.update(kwargs)
+    return device
+
+
+def http_error(status):
+    return HTTPError("ERROR", response=mock_requests_response(status=status))
+
+
+class TestLazyModule(object):
+
+    def test_backends_are_not_imported_on_startup(self):
+        actual = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, importer; "
+                "print(sorted(set(sys.modules) & "
+                "{'requests', 'asyncio', 'json', 'multiprocessing'}))",
+            ],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True,
+        )
+        assert actual.stdout.strip() == "[]"
+
+    def test_patch(self):
+        module = LazyModule("json")
+        with mock.patch.object(module, "dumps", return_value="patched"):
+            assert module.dumps({}) == "patched"
+            assert module.loads("{}") == {}
+            assert module.dumps({}) == "patched"
+        assert module.dumps({}) == "{}"
+
+
+class TestAdaptiveConcurrency(object):
+
+    def test_slow_start(self):
+        controller = AdaptiveConcurrency(maximum=8, latency_target=1)
+        for _ in range(5):
+            controller.record(0, 0.1)
+        assert controller.current() == 6
+        for _ in range(5):
+            controller.record(0, 0.1)
+        assert controller.current() == 8
+
+    def test_decrease_once_per_round_trip(self):
+        controller = AdaptiveConcurrency(maximum=32, latency_target=1, initial=16)
+        started = controller.decreased_at
+        controller.record(started, 2)
+        assert controller.current() == 8
+        controller.record(started, 0, congested=True)
+        assert controller.current() == 8
+        controller.record(controller.decreased_at, 0, congested=True)
+        assert controller.current() == 4
+        controller.record(controller.decreased_at, 0, congested=True)
+        controller.record(controller.decreased_at, 0, congested=True)
+        controller.record(controller.decreased_at, 0, congested=True)
+        assert controller.current() == 1
+
+    def test_additive_increase(self):
+        controller = AdaptiveConcurrency(maximum=32, latency_target=1, initial=8)
+        controller.record(0, 2)
+        for _ in range(4):
+            controller.record(0, 0.1)
+        assert controller.current() == 4
+        for _ in range(4):
+            controller.record(0, 0.1)
+        assert controller.current() == 5
+
+    def test_iter_bounded(self):
+        controller = AdaptiveConcurrency(maximum=8, latency_target=1, initial=2)
+        controller.record(0, 0, congested=True)
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def function(item):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            time.sleep(0.001)
+            with lock:
+                in_flight[0] -= 1
+            return item
+
+        actual = iter_bounded(function, range(20), 8, controller)
+        assert sorted(result for _, _, result, _ in actual) == list(range(20))
+        assert in_flight[1] == 1
+
+
+class TestRetry(object):
+
+    @pytest.mark.parametrize(
+        "error,expected",
+        [
+            (Timeout("TIMEOUT"), True),
+            (requests.exceptions.ConnectionError("RESET"), True),
+            (http_error(503), True),
+            (http_error(429), True),
+            (http_error(400), False),
+            (HTTPError("ERROR"), False),
+            (ValueError("ERROR"), False),
+        ],
+    )
+    def test_is_retryable_error(self, error, expected):
+        assert is_retryable_error(error, get_retryable_request_errors()) == expected
+
+    def test_is_unprocessed_error(self):
+        try:
+            requests.post("http://127.0.0.1:1/api/devices", timeout=1)
+        except requests.exceptions.ConnectionError as error:
+            refused = error
+        connect_errors = get_connect_request_errors()
+        assert is_unprocessed_error(refused, connect_errors)
+        assert is_unprocessed_error(
+            requests.exceptions.ConnectTimeout(), connect_errors
+        )
+        assert is_unprocessed_error(http_error(503), connect_errors)
+        assert is_unprocessed_error(http_error(429), connect_errors)
+        assert not is_unprocessed_error(http_error(500), connect_errors)
+        assert not is_unprocessed_error(Timeout("TIMEOUT"), connect_errors)
+        assert not is_unprocessed_error(
+            requests.exceptions.ConnectionError("RESET"), connect_errors
+        )
+
+    def test_get_ha_bridge_retry_delay(self, configured_importer):
+        configured_importer.ha_bridge_retries = 1
+        configured_importer.ha_bridge_concurrency_controller = AdaptiveConcurrency(
+            maximum=4, latency_target=1, initial=4
+        )
+        errors = get_retryable_request_errors()
+        for error in (Timeout("TIMEOUT"), http_error(503)):
+            assert (
+                configured_importer.get_ha_bridge_retry_delay(0, 0, error, errors)
+                is not None
+            )
+        assert configured_importer.ha_bridge_concurrency_controller.current() == 2
+        assert (
+            configured_importer.get_ha_bridge_retry_delay(
+                1, 0, Timeout("TIMEOUT"), errors
+            )
+            is None
+        )
+        assert (
+            configured_importer.get_ha_bridge_retry_delay(0, 0, http_error(400), errors)
+            is None
+        )
+
+    def test_get_failed_batch_outcomes(self, configured_importer):
+        batch = [(0, "a"), (1, "b")]
+        error = http_error(500)
+        assert configured_importer.get_failed_batch_outcomes(batch, error) == [
+            (0, "a", error),
+            (1, "b", error),
+        ]
+        assert (
+            configured_importer.get_failed_batch_outcomes(batch, http_error(400))
+            is None
+        )
+
+    def test_backoff_delay(self):
+        assert all(0 <= backoff_delay(0, 0.5, 30) <= 0.5 for _ in range(100))
+        assert all(0 <= backoff_delay(3, 0.5, 30) <= 4 for _ in range(100))
+        assert all(0 <= backoff_delay(10, 0.5, 30) <= 30 for _ in range(100))
+
+    @mock.patch("importer.time.sleep")
+    @mock.patch("importer.requests.Session")
+    def test_retry_add(self, mock_session, mock_sleep, configured_importer):
+        configured_importer.ha_bridge_retries = 2
+        configured_importer.ha_bridge_concurrency_controller = AdaptiveConcurrency(
+            maximum=4, latency_target=1, initial=4
+        )
+        mock_session.return_value.post.side_effect = [
+            Timeout("TIMEOUT"),
+            mock_requests_response(status=503, raise_for_status=http_error(503)),
+            mock_requests_response(status=requests.codes.created),
+        ]
+        mock_session.return_value.get.return_value = mock_requests_response(
+            json_data=[ha_bridge_device("2", "other", id="1")]
+        )
+        configured_importer.add_devices_into_ha_bridge([ha_bridge_device("1", "1")])
+        assert mock_session.return_value.post.call_count == 3
+        # Only the timeout may have created the device, the 503 did not
+        mock_session.return_value.get.assert_called_once()
+        assert mock_sleep.call_count == 2
+        assert configured_importer.ha_bridge_concurrency_controller.current() < 4
+
+    @mock.patch("importer.time.sleep")
+    @mock.patch("importer.requests.Session")
+    def test_retries_exhausted(self, mock_session, mock_sleep, configured_importer):
+        configured_importer.ha_bridge_retries = 2
+        mock_session.return_value.post.side_effect = Timeout("TIMEOUT")
+        mock_session.return_value.get.return_value = mock_requests_response(
+            json_data=[ha_bridge_device("2", "other", id="1")]
+        )
+        with pytest.raises(Timeout):
+            configured_importer.add_devices_into_ha_bridge([ha_bridge_device("1", "1")])
+        assert mock_session.return_value.post.call_count == 3
+
+    @pytest.mark.parametrize("batch_size", [1, 3])
+    @mock.patch("importer.time.sleep")
+    @mock.patch("importer.requests.Session")
+    def test_no_duplicate_after_lost_response(
+        self, mock_session, mock_sleep, batch_size, configured_importer, tmp_path
+    ):
+        ha_bridge = HaBridgeSessionStub(lost_responses=1)
+        mock_session.return_value = ha_bridge
+        configured_importer.ha_bridge_retries = 2
+        configured_importer.ha_bridge_batch_size = batch_size
+        configured_importer.journal_path = str(tmp_path / "journal")
+        devices = [ha_bridge_device(str(i), str(i)) for i in range(3)]
+        configured_importer.add_devices_into_ha_bridge(devices)
+        assert sorted(d["mapId"] for d in ha_bridge.devices.values()) == ["0", "1", "2"]
+        assert ("GET", "http://192.168.1.3:8080/api/devices") in ha_bridge.requests
+
+    @mock.patch("importer.time.sleep")
+    @mock.patch("importer.requests.Session")
+    def test_no_retry_on_client_error(
+        self, mock_session, mock_sleep, configured_importer
+    ):
+        configured_importer.ha_bridge_retries = 2
+        mock_session.return_value.put.return_value = mock_requests_response(
+            status=400, raise_for_status=http_error(400)
+        )
+        with pytest.raises(HTTPError):
+            configured_importer.sync_devices_into_ha_bridge(
+                SyncPlan([], [{"id": "1", "name": "x"}], [], 0)
+            )
+        mock_session.return_value.put.assert_called_once()
+        mock_sleep.assert_not_called()
+
+
+@pytest.mark.usefixtures("configured_importer")
+class TestSyncDevicesIntoHaBridge(object):
+
+    def test_plan(self, configured_importer):
+        ha_bridge_devices_configuration = [
+            ha_bridge_device("1", "unchanged"),
+            ha_bridge_device("2", "renamed"),
+            ha_bridge_device("3", "new"),
+        ]
+        ha_bridge_devices = [
+            ha_bridge_device("1", "unchanged", id="10", inactive=False),
+            ha_bridge_device("2", "old name", id="20", inactive=True),
+            ha_bridge_device("2", "duplicate", id="21"),
+            ha_bridge_device("4", "removed", id="40"),
+            {"id": "50", "name": "foreign", "mapId": "4", "mapType": "hueDevice"},
+        ]
+        actual = configured_importer.plan_ha_bridge_devices_sync(
+            ha_bridge_devices_configuration, ha_bridge_devices
+        )
+        assert actual.create == [ha_bridge_device("3", "new")]
+        assert actual.update == [
+            ha_bridge_device("2", "renamed", id="20", inactive=True)
+        ]
+        assert [device["id"] for device in actual.delete] == ["21", "40"]
+        assert actual.unchanged == 1
+
+    @mock.patch("importer.requests.Session")
+    def test_sync(self, mock_session, configured_importer):
+        session = mock_session.return_value
+        session.post.return_value = mock_requests_response(
+            status=requests.codes.created
+        )
+        session.put.return_value = mock_requests_response(status=requests.codes.ok)
+        session.delete.return_value = mock_requests_response(status=requests.codes.ok)
+        sync_plan = SyncPlan(
+            [ha_bridge_device("3", "new")],
+            [ha_bridge_device("2", "renamed", id="20")],
+            [ha_bridge_device("4", "removed", id="40")],
+            1,
+        )
+        configured_importer.sync_devices_into_ha_bridge(sync_plan)
+        url = "http://192.168.1.3:8080/api/devices"
+        session.post.assert_called_once_with(
+            url, json=ha_bridge_device("3", "new"), timeout=5
+        )
+        session.put.assert_called_once_with(
+            url + "/20", json=ha_bridge_device("2", "renamed", id="20"), timeout=5
+        )
+        session.delete.assert_called_once_with(url + "/40", timeout=5)
+
+    @mock.patch("importer.requests.Session")
+    def test_replace(self, mock_session, configured_importer):
+        existing = [ha_bridge_device(str(i), "old", id=str(i)) for i in range(10)] + [
+            {"id": "hue", "name": "Hue", "mapType": "hueDevice"}
+        ]
+        ha_bridge = HaBridgeSessionStub(existing)
+        ha_bridge.next_id = 100
+        mock_session.return_value = ha_bridge
+        configured_importer.ha_bridge_concurrency = 4
+        configured_importer.ha_bridge_replace = True
+        devices = [ha_bridge_device("new", "new")]
+        echo = mock.Mock()
+
+        push_devices_into_ha_bridge(configured_importer, iter(devices), echo=echo)
+
+        methods = [method for method, _ in ha_bridge.requests]
+        assert methods == ["GET"] + ["DELETE"] * 10 + ["POST"]
+        assert list(ha_bridge.devices) == ["hue", "100"]
+        echo.assert_any_call(
+            "Delete 10 previously imported devices over REST API from HA-Bridge server"
+        )
+
+    @mock.patch("importer.requests.Session")
+    def test_get_ha_bridge_devices(self, mock_session, configured_importer):
+        expected = [ha_bridge_device("1", "device", id="10")]
+        mock_session.return_value.get.return_value = mock_requests_response(
+            status=requests.codes.ok, json_data=expected
+        )
+        actual = configured_importer.get_ha_bridge_devices()
+        assert actual == expected
+        mock_session.return_value.get.assert_called_once_with(
+            "http://192.168.1.3:8080/api/devices", timeout=5
+        )
+
+
+class HaBridgeSessionStub(object):
+    """Test double for a requests session to the HA-Bridge devices REST API"""
+
+    def __init__(self, devices=(), timeout_after=None, lost_responses=0):
+        self.devices = OrderedDict((device["id"], device) for device in devices)
+        self.timeout_after = timeout_after
+        self.lost_responses = lost_responses
+        self.requests = []
+        self.next_id = 1
+        self.hooks = {"response": []}
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def response(self, status, json_data):
+        mock_resp = mock_requests_response(status=status)
+        mock_resp.content = json.dumps(json_data).encode("utf-8")
+        mock_resp.json = mock.Mock(return_value=json.loads(mock_resp.content))
+        return mock_resp
+
+    def get(self, url, **kwargs):
+        self.requests.append(("GET", url))
+        return self.response(requests.codes.ok, list(self.devices.values()))
+
+    def post(self, url, json, **kwargs):
+        self.requests.append(("POST", url))
+        if self.timeout_after is not None and len(self.devices) >= self.timeout_after:
+            raise Timeout("TIMEOUT")
+        added_devices = []
+        for device in json if isinstance(json, list) else [json]:
+            device = dict(device, id=str(self.next_id))
+            self.next_id += 1
+            self.devices[device["id"]] = device
+            added_devices.append(device)
+        if self.lost_responses:
+            self.lost_responses -= 1
+            raise Timeout("READ TIMEOUT")
+        return self.response(requests.codes.created, added_devices)
+
+    def put(self, url, json, **kwargs):
+        self.requests.append(("PUT", url))
+        self.devices[json["id"]] = json
+        return self.response(requests.codes.ok, json)
+
+    def delete(self, url, **kwargs):
+        self.requests.append(("DELETE", url))
+        del self.devices[url.rsplit("/", 1)[1]]
+        return self.response(requests.codes.ok, {})
+
+
+class TestImportJournal(object):
+
+    def test_flush_in_batches(self, tmp_path):
+        path = tmp_path / "journal.jsonl"
+        with ImportJournal(str(path), flush_size=2) as journal:
+            journal.record("a", "1")
+            assert path.read_text() == ""
+            journal.record("b", "2")
+            assert len(path.read_text().splitlines()) == 2
+            journal.record("c", None)
+        assert [json.loads(line) for line in path.read_text().splitlines()] == [
+            {"mapId": "a", "id": "1"},
+            {"mapId": "b", "id": "2"},
+            {"mapId": "c", "id": None},
+        ]
+
+    def test_resume_after_torn_write(self, tmp_path):
+        path = tmp_path / "journal.jsonl"
+        path.write_text('{"mapId": "a", "id": "1"}\n{"mapId": "b", "i')
+        with ImportJournal(str(path), resume=True) as journal:
+            assert "a" in journal
+            assert "b" not in journal
+            journal.record("b", "2")
+        with ImportJournal(str(path), resume=True) as journal:
+            assert journal.devices == {"a": "1", "b": "2"}
+        with ImportJournal(str(path)) as journal:
+            assert len(journal) == 0
+        assert path.read_text() == ""
+
+    @pytest.mark.parametrize("batch_size", [1, 2])
+    @mock.patch("importer.requests.Session")
+    def test_resume(self, mock_session, batch_size, configured_importer, tmp_path):
+        ha_bridge = HaBridgeSessionStub(timeout_after=3)
+        mock_session.return_value = ha_bridge
+        devices = [ha_bridge_device(str(i), "device {i}".format(i=i)) for i in range(6)]
+        configured_importer.ha_bridge_batch_size = batch_size
+        configured_importer.journal_path = str(tmp_path / "journal.jsonl")
+        with pytest.raises(Timeout):
+            configured_importer.add_devices_into_ha_bridge(devices)
+        journal = ImportJournal(configured_importer.journal_path, resume=True)
+        journal.close()
+        assert sorted(journal.devices.items()) == [
+            (device["mapId"], device["id"]) for device in ha_bridge.devices.values()
+        ]
+
+        ha_bridge.timeout_after = None
+        configured_importer.journal_resume = True
+        configured_importer.add_devices_into_ha_bridge(devices)
+        assert sorted(device["mapId"] for device in ha_bridge.devices.values()) == [
+            device["mapId"] for device in devices
+        ]
+        assert not os.path.exists(configured_importer.journal_path)
+
+    def test_resume_async(self, configured_importer, tmp_path):
+        devices = load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+        journal_path = tmp_path / "journal.jsonl"
+        journal_path.write_text(
+            "".join(
+                json.dumps({"mapId": device["mapId"], "id": None}) + "\n"
+                for device in devices[:10]
+            )
+        )
+        configured_importer.journal_path = str(journal_path)
+        configured_importer.journal_resume = True
+        stub = run_async_importer(configured_importer, {})
+        assert sorted(device["mapId"] for device in stub.devices.values()) == sorted(
+            device["mapId"] for device in devices[10:]
+        )
+        assert not journal_path.exists()
+
+    def test_fail_fast_async(self, configured_importer, tmp_path):
+        configured_importer.ha_bridge_concurrency = 4
+        configured_importer.journal_path = str(tmp_path / "journal.jsonl")
+
+        async def run(stub):
+            async with stub:
+                configured_importer.loxone_miniserver_host = "127.0.0.1"
+                configured_importer.loxone_miniserver_port = stub.port
+                configured_importer.ha_bridge_host = "127.0.0.1"
+                configured_importer.ha_bridge_port = stub.port
+                await AsyncImporter(configured_importer).import_devices(
+                    [configured_importer]
+                )
+
+        stub = AsyncHaBridgeStub(
+            load_json_fixture_file("LoxAPP3_1.json"),
+            latency=0.05,
+            rejected_names=["Wandlicht links Gästezimmer"],
+        )
+        with pytest.raises(aiohttp.ClientResponseError):
+            asyncio.run(run(stub))
+        # Devices in flight at the error were stored and must be journaled
+        journal = ImportJournal(configured_importer.journal_path, resume=True)
+        journal.close()
+        assert len(stub.devices) > 0
+        assert sorted(journal.devices.items()) == sorted(
+            (device["mapId"], device["id"]) for device in stub.devices.values()
+        )
+
+
+@pytest.mark.usefixtures("configured_importer")
+class TestWatch(object):
+
+    @mock.patch("importer.time.sleep")
+    @mock.patch("importer.requests.Session")
+    @mock.patch("importer.requests.get")
+    def test_sync_on_change(
+        self, mock_get, mock_session, mock_sleep, configured_importer
+    ):
+        miniserver = MiniServerStub(load_json_fixture_file("LoxAPP3_1.json"))
+        mock_get.side_effect = miniserver.get
+        ha_bridge = HaBridgeSessionStub()
+        mock_session.return_value = ha_bridge
+
+        def modify(interval):
+            if mock_sleep.call_count == 2:
+                miniserver.last_modified = "2018-01-02 10:00:00"
+                control = next(iter(miniserver.structure_file["controls"].values()))
+                control["name"] = "Renamed"
+
+        mock_sleep.side_effect = modify
+        run = mock.Mock(
+            side_effect=lambda: run_importers(
+                configured_importer, [configured_importer], True, echo=mock.Mock()
+            )
+        )
+        watch_importers([configured_importer], run, 30, mock.Mock(), polls=4)
+
+        assert run.call_count == 2
+        mock_sleep.assert_called_with(30)
+        assert miniserver.requests.count("jdev/sps/LoxAPPversion3") == 4
+        assert miniserver.requests.count("data/LoxAPP3.json") == 2
+        expected = len(load_json_fixture_file("LoxAPP3_1_ha_bridge.json"))
+        methods = [method for method, _ in ha_bridge.requests]
+        assert methods.count("POST") == expected
+        assert methods.count("PUT") == 1
+        assert "DELETE" not in methods
+        assert any(
+            device["name"].startswith("Renamed")
+            for device in ha_bridge.devices.values()
+        )
+
+    @mock.patch("importer.time.sleep")
+    @mock.patch("importer.requests.get")
+    def test_retry_after_failure(self, mock_get, mock_sleep, configured_importer):
+        miniserver = MiniServerStub(load_json_fixture_file("LoxAPP3_1.json"))
+        mock_get.side_effect = miniserver.get
+        run = mock.Mock(side_effect=[UploadError([]), None])
+        watch_importers([configured_importer], run, 30, mock.Mock(), polls=3)
+        assert run.call_count == 2
+
+    @mock.patch("importer.time.sleep")
+    @mock.patch("importer.requests.get")
+    def test_async_engine_errors(self, mock_get, mock_sleep, configured_importer):
+        structure_file = load_json_fixture_file("LoxAPP3_1.json")
+        mock_get.side_effect = MiniServerStub(structure_file).get
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        stub = asyncio.run_coroutine_threadsafe(
+            AsyncHaBridgeStub(structure_file, server_errors=1).__aenter__(), loop
+        ).result()
+        try:
+            configured_importer.loxone_miniserver_host = "127.0.0.1"
+            configured_importer.loxone_miniserver_port = stub.port
+            configured_importer.ha_bridge_host = "127.0.0.1"
+            configured_importer.ha_bridge_port = stub.port
+            run = mock.Mock(
+                side_effect=partial(
+                    AsyncImporter(configured_importer).run,
+                    [configured_importer],
+                    True,
+                    echo=mock.Mock(),
+                )
+            )
+            watch_importers(
+                [configured_importer],
+                run,
+                30,
+                mock.Mock(),
+                polls=2,
+                errors=get_async_request_errors(),
+            )
+        finally:
+            asyncio.run_coroutine_threadsafe(stub.__aexit__(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+        assert run.call_count == 2
+        expected = load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+        assert len(stub.devices) == len(expected)
+
+    @mock.patch("importer.time.sleep")
+    @mock.patch("importer.requests.get")
+    def test_version_unavailable(self, mock_get, mock_sleep, configured_importer):
+        miniserver = MiniServerStub(load_json_fixture_file("LoxAPP3_1.json"), None)
+        mock_get.side_effect = miniserver.get
+        run = mock.Mock()
+        watch_importers([configured_importer], run, 30, mock.Mock(), polls=2)
+        run.assert_not_called()
+
+
+class TestVerify(object):
+
+    @mock.patch("importer.requests.Session")
+    @mock.patch("importer.requests.get")
+    def test_report_failures(
+        self, mock_get, mock_session, configured_importer, tmp_path
+    ):
+        miniserver = MiniServerStub(load_json_fixture_file("LoxAPP3_1.json"))
+        miniserver.unknown_controls.add("0399dc1f-6e35-11df-9d1defc088fafadd")
+        mock_get.side_effect = miniserver.get
+        mock_session.return_value.get.side_effect = miniserver.get
+        configured_importer.cache_dir = str(tmp_path)
+        configured_importer.loxone_verify_concurrency = 4
+        echo = mock.Mock()
+
+        failures = verify_importers(
+            configured_importer, [configured_importer], echo=echo
+        )
+
+        expected = len(load_json_fixture_file("LoxAPP3_1_ha_bridge.json"))
+        assert miniserver.requests.count("data/LoxAPP3.json") == 1
+        assert (
+            len([r for r in miniserver.requests if r.startswith("jdev/sps/io/")])
+            == expected
+        )
+        assert [f[1]["mapId"] for f in failures] == [
+            "0399dc1f-6e35-11df-9d1defc088fafadd"
+        ]
+        assert isinstance(failures[0][2], ValueError)
+        echo.assert_called_with(
+            "Verified {expected} controls, 1 failed".format(expected=expected)
+        )
+        assert mock_session.return_value.auth == ("player1", "secret")
+        assert not os.path.exists(configured_importer.get_device_hashes_path())
+
+    @mock.patch("importer.requests.Session")
+    def test_request_errors(self, mock_session, configured_importer):
+        configured_importer.map_id_prefix = "a:"
+        responses = {
+            "0": requests.exceptions.ConnectionError("refused"),
+            "1": mock_requests_response(
+                status=requests.codes.not_found,
+                raise_for_status=HTTPError("NOT FOUND"),
+            ),
+            "2": mock_requests_response(
+                json_data={"LL": {"value": "1", "Code": "200"}}
+            ),
+        }
+
+        # Controls are verified concurrently, so responses depend on the URL
+        def get(url, **kwargs):
+            response = responses[url.rsplit("/", 1)[1]]
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        mock_session.return_value.get.side_effect = get
+        devices = [ha_bridge_device("a:{i}".format(i=i), str(i)) for i in range(3)]
+
+        report = configured_importer.verify_loxone_controls(devices)
+
+        assert report.verified == 3
+        assert [(f[0], type(f[2])) for f in report.failures] == [
+            (0, requests.exceptions.ConnectionError),
+            (1, HTTPError),
+        ]
+        mock_session.return_value.get.assert_has_calls(
+            [
+                mock.call(
+                    "http://192.168.1.2:80/jdev/sps/io/{i}".format(i=i), timeout=5
+                )
+                for i in range(3)
+            ],
+            any_order=True,
+        )
+        assert mock_session.return_value.get.call_count == 3
+
+    def test_rate_limiter(self):
+        rate_limiter = RateLimiter(100)
+        start = time.monotonic()
+        threads = [threading.Thread(target=rate_limiter.wait) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert time.monotonic() - start >= 0.05
+
 
 @pytest.mark.usefixtures("cli_runner")
+class TestExportAndReplay(object):
+
+    @pytest.mark.parametrize("file_name", ["device.db", "device.db.gz"])
+    @pytest.mark.parametrize("chunk_size", [1, 65536])
+    def test_round_trip(self, file_name, chunk_size, tmp_path):
+        devices = load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+        path = str(tmp_path / file_name)
+        assert export_ha_bridge_devices(iter(devices), path) == len(devices)
+        exported = json.loads(
+            gzip.decompress(Path(path).read_bytes())
+            if file_name.endswith(".gz")
+            else Path(path).read_text()
+        )
+        assert [device["id"] for device in exported] == [
+            str(index) for index in range(1, len(devices) + 1)
+        ]
+        assert list(read_ha_bridge_devices(path, chunk_size)) == devices
+
+    def test_empty(self, tmp_path):
+        path = str(tmp_path / "device.db")
+        assert export_ha_bridge_devices([], path) == 0
+        assert json.loads(Path(path).read_text()) == []
+        assert list(read_ha_bridge_devices(path)) == []
+
+    @mock.patch("importer.requests.Session")
+    def test_replay(self, mock_session, configured_importer, tmp_path):
+        devices = load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+        path = str(tmp_path / "device.db.gz")
+        export_ha_bridge_devices(devices, path)
+        mock_session.return_value.post.return_value = mock_requests_response(
+            status=requests.codes.created
+        )
+        replay_ha_bridge_devices(configured_importer, path, echo=lambda _: None)
+        assert [
+            c.kwargs["json"] for c in mock_session.return_value.post.call_args_list
+        ] == devices
+
+
 class TestCommandLineInterface(object):
 
     def test_no_parameter(self, cli_runner):
@@ -235,6 +1790,8 @@ class TestCommandLineInterface(object):
 
     @mock.patch("importer.Importer", autospec=True)
     def test_with_mandatory_parameter(self, mock_importer, cli_runner):
+        # Importer.__init__ creates the statistics, autospec does not
+        mock_importer.return_value.statistics = Statistics()
         actual = cli_runner.invoke(
             cli,
             [
@@ -253,3 +1810,550 @@ class TestCommandLineInterface(object):
             in actual.output
         )
         assert "Add devices over REST API into HA-Bridge" in actual.output
+
+    @mock.patch("importer.Importer", autospec=True)
+    def test_sync(self, mock_importer, cli_runner):
+        mock_importer.return_value.statistics = Statistics()
+        actual = cli_runner.invoke(
+            cli,
+            [
+                "--loxone-miniserver-host=192.168.1.2",
+                "--loxone-username=player1",
+                "--loxone-password=secret",
+                "--sync",
+            ],
+        )
+        assert actual.exit_code == 0
+        assert "Sync plan: 0 to create, 0 to update, 0 to delete" in actual.output
+        assert "Synchronise devices over REST API with HA-Bridge" in actual.output
+        mock_importer.return_value.sync_devices_into_ha_bridge.assert_called_once()
+
+    @mock.patch("importer.AsyncImporter", autospec=True)
+    @mock.patch("importer.Importer", autospec=True)
+    def test_async_engine(self, mock_importer, mock_async_importer, cli_runner):
+        actual = cli_runner.invoke(
+            cli,
+            [
+                "--loxone-miniserver-host=192.168.1.2",
+                "--loxone-username=player1",
+                "--loxone-password=secret",
+                "--engine=async",
+                "--timeout=2.5",
+            ],
+        )
+        assert actual.exit_code == 0
+        mock_async_importer.assert_called_once_with(mock_importer.return_value)
+        mock_async_importer.return_value.run.assert_called_once_with(
+            [mock_importer.return_value], False, False, click.echo
+        )
+        assert mock_importer.return_value.request_timeout == 2.5
+
+    @mock.patch("importer.Importer", autospec=True)
+    def test_stats_json_and_profile(self, mock_importer, cli_runner, tmp_path):
+        mock_importer.return_value.statistics = Statistics()
+        stats_file = str(tmp_path / "stats.json")
+        mock_importer.return_value.add_devices_into_ha_bridge.side_effect = list
+        actual = cli_runner.invoke(
+            cli,
+            [
+                "--loxone-miniserver-host=192.168.1.2",
+                "--loxone-username=player1",
+                "--loxone-password=secret",
+                "--stats-json",
+                stats_file,
+                "--profile",
+            ],
+        )
+        assert actual.exit_code == 0
+        assert "Peak traced memory" in actual.stderr
+        assert sorted(json.loads(Path(stats_file).read_text())["phases"]) == [
+            "add_devices_into_ha_bridge",
+            "generate_ha_bridge_devices_configuration",
+            "get_loxone_structure_file",
+        ]
+
+    @mock.patch("importer.requests.Session")
+    @mock.patch("importer.requests.get")
+    def test_config(self, mock_get, mock_session, cli_runner, tmp_path):
+        miniserver = MiniServerStub(load_json_fixture_file("LoxAPP3_1.json"))
+        mock_get.side_effect = miniserver.get
+        mock_session.return_value.post.return_value = mock_requests_response(
+            status=requests.codes.created
+        )
+        config_file = write_miniservers_configuration(
+            tmp_path,
+            [
+                {"name": "a", "host": "192.168.1.2", "username": "u", "password": "p"},
+                {"name": "b", "host": "192.168.1.2", "username": "u", "password": "p"},
+            ],
+        )
+        actual = cli_runner.invoke(cli, ["--config", config_file, "--no-cache"])
+        assert actual.exit_code == 0
+        expected = len(load_json_fixture_file("LoxAPP3_1_ha_bridge.json"))
+        map_ids = [
+            c.kwargs["json"]["mapId"]
+            for c in mock_session.return_value.post.call_args_list
+        ]
+        assert len(map_ids) == len(set(map_ids)) == 2 * expected
+
+    @mock.patch("importer.requests.Session")
+    @mock.patch("importer.requests.get")
+    def test_export_and_replay(self, mock_get, mock_session, cli_runner, tmp_path):
+        mock_get.side_effect = MiniServerStub(
+            load_json_fixture_file("LoxAPP3_1.json")
+        ).get
+        mock_session.return_value.post.return_value = mock_requests_response(
+            status=requests.codes.created
+        )
+        export_file = str(tmp_path / "device.db")
+        actual = cli_runner.invoke(
+            cli,
+            [
+                "--loxone-miniserver-host=192.168.1.2",
+                "--loxone-username=player1",
+                "--loxone-password=secret",
+                "--no-cache",
+                "--export",
+                export_file,
+            ],
+        )
+        assert actual.exit_code == 0
+        expected = load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+        assert "Exported {count} devices".format(count=len(expected)) in actual.output
+        mock_session.return_value.post.assert_not_called()
+
+        mock_get.reset_mock()
+        actual = cli_runner.invoke(cli, ["--replay", export_file])
+        assert actual.exit_code == 0
+        mock_get.assert_not_called()
+        assert [
+            c.kwargs["json"] for c in mock_session.return_value.post.call_args_list
+        ] == expected
+
+    @mock.patch("importer.Importer", autospec=True)
+    def test_filters(self, mock_importer, cli_runner):
+        mock_importer.return_value.statistics = Statistics()
+        actual = cli_runner.invoke(
+            cli,
+            [
+                "--loxone-miniserver-host=192.168.1.2",
+                "--loxone-username=player1",
+                "--loxone-password=secret",
+                "--room=Küche",
+                "--room=Bad OG",
+                "--category=lights",
+                "--type=Jalousie",
+                "--name=Decken*",
+            ],
+        )
+        assert actual.exit_code == 0
+        assert mock_importer.return_value.room_filters == ["Küche", "Bad OG"]
+        assert mock_importer.return_value.category_filters == ["lights"]
+        assert mock_importer.return_value.type_filters == ["Jalousie"]
+        assert mock_importer.return_value.name_filters == ["Decken*"]
+
+    @mock.patch("importer.watch_importers")
+    @mock.patch("importer.Importer", autospec=True)
+    def test_watch(self, mock_importer, mock_watch_importers, cli_runner):
+        actual = cli_runner.invoke(
+            cli,
+            [
+                "--loxone-miniserver-host=192.168.1.2",
+                "--loxone-username=player1",
+                "--loxone-password=secret",
+                "--watch",
+                "--interval=5",
+            ],
+        )
+        assert actual.exit_code == 0
+        importers, run, interval, _ = mock_watch_importers.call_args.args
+        assert importers == [mock_importer.return_value]
+        assert interval == 5
+        assert run.args[2] is True
+
+    def test_invalid_actions_map(self, cli_runner, tmp_path):
+        path = tmp_path / "actions.json"
+        path.write_text('{"Switch": {"on": "pulse"}}')
+        actual = cli_runner.invoke(
+            cli,
+            [
+                "--loxone-miniserver-host=192.168.1.2",
+                "--loxone-username=player1",
+                "--loxone-password=secret",
+                "--actions-map",
+                str(path),
+            ],
+        )
+        assert actual.exit_code == 2
+        assert 'Control type "Switch" is missing action "off"' in actual.output
+
+    @mock.patch("importer.requests.Session")
+    @mock.patch("importer.requests.get")
+    def test_verify(self, mock_get, mock_session, cli_runner):
+        miniserver = MiniServerStub(load_json_fixture_file("LoxAPP3_1.json"))
+        miniserver.unknown_controls.add("0399dc1f-6e35-11df-9d1defc088fafadd")
+        mock_get.side_effect = miniserver.get
+        mock_session.return_value.get.side_effect = miniserver.get
+        actual = cli_runner.invoke(
+            cli,
+            [
+                "--loxone-miniserver-host=192.168.1.2",
+                "--loxone-username=player1",
+                "--loxone-password=secret",
+                "--no-cache",
+                "--verify",
+                "--verify-rate=0",
+            ],
+        )
+        assert actual.exit_code == 1
+        assert (
+            'Control "0399dc1f-6e35-11df-9d1defc088fafadd" of device' in actual.output
+        )
+        assert "1 control(s) failed verification" in actual.output
+        mock_session.return_value.post.assert_not_called()
+
+    @pytest.mark.parametrize("option", ["--sync", "--watch", "--resume"])
+    def test_replace_exclusive(self, option, cli_runner):
+        actual = cli_runner.invoke(cli, ["--replace", "--journal=j", option])
+        assert actual.exit_code == 2
+        assert "Option --replace can not be combined" in actual.output
+
+    def test_resume_without_journal(self, cli_runner):
+        actual = cli_runner.invoke(cli, ["--resume"])
+        assert actual.exit_code == 2
+        assert "Option --resume requires --journal" in actual.output
+
+    @pytest.mark.parametrize("resume,exit_code", [(False, 2), (True, 0)])
+    @mock.patch("importer.Importer", autospec=True)
+    def test_existing_journal(
+        self, mock_importer, resume, exit_code, cli_runner, tmp_path
+    ):
+        mock_importer.return_value.statistics = Statistics()
+        journal_path = tmp_path / "journal.jsonl"
+        journal_path.write_text('{"mapId": "a", "id": "1"}\n')
+        args = [
+            "--loxone-miniserver-host=192.168.1.2",
+            "--loxone-username=player1",
+            "--loxone-password=secret",
+            "--journal={path}".format(path=journal_path),
+        ]
+        actual = cli_runner.invoke(cli, args + ["--resume"] if resume else args)
+        assert actual.exit_code == exit_code
+        assert ("add --resume to continue it" in actual.output) != resume
+        assert journal_path.read_text() == '{"mapId": "a", "id": "1"}\n'
+
+    def test_export_and_replay_exclusive(self, cli_runner, tmp_path):
+        replay_file = tmp_path / "device.db"
+        replay_file.write_text("[]")
+        actual = cli_runner.invoke(
+            cli, ["--export", "out.db", "--replay", str(replay_file)]
+        )
+        assert actual.exit_code == 2
+        assert "mutually exclusive" in actual.output
+
+    def test_export_and_sync_exclusive(self, cli_runner):
+        actual = cli_runner.invoke(cli, ["--export", "out.db", "--sync"])
+        assert actual.exit_code == 2
+        assert "Option --sync can not be combined with --export" in actual.output
+
+
+class AsyncHaBridgeStub(object):
+    """asyncio stub of HA-Bridge devices REST API which also serves
+    the visualisation structure file like a Loxone MiniServer"""
+
+    def __init__(
+        self,
+        structure_file,
+        devices=(),
+        latency=0,
+        rejected_names=(),
+        server_errors=0,
+        lost_responses=0,
+        structure_file_latency=0,
+    ):
+        self.structure_file = structure_file
+        self.structure_file_latency = structure_file_latency
+        self.structure_file_requests = 0
+        self.devices = {device["id"]: device for device in devices}
+        self.latency = latency
+        self.rejected_names = rejected_names
+        self.server_errors = server_errors
+        self.lost_responses = lost_responses
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.next_id = 1000
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/data/LoxAPP3.json", self.get_structure_file)
+        app.router.add_get("/jdev/sps/LoxAPPversion3", self.get_version)
+        app.router.add_get("/api/devices", self.get_devices)
+        app.router.add_post("/api/devices", self.add_devices)
+        app.router.add_put("/api/devices/{id}", self.update_device)
+        app.router.add_delete("/api/devices/{id}", self.delete_device)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *args):
+        await self.runner.cleanup()
+
+    async def handle(self, request, latency=None):
+        self.requests.append((request.method, request.path))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency if latency is None else latency)
+        finally:
+            self.in_flight -= 1
+
+    async def get_structure_file(self, request):
+        self.structure_file_requests += 1
+        await asyncio.sleep(self.structure_file_latency)
+        return web.json_response(self.structure_file)
+
+    async def get_version(self, request):
+        return web.json_response(
+            {
+                "LL": {
+                    "control": "dev/sps/LoxAPPversion3",
+                    "value": "2018-01-01 15:30:45",
+                    "Code": "200",
+                }
+            }
+        )
+
+    async def get_devices(self, request):
+        await self.handle(request)
+        return web.json_response(list(self.devices.values()))
+
+    async def add_devices(self, request):
+        payload = await request.json()
+        devices = payload if isinstance(payload, list) else [payload]
+        rejected = any(device["name"] in self.rejected_names for device in devices)
+        # Invalid devices are rejected before anything is stored
+        await self.handle(request, 0 if rejected else None)
+        if self.server_errors:
+            self.server_errors -= 1
+            return web.json_response({"message": "unavailable"}, status=503)
+        if rejected:
+            return web.json_response({"message": "rejected"}, status=400)
+        for device in devices:
+            device["id"] = str(self.next_id)
+            self.next_id += 1
+            self.devices[device["id"]] = device
+        if self.lost_responses:
+            self.lost_responses -= 1
+            await asyncio.sleep(1)
+        return web.json_response(devices, status=201)
+
+    async def update_device(self, request):
+        await self.handle(request)
+        self.devices[request.match_info["id"]] = await request.json()
+        return web.json_response(self.devices[request.match_info["id"]])
+
+    async def delete_device(self, request):
+        await self.handle(request)
+        del self.devices[request.match_info["id"]]
+        return web.json_response({})
+
+
+def run_async_importer(importer, stub_kwargs, sync=False, stream=False):
+    async def run():
+        async with AsyncHaBridgeStub(
+            load_json_fixture_file("LoxAPP3_1.json"), **stub_kwargs
+        ) as stub:
+            importer.loxone_miniserver_host = "127.0.0.1"
+            importer.loxone_miniserver_port = stub.port
+            importer.ha_bridge_host = "127.0.0.1"
+            importer.ha_bridge_port = stub.port
+            await AsyncImporter(importer).import_devices(
+                [importer], sync=sync, stream=stream
+            )
+            return stub
+
+    return asyncio.run(run())
+
+
+def expected_async_devices(port):
+    expected = load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+    for device in expected:
+        for key in ("onUrl", "offUrl"):
+            if key in device:
+                device[key] = device[key].replace(
+                    "192.168.1.2:80", "127.0.0.1:{port}".format(port=port)
+                )
+    return expected
+
+
+@pytest.mark.usefixtures("configured_importer")
+class TestAsyncImporter(object):
+
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_add(self, stream, configured_importer):
+        configured_importer.ha_bridge_concurrency = 8
+        stub = run_async_importer(configured_importer, {"latency": 0.01}, stream=stream)
+        actual = sorted(stub.devices.values(), key=lambda d: d["mapId"])
+        for device in actual:
+            del device["id"]
+        assert actual == expected_async_devices(stub.port)
+        assert 1 < stub.max_in_flight <= 8
+
+    def test_structure_files_in_parallel(self, configured_importer):
+        async def run():
+            async with AsyncHaBridgeStub(
+                load_json_fixture_file("LoxAPP3_1.json"), structure_file_latency=0.4
+            ) as stub:
+                configured_importer.ha_bridge_host = "127.0.0.1"
+                configured_importer.ha_bridge_port = stub.port
+                importers = configured_importer.get_miniserver_importers(
+                    [
+                        {
+                            "name": name,
+                            "host": "127.0.0.1",
+                            "port": stub.port,
+                            "username": "u",
+                            "password": "p",
+                        }
+                        for name in ("a", "b", "c")
+                    ]
+                )
+                start = time.perf_counter()
+                await AsyncImporter(configured_importer).import_devices(importers)
+                return stub, time.perf_counter() - start
+
+        # HA-Bridge concurrency 1 must not serialise the MiniServer downloads
+        stub, elapsed = asyncio.run(run())
+        assert stub.structure_file_requests == 3
+        assert elapsed < 1.0
+
+    def test_stream_into_cache(self, configured_importer, tmp_path):
+        configured_importer.cache_dir = str(tmp_path)
+
+        async def run():
+            async with AsyncHaBridgeStub(
+                load_json_fixture_file("LoxAPP3_1.json")
+            ) as stub:
+                configured_importer.loxone_miniserver_host = "127.0.0.1"
+                configured_importer.loxone_miniserver_port = stub.port
+                configured_importer.ha_bridge_host = "127.0.0.1"
+                configured_importer.ha_bridge_port = stub.port
+                for _ in range(2):
+                    await AsyncImporter(configured_importer).import_devices(
+                        [configured_importer], stream=True
+                    )
+                return stub
+
+        stub = asyncio.run(run())
+        assert stub.structure_file_requests == 1
+        assert len(stub.devices) == 2 * len(expected_async_devices(stub.port))
+        cache_file, _ = configured_importer.get_loxone_structure_file_cache_paths()
+        assert json.loads(Path(cache_file).read_text()) == load_json_fixture_file(
+            "LoxAPP3_1.json"
+        )
+
+    @pytest.mark.parametrize("stream", [False, True])
+    def test_unwritable_cache(self, stream, configured_importer, tmp_path):
+        (tmp_path / "file").write_text("")
+        configured_importer.cache_dir = str(tmp_path / "file" / "cache")
+        stub = run_async_importer(configured_importer, {}, stream=stream)
+        assert len(stub.devices) == len(expected_async_devices(stub.port))
+
+    def test_batch(self, configured_importer):
+        configured_importer.ha_bridge_batch_size = 10
+        stub = run_async_importer(configured_importer, {})
+        expected = expected_async_devices(stub.port)
+        assert len(stub.devices) == len(expected)
+        assert len(stub.requests) == (len(expected) + 9) // 10
+
+    def test_sync(self, configured_importer):
+        existing = load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+        for index, device in enumerate(existing):
+            device["id"] = str(index)
+        existing[0]["name"] = "renamed"
+        existing.append(dict(existing[1], id="duplicate"))
+        stub = run_async_importer(configured_importer, {"devices": existing}, True)
+        methods = [method for method, _ in stub.requests]
+        assert methods.count("GET") == 1
+        assert methods.count("PUT") == len(existing) - 1
+        assert methods.count("DELETE") == 1
+        assert "POST" not in methods
+
+    def test_replace(self, configured_importer):
+        configured_importer.ha_bridge_concurrency = 4
+        configured_importer.ha_bridge_replace = True
+        existing = [ha_bridge_device(str(i), "old", id=str(i)) for i in range(10)] + [
+            {"id": "hue", "name": "Hue", "mapType": "hueDevice"}
+        ]
+        stub = run_async_importer(configured_importer, {"devices": existing})
+        methods = [method for method, _ in stub.requests]
+        expected = expected_async_devices(stub.port)
+        assert methods.count("DELETE") == 10
+        assert methods.count("POST") == len(expected)
+        assert methods.index("POST") > methods.index("DELETE")
+        assert "hue" in stub.devices
+        assert len(stub.devices) == len(expected) + 1
+
+    @mock.patch("importer.random.uniform", return_value=0)
+    def test_no_duplicate_after_lost_response(self, mock_uniform, configured_importer):
+        configured_importer.ha_bridge_retries = 1
+        configured_importer.request_timeout = 0.3
+        configured_importer.ha_bridge_batch_size = 100
+        stub = run_async_importer(configured_importer, {"lost_responses": 1})
+        methods = [method for method, _ in stub.requests]
+        assert methods == ["POST", "GET"]
+        assert len(stub.devices) == len(expected_async_devices(stub.port))
+
+    def test_fail_fast(self, configured_importer):
+        with pytest.raises(aiohttp.ClientResponseError):
+            run_async_importer(
+                configured_importer, {"rejected_names": ["Wandlicht links Gästezimmer"]}
+            )
+
+    def test_collect_all_errors(self, configured_importer):
+        configured_importer.ha_bridge_concurrency = 4
+        configured_importer.ha_bridge_fail_fast = False
+        with pytest.raises(UploadError) as e:
+            run_async_importer(
+                configured_importer, {"rejected_names": ["Wandlicht links Gästezimmer"]}
+            )
+        assert [index for index, _, _ in e.value.errors] == [1]
+
+    def test_timeout(self, configured_importer):
+        configured_importer.request_timeout = 0.05
+        with pytest.raises(asyncio.TimeoutError):
+            run_async_importer(configured_importer, {"latency": 1})
+
+    def test_retry(self, configured_importer):
+        configured_importer.ha_bridge_concurrency = 8
+        configured_importer.ha_bridge_retries = 3
+        configured_importer.ha_bridge_retry_backoff = 0.001
+        configured_importer.ha_bridge_concurrency_controller = AdaptiveConcurrency(
+            maximum=8, latency_target=1
+        )
+        stub = run_async_importer(configured_importer, {"server_errors": 3})
+        expected = expected_async_devices(stub.port)
+        assert len(stub.devices) == len(expected)
+        assert len(stub.requests) == len(expected) + 3
+
+    def test_replay(self, configured_importer, tmp_path):
+        devices = load_json_fixture_file("LoxAPP3_1_ha_bridge.json")
+        path = str(tmp_path / "device.db")
+        export_ha_bridge_devices(devices, path)
+
+        async def run():
+            async with AsyncHaBridgeStub({}) as stub:
+                configured_importer.ha_bridge_host = "127.0.0.1"
+                configured_importer.ha_bridge_port = stub.port
+                await AsyncImporter(configured_importer).replay_devices(path)
+                return stub
+
+        stub = asyncio.run(run())
+        actual = sorted(stub.devices.values(), key=lambda d: d["mapId"])
+        for device in actual:
+            del device["id"]
+        assert actual == devices